@@ -57,6 +57,13 @@ class Config:
             "task_ignore_result": _get_bool_env("CELERY_TASK_IGNORE_RESULT"),
             "result_expires": int(_get_env("CELERY_RESULT_EXPIRES")),
             "broker_connection_retry_on_startup": _get_bool_env("CELERY_BROKER_CONNECTION_RETRY_ON_STARTUP"),
+            "imports": ["internal.schedule.retrieval_schedule"],
+            "beat_schedule": {
+                "flush-retrieval-accounting": {
+                    "task": "internal.schedule.retrieval_schedule.flush_retrieval_accounting",
+                    "schedule": float(os.getenv("RETRIEVAL_ACCOUNTING_FLUSH_INTERVAL", 10)),
+                },
+            },
         }
 
         # 辅助Agent应用id标识
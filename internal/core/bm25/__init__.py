@@ -0,0 +1,10 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+@Time    : 2024/12/23 15:18
+@Author  : thezehui@gmail.com
+@File    : __init__.py.py
+"""
+from .bm25_index import BM25Index, LayeredBM25Index, get_bm25_index, delete_bm25_index
+
+__all__ = ["BM25Index", "LayeredBM25Index", "get_bm25_index", "delete_bm25_index"]
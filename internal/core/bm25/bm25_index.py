@@ -0,0 +1,372 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+@Time    : 2024/12/23 15:20
+@Author  : thezehui@gmail.com
+@File    : bm25_index.py
+"""
+import json
+import os
+import shutil
+import time
+import uuid
+from collections import Counter
+from threading import Lock
+from typing import Optional
+
+import numpy as np
+
+# 索引目录中指向当前生效版本的文件名，第一行为主索引版本号，第二行为增量索引版本号(可选)
+CURRENT_FILE = "CURRENT"
+
+# 每个版本目录下存储的数组文件，均为.npy格式，加载时使用mmap共享操作系统页缓存
+ARRAY_FILES = ["terms", "indptr", "doc_ids", "term_freqs", "doc_lens", "segment_ids"]
+
+# 增量索引版本目录下额外存储的主索引屏蔽片段id文件
+REMOVED_FILE = "removed_ids"
+
+# 进程内已加载的索引，键为索引目录，值为 (版本号, 索引)，版本变化时重新加载
+_loaded_indexes: dict[str, tuple[str, "LayeredBM25Index"]] = {}
+_loaded_indexes_lock = Lock()
+
+# 片段id数组每行16字节，转换成该类型后可以整行比较
+_SEGMENT_ID_DTYPE = np.dtype((np.void, 16))
+
+
+class BM25Index:
+    """BM25全文索引，使用按词条组织的CSR数组存储倒排表(词条->片段下标+词频)，IDF及长度归一化因子在检索时按词条计算"""
+    terms: np.ndarray  # 排序后的词表，通过二分查找定位词条所在行
+    indptr: np.ndarray  # 第i个词条的倒排表为 doc_ids/term_freqs[indptr[i]:indptr[i+1]]，文档频率即倒排表长度
+    doc_ids: np.ndarray  # 倒排表中的片段下标
+    term_freqs: np.ndarray  # 倒排表中词条在片段内出现的次数
+    doc_lens: np.ndarray  # 每个片段的词条总数
+    segment_ids: np.ndarray  # 片段下标对应的片段id，每行为uuid的16字节
+
+    def __init__(self, arrays: dict[str, np.ndarray], k1: float = 1.5, b: float = 0.75):
+        """构造函数，传递索引数组及BM25参数"""
+        for name in ARRAY_FILES:
+            setattr(self, name, arrays[name])
+        self.k1 = k1
+        self.b = b
+
+    @classmethod
+    def empty(cls, k1: float = 1.5, b: float = 0.75) -> "BM25Index":
+        """创建一个不包含任何片段的空索引"""
+        return cls({
+            "terms": np.array([], dtype="<U1"),
+            "indptr": np.zeros(1, dtype=np.int64),
+            "doc_ids": np.array([], dtype=np.int32),
+            "term_freqs": np.array([], dtype=np.uint16),
+            "doc_lens": np.array([], dtype=np.int32),
+            "segment_ids": np.zeros((0, 16), dtype=np.uint8),
+        }, k1, b)
+
+    @property
+    def segment_count(self) -> int:
+        """索引中的片段数"""
+        return len(self.doc_lens)
+
+    def merge(self, added: dict[str, list[str]], removed: set[str]) -> "BM25Index":
+        """增量合并，移除removed中的片段后追加added中的片段(片段id->词条列表)，返回新的索引，原索引保持不变"""
+        # 1.将原有倒排表展开成 (词条, 片段下标, 词频) 三元组，并剔除被移除或者被重新添加的片段
+        removed_ids = {uuid.UUID(id).bytes for id in removed | set(added.keys())}
+        keep = np.array(
+            [segment_id.tobytes() not in removed_ids for segment_id in self.segment_ids], dtype=bool,
+        ) if removed_ids else np.ones(self.segment_count, dtype=bool)
+        doc_map = np.cumsum(keep, dtype=np.int64) - 1
+        term_rows = np.repeat(np.arange(len(self.terms), dtype=np.int64), np.diff(self.indptr))
+        posting_mask = keep[self.doc_ids]
+        term_rows, doc_ids = term_rows[posting_mask], doc_map[self.doc_ids[posting_mask]]
+        term_freqs = np.asarray(self.term_freqs[posting_mask], dtype=np.int64)
+
+        # 2.统计新增片段的词频，并将新增词条与原词表合并成新的排序词表
+        counters = [Counter(tokens) for tokens in added.values()]
+        new_terms = {term for counter in counters for term in counter}
+        terms = np.union1d(np.asarray(self.terms), np.array(sorted(new_terms), dtype=str)) if new_terms else np.asarray(
+            self.terms,
+        )
+        term_rows = np.searchsorted(terms, np.asarray(self.terms))[term_rows] if len(term_rows) else term_rows
+
+        # 3.追加新增片段的三元组
+        base = int(keep.sum())
+        added_rows, added_docs, added_freqs = [], [], []
+        for i, counter in enumerate(counters):
+            if not counter:
+                continue
+            added_rows.append(np.searchsorted(terms, np.array(list(counter.keys()), dtype=str)))
+            added_docs.append(np.full(len(counter), base + i, dtype=np.int64))
+            added_freqs.append(np.fromiter(counter.values(), dtype=np.int64, count=len(counter)))
+        if added_rows:
+            term_rows = np.concatenate([term_rows, *added_rows])
+            doc_ids = np.concatenate([doc_ids, *added_docs])
+            term_freqs = np.concatenate([term_freqs, *added_freqs])
+
+        # 4.剔除文档频率为0的词条，并按 (词条, 片段下标) 排序重建CSR数组
+        doc_freqs = np.bincount(term_rows, minlength=len(terms))
+        used = doc_freqs > 0
+        term_rows = (np.cumsum(used, dtype=np.int64) - 1)[term_rows]
+        terms, doc_freqs = terms[used], doc_freqs[used]
+        order = np.lexsort((doc_ids, term_rows))
+        indptr = np.concatenate([[0], np.cumsum(doc_freqs)]).astype(np.int64)
+
+        # 5.重新计算片段长度
+        doc_lens = np.concatenate([
+            np.asarray(self.doc_lens)[keep],
+            np.array([sum(counter.values()) for counter in counters], dtype=np.int32),
+        ]).astype(np.int32)
+        segment_ids = np.concatenate([
+            np.asarray(self.segment_ids)[keep],
+            np.array([list(uuid.UUID(id).bytes) for id in added.keys()], dtype=np.uint8).reshape(-1, 16),
+        ])
+
+        return BM25Index({
+            "terms": terms,
+            "indptr": indptr,
+            "doc_ids": doc_ids[order].astype(np.int32),
+            "term_freqs": np.minimum(term_freqs[order], np.iinfo(np.uint16).max).astype(np.uint16),
+            "doc_lens": doc_lens,
+            "segment_ids": segment_ids,
+        }, self.k1, self.b)
+
+    def to_tokens(self) -> dict[str, list[str]]:
+        """将索引还原成 片段id->词条列表(词条顺序不保留)，用于将增量索引合并回主索引，只应在较小的索引上调用"""
+        tokens = {str(uuid.UUID(bytes=segment_id.tobytes())): [] for segment_id in self.segment_ids}
+        segment_ids = list(tokens.keys())
+        term_rows = np.repeat(np.arange(len(self.terms), dtype=np.int64), np.diff(self.indptr))
+        for row, doc_id, term_freq in zip(term_rows, self.doc_ids, self.term_freqs):
+            tokens[segment_ids[doc_id]].extend([str(self.terms[row])] * int(term_freq))
+        return tokens
+
+    def search(self, query_terms: list[str], k: int) -> list[tuple[str, float]]:
+        """根据查询词条列表计算BM25得分，返回得分最高的前k个 (片段id, 得分)"""
+        return LayeredBM25Index(self, BM25Index.empty(self.k1, self.b)).search(query_terms, k)
+
+    def _lookup(self, query_terms: np.ndarray) -> np.ndarray:
+        """二分查找定位查询词条所在的行，不存在的词条返回-1"""
+        if len(self.terms) == 0:
+            return np.full(len(query_terms), -1, dtype=np.int64)
+        rows = np.searchsorted(self.terms, query_terms)
+        found = (rows < len(self.terms)) & (self.terms[np.minimum(rows, len(self.terms) - 1)] == query_terms)
+        return np.where(found, rows, -1)
+
+    def _doc_freqs(self, rows: np.ndarray, excluded: Optional[np.ndarray] = None) -> np.ndarray:
+        """获取词条所在行的文档频率，不存在的词条为0，excluded为需要排除的片段下标掩码"""
+        if len(self.terms) == 0:
+            return np.zeros(len(rows), dtype=np.int64)
+        doc_freqs = np.where(rows >= 0, self.indptr[rows + 1] - self.indptr[np.maximum(rows, 0)], 0)
+        if excluded is not None and excluded.any():
+            for i, row in enumerate(rows):
+                if row >= 0:
+                    doc_freqs[i] -= int(excluded[self.doc_ids[self.indptr[row]:self.indptr[row + 1]]].sum())
+        return doc_freqs
+
+    def _scores(self, rows: np.ndarray, idf: np.ndarray, avgdl: float) -> np.ndarray:
+        """逐个词条累加倒排表中片段的得分 idf*tf*(k1+1)/(tf+k1*(1-b+b*len/avgdl))"""
+        scores = np.zeros(self.segment_count, dtype=np.float32)
+        for row, weight in zip(rows, idf):
+            if row < 0:
+                continue
+            start, end = self.indptr[row], self.indptr[row + 1]
+            doc_ids = self.doc_ids[start:end]
+            term_freqs = self.term_freqs[start:end].astype(np.float32)
+            norms = self.k1 * (1 - self.b + self.b * self.doc_lens[doc_ids] / avgdl)
+            scores[doc_ids] += weight * term_freqs * (self.k1 + 1) / (term_freqs + norms)
+        return scores
+
+    def _top_k(self, scores: np.ndarray, k: int) -> list[tuple[str, float]]:
+        """只对有得分的片段取前k个并降序排序"""
+        candidates = np.flatnonzero(scores)
+        if len(candidates) > k:
+            candidates = candidates[np.argpartition(-scores[candidates], k - 1)[:k]]
+        candidates = candidates[np.argsort(-scores[candidates], kind="stable")]
+        return [(str(uuid.UUID(bytes=self.segment_ids[i].tobytes())), float(scores[i])) for i in candidates]
+
+    def save(self, path: str, extra_arrays: Optional[dict[str, np.ndarray]] = None) -> str:
+        """将索引写入索引目录下一个新的版本目录，返回新的版本号，版本的生效由CURRENT文件控制"""
+        os.makedirs(path, exist_ok=True)
+        generation = f"{time.time_ns()}"
+        generation_path = os.path.join(path, generation)
+        os.makedirs(generation_path)
+        for name in ARRAY_FILES:
+            np.save(os.path.join(generation_path, f"{name}.npy"), np.ascontiguousarray(getattr(self, name)))
+        for name, array in (extra_arrays or {}).items():
+            np.save(os.path.join(generation_path, f"{name}.npy"), np.ascontiguousarray(array))
+        with open(os.path.join(generation_path, "meta.json"), "w") as f:
+            json.dump({"k1": self.k1, "b": self.b}, f)
+        return generation
+
+    @classmethod
+    def load(cls, path: str, generation: str) -> "BM25Index":
+        """以mmap方式加载指定版本的索引，多个worker进程共享同一份页缓存"""
+        generation_path = os.path.join(path, generation)
+        with open(os.path.join(generation_path, "meta.json")) as f:
+            meta = json.load(f)
+        return cls({
+            name: np.load(os.path.join(generation_path, f"{name}.npy"), mmap_mode="r") for name in ARRAY_FILES
+        }, meta["k1"], meta["b"])
+
+
+class LayeredBM25Index:
+    """由较大的主索引及较小的增量索引组成的BM25索引，片段变更只合并到增量索引，主索引中被删除或重新写入的片段在检索时被屏蔽，
+    增量索引超过阈值后再整体合并回主索引，使单个片段的变更不必重建全部CSR数组"""
+    base: BM25Index  # 主索引
+    delta: BM25Index  # 增量索引，记录主索引之后新增或更新的片段
+    removed_ids: np.ndarray  # 主索引中需要屏蔽的片段id，每行为uuid的16字节
+    base_generation: Optional[str]  # 主索引已存储的版本号，为None时表示主索引尚未写入
+
+    def __init__(
+            self,
+            base: BM25Index,
+            delta: BM25Index,
+            removed_ids: Optional[np.ndarray] = None,
+            base_generation: Optional[str] = None,
+    ):
+        """构造函数，传递主索引、增量索引及主索引中需要屏蔽的片段id"""
+        self.base = base
+        self.delta = delta
+        self.removed_ids = np.zeros((0, 16), dtype=np.uint8) if removed_ids is None else removed_ids
+        self.base_generation = base_generation
+        self._removed_mask = _segment_id_mask(self.base.segment_ids, self.removed_ids)
+        self._removed_count = int(self._removed_mask.sum())
+        self._removed_len = int(np.sum(self.base.doc_lens[self._removed_mask], dtype=np.int64))
+
+    @classmethod
+    def empty(cls, k1: float = 1.5, b: float = 0.75) -> "LayeredBM25Index":
+        """创建一个不包含任何片段的空索引"""
+        return cls(BM25Index.empty(k1, b), BM25Index.empty(k1, b))
+
+    @property
+    def segment_count(self) -> int:
+        """索引中的有效片段数"""
+        return self.base.segment_count - self._removed_count + self.delta.segment_count
+
+    @property
+    def delta_size(self) -> int:
+        """增量索引的大小，即增量索引片段数及主索引屏蔽片段数之和，用于判断是否需要合并回主索引"""
+        return self.delta.segment_count + len(self.removed_ids)
+
+    def merge(self, added: dict[str, list[str]], removed: set[str]) -> "LayeredBM25Index":
+        """增量合并，只重建增量索引，并将被删除或重新写入的片段追加到主索引的屏蔽列表，返回新的索引，原索引保持不变"""
+        changed_ids = np.array(
+            [list(uuid.UUID(id).bytes) for id in removed | set(added.keys())], dtype=np.uint8,
+        ).reshape(-1, 16)
+        removed_ids = np.concatenate([np.asarray(self.removed_ids), changed_ids])
+        removed_ids = np.unique(removed_ids.view(_SEGMENT_ID_DTYPE).ravel()).view(np.uint8).reshape(-1, 16)
+        return LayeredBM25Index(
+            self.base, self.delta.merge(added, removed), removed_ids, self.base_generation,
+        )
+
+    def compact(self) -> "LayeredBM25Index":
+        """将增量索引及屏蔽列表合并回主索引，需要重建主索引的全部CSR数组，应在增量索引超过阈值时调用"""
+        removed = {str(uuid.UUID(bytes=segment_id.tobytes())) for segment_id in self.removed_ids}
+        base = self.base.merge(self.delta.to_tokens(), removed)
+        return LayeredBM25Index(base, BM25Index.empty(base.k1, base.b))
+
+    def search(self, query_terms: list[str], k: int) -> list[tuple[str, float]]:
+        """根据查询词条列表计算BM25得分，IDF及平均片段长度按主索引+增量索引整体计算，返回得分最高的前k个 (片段id, 得分)"""
+        if self.segment_count == 0 or k <= 0:
+            return []
+
+        # 1.定位查询词条在两个索引中所在的行，重复的词条直接忽略
+        query_terms = np.array(list(dict.fromkeys(query_terms)), dtype=str)
+        base_rows, delta_rows = self.base._lookup(query_terms), self.delta._lookup(query_terms)
+
+        # 2.按两个索引整体计算IDF及平均片段长度，主索引中被屏蔽的片段不计入，与合并回主索引后的得分保持一致
+        n = self.segment_count
+        doc_freqs = self.base._doc_freqs(base_rows, self._removed_mask) + self.delta._doc_freqs(delta_rows)
+        idf = np.log(1 + (n - doc_freqs + 0.5) / (doc_freqs + 0.5)).astype(np.float32)
+        total_len = float(
+            np.sum(self.base.doc_lens, dtype=np.int64) - self._removed_len + np.sum(self.delta.doc_lens, dtype=np.int64)
+        )
+        avgdl = total_len / n if total_len > 0 else 1.0
+
+        # 3.分别计算两个索引的得分，屏蔽主索引中已被删除或重新写入的片段后合并取前k个
+        base_scores = self.base._scores(base_rows, idf, avgdl)
+        base_scores[self._removed_mask] = 0
+        results = self.base._top_k(base_scores, k) + self.delta._top_k(self.delta._scores(delta_rows, idf, avgdl), k)
+
+        return sorted(results, key=lambda item: item[1], reverse=True)[:k]
+
+    def save(self, path: str) -> str:
+        """写入尚未存储的主索引及新的增量索引版本，再原子替换CURRENT文件使其生效，并清理旧版本，返回新的版本号"""
+        # 1.主索引未变化时直接复用原版本，只写入较小的增量索引
+        base_generation = self.base_generation or self.base.save(path)
+        generations = [base_generation]
+        if self.delta_size > 0:
+            generations.append(self.delta.save(path, {REMOVED_FILE: self.removed_ids}))
+        self.base_generation = base_generation
+
+        # 2.原子替换CURRENT文件，已经mmap旧版本的进程不受影响
+        version = "\n".join(generations)
+        current_tmp = os.path.join(path, f"{CURRENT_FILE}.{generations[-1]}.tmp")
+        with open(current_tmp, "w") as f:
+            f.write(version)
+        os.replace(current_tmp, os.path.join(path, CURRENT_FILE))
+
+        # 3.删除旧的版本目录
+        for name in os.listdir(path):
+            if name not in (*generations, CURRENT_FILE) and os.path.isdir(os.path.join(path, name)):
+                shutil.rmtree(os.path.join(path, name), ignore_errors=True)
+
+        return version
+
+    @classmethod
+    def load(cls, path: str, version: str) -> "LayeredBM25Index":
+        """以mmap方式加载指定版本的主索引及增量索引"""
+        generations = version.split()
+        base = BM25Index.load(path, generations[0])
+        if len(generations) == 1:
+            return cls(base, BM25Index.empty(base.k1, base.b), base_generation=generations[0])
+        return cls(
+            base,
+            BM25Index.load(path, generations[1]),
+            np.load(os.path.join(path, generations[1], f"{REMOVED_FILE}.npy"), mmap_mode="r"),
+            generations[0],
+        )
+
+
+def _segment_id_mask(segment_ids: np.ndarray, removed_ids: np.ndarray) -> np.ndarray:
+    """计算片段id数组中哪些行出现在removed_ids中"""
+    if len(segment_ids) == 0 or len(removed_ids) == 0:
+        return np.zeros(len(segment_ids), dtype=bool)
+    return np.isin(
+        np.ascontiguousarray(segment_ids).view(_SEGMENT_ID_DTYPE).ravel(),
+        np.ascontiguousarray(removed_ids).view(_SEGMENT_ID_DTYPE).ravel(),
+    )
+
+
+def read_version(path: str) -> Optional[str]:
+    """读取索引目录当前生效的版本号(主索引及增量索引的版本号)，索引尚未构建时返回None"""
+    try:
+        with open(os.path.join(path, CURRENT_FILE)) as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def get_bm25_index(path: str) -> Optional[LayeredBM25Index]:
+    """获取索引目录当前生效的索引，同一进程内复用已加载的索引，版本变化时重新加载，索引尚未构建时返回None"""
+    version = read_version(path)
+    if version is None:
+        return None
+
+    with _loaded_indexes_lock:
+        loaded = _loaded_indexes.get(path)
+        if loaded is None or loaded[0] != version:
+            try:
+                loaded = (version, LayeredBM25Index.load(path, version))
+            except FileNotFoundError:
+                # 读取版本号后该版本恰好被新版本替换并清理，此时重新读取一次
+                version = read_version(path)
+                if version is None:
+                    return None
+                loaded = (version, LayeredBM25Index.load(path, version))
+            _loaded_indexes[path] = loaded
+        return loaded[1]
+
+
+def delete_bm25_index(path: str) -> None:
+    """删除索引目录，并清除进程内已加载的索引"""
+    shutil.rmtree(path, ignore_errors=True)
+    with _loaded_indexes_lock:
+        _loaded_indexes.pop(path, None)
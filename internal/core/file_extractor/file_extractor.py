@@ -5,15 +5,18 @@
 @Author  : thezehui@gmail.com
 @File    : file_extractor.py
 """
+import csv
 import os.path
 import tempfile
 from dataclasses import dataclass
 from pathlib import Path
-from typing import Union
+from typing import Union, Iterator
 
+import pandas as pd
 import requests
 from injector import inject
 from langchain_community.document_loaders import (
+    PyPDFLoader,
     UnstructuredExcelLoader,
     UnstructuredPDFLoader,
     UnstructuredMarkdownLoader,
@@ -24,11 +27,21 @@ from langchain_community.document_loaders import (
     UnstructuredFileLoader,
     TextLoader,
 )
+from langchain_core.document_loaders import BaseLoader
 from langchain_core.documents import Document as LCDocument
+from openpyxl import load_workbook
+from pypdf import PdfReader, PdfWriter
+from pypdf.errors import PdfReadError
 
 from internal.model import UploadFile
 from internal.service import CosService
 
+# 流式加载表格文件时，每个文档(页)包含的最大行数
+STREAMING_ROWS_PER_PAGE = 100
+
+# 使用unstructured流式解析PDF时，每次拆分出来单独解析的页数
+STREAMING_PDF_PAGES_PER_PARTITION = 20
+
 
 @inject
 @dataclass
@@ -77,27 +90,144 @@ class FileExtractor:
             is_unstructured: bool = True,
     ) -> Union[list[LCDocument], str]:
         """从本地文件中加载数据，返回LangChain文档列表或者字符串"""
-        # 1.获取文件的扩展名
+        # 1.根据不同的文件扩展名获取加载器
         delimiter = "\n\n"
+        loader = cls._get_loader(file_path, is_unstructured)
+
+        # 2.返回加载的文档列表或者文本
+        return delimiter.join([document.page_content for document in loader.load()]) if return_text else loader.load()
+
+    def lazy_load(self, upload_file: UploadFile, is_unstructured: bool = True) -> Iterator[LCDocument]:
+        """流式加载传入的upload_file记录，逐页(或逐批行)生成LangChain文档，避免整个文件同时驻留在内存中"""
+        # 1.创建一个临时的文件夹，生成器结束后自动清除
+        with tempfile.TemporaryDirectory() as temp_dir:
+            # 2.构建一个临时文件路径并将对象存储中的文件下载到本地
+            file_path = os.path.join(temp_dir, os.path.basename(upload_file.key))
+            self.cos_service.download_file(upload_file.key, file_path)
+
+            # 3.从指定的路径中流式加载文件
+            yield from self.lazy_load_from_file(file_path, is_unstructured)
+
+    @classmethod
+    def lazy_load_from_file(cls, file_path: str, is_unstructured: bool = True) -> Iterator[LCDocument]:
+        """从本地文件中流式加载数据，PDF按页范围拆分解析，xlsx/csv/xls按行批次解析，其余文件使用加载器的lazy_load"""
+        # 1.获取文件的扩展名
         file_extension = Path(file_path).suffix.lower()
 
-        # 2.根据不同的文件扩展名去加载不同的加载器
+        # 2.PDF默认使用unstructured按页范围分批解析，配置为pypdf时逐页读取，内存占用更低但版面解析效果不同
+        if file_extension == ".pdf":
+            if os.getenv("FILE_EXTRACTOR_PDF_LOADER", "unstructured") == "pypdf":
+                yield from PyPDFLoader(file_path).lazy_load()
+            else:
+                yield from cls._lazy_load_pdf(file_path)
+        elif file_extension == ".xlsx":
+            yield from cls._lazy_load_xlsx(file_path)
+        elif file_extension == ".xls":
+            yield from cls._lazy_load_xls(file_path)
+        elif file_extension == ".csv":
+            yield from cls._lazy_load_csv(file_path)
+        else:
+            yield from cls._get_loader(file_path, is_unstructured).lazy_load()
+
+    @classmethod
+    def _get_loader(cls, file_path: str, is_unstructured: bool = True) -> BaseLoader:
+        """根据文件的扩展名获取对应的LangChain文档加载器"""
+        file_extension = Path(file_path).suffix.lower()
         if file_extension in [".xlsx", ".xls"]:
-            loader = UnstructuredExcelLoader(file_path)
+            return UnstructuredExcelLoader(file_path)
         elif file_extension == ".pdf":
-            loader = UnstructuredPDFLoader(file_path)
+            return UnstructuredPDFLoader(file_path)
         elif file_extension in [".md", ".markdown"]:
-            loader = UnstructuredMarkdownLoader(file_path)
+            return UnstructuredMarkdownLoader(file_path)
         elif file_extension in [".htm", ".html"]:
-            loader = UnstructuredHTMLLoader(file_path)
+            return UnstructuredHTMLLoader(file_path)
         elif file_extension == ".csv":
-            loader = UnstructuredCSVLoader(file_path)
+            return UnstructuredCSVLoader(file_path)
         elif file_extension in [".ppt", "pptx"]:
-            loader = UnstructuredPowerPointLoader(file_path)
+            return UnstructuredPowerPointLoader(file_path)
         elif file_extension == ".xml":
-            loader = UnstructuredXMLLoader(file_path)
-        else:
-            loader = UnstructuredFileLoader(file_path) if is_unstructured else TextLoader(file_path)
+            return UnstructuredXMLLoader(file_path)
+        return UnstructuredFileLoader(file_path) if is_unstructured else TextLoader(file_path)
 
-        # 3.返回加载的文档列表或者文本
-        return delimiter.join([document.page_content for document in loader.load()]) if return_text else loader.load()
+    @classmethod
+    def _lazy_load_xlsx(cls, file_path: str) -> Iterator[LCDocument]:
+        """使用openpyxl只读模式逐个工作表按行批次读取xlsx文件"""
+        workbook = load_workbook(file_path, read_only=True, data_only=True)
+        try:
+            for worksheet in workbook.worksheets:
+                yield from cls._rows_to_documents(
+                    (row for row in worksheet.iter_rows(values_only=True)),
+                    {"source": file_path, "sheet": worksheet.title},
+                )
+        finally:
+            workbook.close()
+
+    @classmethod
+    def _lazy_load_pdf(cls, file_path: str) -> Iterator[LCDocument]:
+        """将PDF按页范围拆分成多个临时文件，逐个使用unstructured按页解析，峰值内存只与单个页范围的大小相关"""
+        # 1.读取PDF的页信息，pypdf无法解析的文件(如加密文件)回退到整个文件解析
+        try:
+            reader = PdfReader(file_path)
+            page_count = len(reader.pages)
+        except PdfReadError:
+            yield from UnstructuredPDFLoader(file_path, mode="paged").lazy_load()
+            return
+
+        # 2.逐个页范围写入临时文件并解析，页码及来源修正为原文件对应的值
+        with tempfile.TemporaryDirectory() as temp_dir:
+            for start in range(0, page_count, STREAMING_PDF_PAGES_PER_PARTITION):
+                writer = PdfWriter()
+                for page in reader.pages[start:start + STREAMING_PDF_PAGES_PER_PARTITION]:
+                    writer.add_page(page)
+                partition_path = os.path.join(temp_dir, f"pages_{start}.pdf")
+                with open(partition_path, "wb") as file:
+                    writer.write(file)
+
+                for document in UnstructuredPDFLoader(partition_path, mode="paged").lazy_load():
+                    document.metadata.update({
+                        "source": file_path,
+                        "filename": os.path.basename(file_path),
+                        "page_number": start + document.metadata.get("page_number", 1),
+                    })
+                    yield document
+                os.remove(partition_path)
+
+    @classmethod
+    def _lazy_load_xls(cls, file_path: str) -> Iterator[LCDocument]:
+        """使用pandas逐个工作表读取旧版xls文件并按行批次生成文档，同一时间只有一个工作表驻留在内存中"""
+        with pd.ExcelFile(file_path) as excel_file:
+            for sheet_name in excel_file.sheet_names:
+                data_frame = excel_file.parse(sheet_name, header=None, dtype=object)
+                data_frame = data_frame.astype(object).where(data_frame.notna(), None)
+                yield from cls._rows_to_documents(
+                    data_frame.itertuples(index=False, name=None),
+                    {"source": file_path, "sheet": sheet_name},
+                )
+                del data_frame
+
+    @classmethod
+    def _lazy_load_csv(cls, file_path: str) -> Iterator[LCDocument]:
+        """使用csv模块按行批次读取csv文件"""
+        with open(file_path, newline="", encoding="utf-8", errors="ignore") as file:
+            yield from cls._rows_to_documents(csv.reader(file), {"source": file_path})
+
+    @classmethod
+    def _rows_to_documents(cls, rows: Iterator[tuple], metadata: dict) -> Iterator[LCDocument]:
+        """将表格行迭代器按批次转换成LangChain文档，每行的单元格使用制表符拼接"""
+        lines, start_row, row_number = [], 1, 0
+        for row_number, row in enumerate(rows, start=1):
+            line = "\t".join("" if cell is None else str(cell) for cell in row).strip()
+            if line:
+                lines.append(line)
+            if row_number - start_row + 1 >= STREAMING_ROWS_PER_PAGE:
+                if lines:
+                    yield LCDocument(
+                        page_content="\n".join(lines),
+                        metadata={**metadata, "start_row": start_row, "end_row": row_number},
+                    )
+                lines, start_row = [], row_number + 1
+        if lines:
+            yield LCDocument(
+                page_content="\n".join(lines),
+                metadata={**metadata, "start_row": start_row, "end_row": row_number},
+            )
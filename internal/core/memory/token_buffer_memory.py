@@ -13,6 +13,7 @@ from sqlalchemy import desc
 
 from internal.entity.conversation_entity import MessageStatus
 from internal.model import Conversation, Message
+from internal.service.tokenizer_service import TokenizerService
 from pkg.sqlalchemy import SQLAlchemy
 
 
@@ -50,11 +51,11 @@ class TokenBufferMemory:
                 AIMessage(content=message.answer),
             ])
 
-        # 4.调用LangChain继承的trim_messages函数剪切消息列表
+        # 4.调用LangChain继承的trim_messages函数剪切消息列表，token数由分词器服务计算并缓存
         return trim_messages(
             messages=prompt_messages,
             max_tokens=max_token_limit,
-            token_counter=self.model_instance,
+            token_counter=TokenizerService.count_messages_tokens,
             strategy="last",
             start_on="human",
             end_on="ai",
@@ -0,0 +1,10 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+@Time    : 2024/12/24 10:15
+@Author  : thezehui@gmail.com
+@File    : __init__.py.py
+"""
+from .local_reranker import LocalReranker, get_local_reranker
+
+__all__ = ["LocalReranker", "get_local_reranker"]
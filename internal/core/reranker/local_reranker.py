@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+@Time    : 2024/12/24 10:18
+@Author  : thezehui@gmail.com
+@File    : local_reranker.py
+"""
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+from functools import lru_cache
+from typing import Optional
+
+import numpy as np
+
+# 本地重排序模型名字，支持中英文等多语言
+LOCAL_RERANKER_MODEL = "BAAI/bge-reranker-base"
+
+# 预热时使用的查询及文本
+WARM_UP_QUERY = "LLMOps 本地重排序模型预热"
+WARM_UP_TEXTS = ["warm up local reranker model"]
+
+
+class LocalReranker:
+    """本地CPU交叉编码器重排序模型，一次批量推理所有 (查询, 片段) 对，推理超出延迟预算时由调用方回退到原有顺序"""
+
+    def __init__(
+            self,
+            model_name: str = LOCAL_RERANKER_MODEL,
+            max_length: int = 512,
+            max_in_flight: int = 1,
+    ):
+        """构造函数，模型在推理线程中延迟加载，首次调用超出延迟预算时模型会在后台继续加载，不阻塞检索"""
+        self.model_name = model_name
+        self.max_length = max_length
+        self._model = None
+        self._max_in_flight = max_in_flight
+        self._lock = threading.Lock()
+        self._model_lock = threading.Lock()
+        self._pid: Optional[int] = None
+
+    def warm_up(self) -> None:
+        """预热模型，完成模型加载及首次推理"""
+        start_at = time.perf_counter()
+        self._predict(WARM_UP_QUERY, WARM_UP_TEXTS)
+        logging.info(
+            "本地重排序模型预热完成，耗时：%(elapsed).2fs",
+            {"elapsed": time.perf_counter() - start_at},
+        )
+
+    def rerank(self, query: str, texts: list[str], timeout: Optional[float] = None) -> Optional[np.ndarray]:
+        """计算query与每条文本的相关性得分(0-1)，推理线程已满或者超出timeout秒时返回None"""
+        if not texts:
+            return np.array([], dtype=np.float32)
+
+        # 1.推理线程都在执行(例如上一次推理超时仍未结束)时直接跳过，避免请求堆积
+        executor, semaphore = self._get_executor()
+        if not semaphore.acquire(blocking=False):
+            return None
+
+        # 2.提交到推理线程并在延迟预算内等待结果，超时后推理继续执行并在结束时释放信号量
+        future = executor.submit(self._predict, query, texts)
+        future.add_done_callback(lambda _: semaphore.release())
+        try:
+            return future.result(timeout=timeout)
+        except TimeoutError:
+            return None
+
+    def _predict(self, query: str, texts: list[str]) -> np.ndarray:
+        """加载模型(仅首次)并一次批量推理所有 (查询, 文本) 对"""
+        with self._model_lock:
+            if self._model is None:
+                from sentence_transformers import CrossEncoder
+
+                self._model = CrossEncoder(self.model_name, max_length=self.max_length, device="cpu")
+
+        return np.asarray(self._model.predict(
+            [(query, text) for text in texts],
+            batch_size=len(texts),
+            convert_to_numpy=True,
+            show_progress_bar=False,
+        ), dtype=np.float32).reshape(-1)
+
+    def _get_executor(self) -> tuple[ThreadPoolExecutor, threading.BoundedSemaphore]:
+        """获取推理线程池，首次调用或者fork后的子进程中调用时重新创建，父进程的线程不会被fork到子进程"""
+        with self._lock:
+            if self._pid != os.getpid():
+                self._executor = ThreadPoolExecutor(max_workers=self._max_in_flight, thread_name_prefix="reranker")
+                self._semaphore = threading.BoundedSemaphore(self._max_in_flight)
+                self._pid = os.getpid()
+            return self._executor, self._semaphore
+
+
+@lru_cache(maxsize=None)
+def _create_local_reranker(model_name: str, max_length: int, max_in_flight: int) -> LocalReranker:
+    """按配置创建本地重排序模型，同一进程内相同配置只创建一次"""
+    return LocalReranker(model_name=model_name, max_length=max_length, max_in_flight=max_in_flight)
+
+
+def get_local_reranker() -> LocalReranker:
+    """根据环境变量获取进程内共享的本地重排序模型"""
+    return _create_local_reranker(
+        os.getenv("LOCAL_RERANKER_MODEL", LOCAL_RERANKER_MODEL),
+        int(os.getenv("LOCAL_RERANKER_MAX_LENGTH", 512)),
+        int(os.getenv("LOCAL_RERANKER_MAX_IN_FLIGHT", 1)),
+    )
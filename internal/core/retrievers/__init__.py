@@ -6,6 +6,7 @@
 @File    : __init__.py.py
 """
 from .full_text_retriever import FullTextRetriever
+from .hybrid_retriever import HybridRetriever
 from .semantic_retriever import SemanticRetriever
 
-__all__ = ["SemanticRetriever", "FullTextRetriever"]
+__all__ = ["SemanticRetriever", "FullTextRetriever", "HybridRetriever"]
@@ -5,7 +5,6 @@
 @Author  : thezehui@gmail.com
 @File    : full_text_retriever.py
 """
-from collections import Counter
 from typing import List
 from uuid import UUID
 
@@ -13,51 +12,66 @@ from langchain_core.callbacks import CallbackManagerForRetrieverRun
 from langchain_core.documents import Document as LCDocument
 from pydantic import Field
 from langchain_core.retrievers import BaseRetriever
+from sqlalchemy import func, desc
 
-from internal.model import KeywordTable, Segment
-from internal.service import JiebaService
+from internal.model import KeywordIndex, Segment
+from internal.service import JiebaService, DatasetExclusionService, BM25IndexService
 from pkg.sqlalchemy import SQLAlchemy
 
 
 class FullTextRetriever(BaseRetriever):
-    """全文检索器"""
+    """全文检索器，优先使用BM25索引检索并返回BM25得分，知识库索引尚未构建时回退到按命中关键词数排序的倒排索引检索"""
     db: SQLAlchemy
     dataset_ids: list[UUID]
     jieba_service: JiebaService
+    dataset_exclusion_service: DatasetExclusionService
+    bm25_index_service: BM25IndexService
     search_kwargs: dict = Field(default_factory=dict)
 
     def _get_relevant_documents(
             self, query: str, *, run_manager: CallbackManagerForRetrieverRun,
     ) -> List[LCDocument]:
         """根据传递的query执行关键词检索获取LangChain文档列表"""
-        # 1.将查询query转换成关键词列表
+        # 1.知识库均已构建BM25索引时，使用BM25索引过度召回并剔除排除集合中已禁用的文档及片段
+        k = self.search_kwargs.get("k", 4)
+        if self.bm25_index_service.has_indexes(self.dataset_ids):
+            return self.dataset_exclusion_service.search_with_exclusion(
+                lambda fetch_k: self._bm25_search(query, fetch_k), k,
+            )
+
+        # 2.将查询query转换成关键词列表
         keywords = self.jieba_service.extract_keywords(query, 10)
+        if len(keywords) == 0:
+            return []
 
-        # 2.查找指定知识库的关键词表
-        keyword_tables = [
-            keyword_table for keyword_table, in
-            self.db.session.query(KeywordTable).with_entities(KeywordTable.keyword_table).filter(
-                KeywordTable.dataset_id.in_(self.dataset_ids)
-            ).all()
-        ]
+        # 3.在倒排索引中过度召回并剔除排除集合中已禁用的文档及片段
+        return self.dataset_exclusion_service.search_with_exclusion(
+            lambda fetch_k: self._keyword_search(keywords, fetch_k), k,
+        )
 
-        # 3.遍历所有的知识库关键词表，找到匹配query关键词的id列表
-        all_ids = []
-        for keyword_table in keyword_tables:
-            # 4.遍历每一个关键词表的每一项
-            for keyword, segment_ids in keyword_table.items():
-                # 5.如果数据存在则提取关键词对应的片段id列表
-                if keyword in keywords:
-                    all_ids.extend(segment_ids)
+    def _bm25_search(self, query: str, k: int) -> List[LCDocument]:
+        """在BM25索引中检索得分最高的前k条片段"""
+        top_k_ids = self.bm25_index_service.search(self.dataset_ids, query, k)
+        return self._build_documents(top_k_ids)
 
-        # 6.统计segment_id出现的频率，这里可以使用Counter进行快速统计
-        id_counter = Counter(all_ids)
+    def _keyword_search(self, keywords: list[str], k: int) -> List[LCDocument]:
+        """根据关键词列表在倒排索引中检索频率最高的前k条片段"""
+        # 1.在倒排索引中只查找query关键词对应的倒排项，按命中关键词数统计片段频率
+        # 2.获取频率最高的前k条数据，格式为[(segment_id, freq), (segment_id, freq), ...]
+        freq = func.count(KeywordIndex.keyword).label("freq")
+        top_k_ids = [
+            (str(segment_id), freq) for segment_id, freq in
+            self.db.session.query(KeywordIndex).with_entities(KeywordIndex.segment_id, freq).filter(
+                KeywordIndex.dataset_id.in_(self.dataset_ids),
+                KeywordIndex.keyword.in_(keywords),
+            ).group_by(KeywordIndex.segment_id).order_by(desc(freq), KeywordIndex.segment_id).limit(k).all()
+        ]
 
-        # 7.获取频率最高的前k条数据，格式为[(segment_id, freq), (segment_id, freq), ...]
-        k = self.search_kwargs.get("k", 4)
-        top_k_ids = id_counter.most_common(k)
+        return self._build_documents([(id, 0) for id, _ in top_k_ids])
 
-        # 8.根据得到的id列表检索数据库得到片段列表信息
+    def _build_documents(self, top_k_ids: list[tuple[str, float]]) -> List[LCDocument]:
+        """根据 (片段id, 得分) 列表查询片段信息，并按原有顺序构建LangChain文档列表，已被删除的片段会被忽略"""
+        # 1.根据得到的id列表检索数据库得到片段列表信息
         segments = self.db.session.query(Segment).filter(
             Segment.id.in_([id for id, _ in top_k_ids])
         ).all()
@@ -65,10 +79,10 @@ class FullTextRetriever(BaseRetriever):
             str(segment.id): segment for segment in segments
         }
 
-        # 9.根据频率进行排序
-        sorted_segments = [segment_dict[str(id)] for id, freq in top_k_ids if id in segment_dict]
+        # 2.根据传递的顺序进行排序
+        sorted_segments = [(segment_dict[id], score) for id, score in top_k_ids if id in segment_dict]
 
-        # 10.构建LangChain文档列表
+        # 3.构建LangChain文档列表
         lc_documents = [LCDocument(
             page_content=segment.content,
             metadata={
@@ -77,10 +91,8 @@ class FullTextRetriever(BaseRetriever):
                 "document_id": str(segment.document_id),
                 "segment_id": str(segment.id),
                 "node_id": str(segment.node_id),
-                "document_enabled": True,
-                "segment_enabled": True,
-                "score": 0,
+                "score": score,
             }
-        ) for segment in sorted_segments]
+        ) for segment, score in sorted_segments]
 
         return lc_documents
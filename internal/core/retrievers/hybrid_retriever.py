@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+@Time    : 2024/12/22 14:08
+@Author  : thezehui@gmail.com
+@File    : hybrid_retriever.py
+"""
+from concurrent.futures import ThreadPoolExecutor
+from typing import List
+
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.documents import Document as LCDocument
+from langchain_core.retrievers import BaseRetriever
+from pydantic import Field
+
+from internal.lib.helper import reciprocal_rank_fusion
+from .full_text_retriever import FullTextRetriever
+from .semantic_retriever import SemanticRetriever
+
+
+class HybridRetriever(BaseRetriever):
+    """混合检索器，并行执行相似性检索与全文检索，并使用倒数排名融合(RRF)合并结果，耗时接近两者中较慢的一个"""
+    semantic_retriever: SemanticRetriever
+    full_text_retriever: FullTextRetriever
+    weights: list[float] = Field(default_factory=lambda: [0.5, 0.5])
+    c: int = 60
+    score_mode: str = "rrf"
+    search_kwargs: dict = Field(default_factory=dict)
+
+    def _get_relevant_documents(
+            self, query: str, *, run_manager: CallbackManagerForRetrieverRun,
+    ) -> List[LCDocument]:
+        """根据传递的query并行执行两种检索并融合结果"""
+        # 1.提取最大搜索条件k，默认值为4
+        k = self.search_kwargs.get("k", 4)
+
+        # 2.在当前线程提前构建检索排除集合，子线程内过滤时只需访问redis，不会使用当前线程的数据库会话
+        self.semantic_retriever.dataset_exclusion_service.ensure_built(self.semantic_retriever.dataset_ids)
+
+        # 3.相似性检索(文本嵌入+向量数据库)放在子线程执行，全文检索(postgres)在当前线程执行
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            semantic_future = executor.submit(
+                self.semantic_retriever.invoke, query, {"callbacks": run_manager.get_child("semantic")},
+            )
+            full_text_documents = self.full_text_retriever.invoke(
+                query, {"callbacks": run_manager.get_child("full_text")},
+            )
+            semantic_documents = semantic_future.result()
+
+        # 4.weighted模式使用两种得分的加权和合并，其余模式使用倒数排名融合合并两个检索结果
+        if self.score_mode == "weighted":
+            return self._weighted_fusion(semantic_documents, full_text_documents)[:k]
+        fused = reciprocal_rank_fusion([semantic_documents, full_text_documents], self.weights, self.c)[:k]
+
+        # 5.按配置输出得分，rrf为归一化到0-1的融合得分，semantic为相似性得分(只被全文检索命中的文档得分为0)
+        max_score = sum(self.weights) / (self.c + 1)
+        semantic_scores = {
+            lc_document.metadata["segment_id"]: lc_document.metadata.get("score", 0)
+            for lc_document in semantic_documents
+        }
+        lc_documents = []
+        for lc_document, score in fused:
+            if self.score_mode == "semantic":
+                lc_document.metadata["score"] = semantic_scores.get(lc_document.metadata["segment_id"], 0)
+            else:
+                lc_document.metadata["score"] = score / max_score
+            lc_documents.append(lc_document)
+
+        return lc_documents
+
+    def _weighted_fusion(
+            self, semantic_documents: list[LCDocument], full_text_documents: list[LCDocument],
+    ) -> list[LCDocument]:
+        """将BM25得分除以本次召回的最大得分归一化到0-1，再与相似性得分加权求和，按加权得分降序返回"""
+        # 1.计算归一化后的BM25得分，全文检索回退到倒排索引时得分均为0，此时只使用相似性得分
+        max_bm25_score = max([lc_document.metadata.get("score", 0) for lc_document in full_text_documents], default=0)
+        scores: dict[str, list[float]] = {}
+        documents: dict[str, LCDocument] = {}
+        for index, lc_documents in enumerate([semantic_documents, full_text_documents]):
+            for lc_document in lc_documents:
+                segment_id = lc_document.metadata["segment_id"]
+                score = lc_document.metadata.get("score", 0)
+                if index == 1:
+                    score = score / max_bm25_score if max_bm25_score > 0 else 0
+                scores.setdefault(segment_id, [0, 0])[index] = score
+                documents.setdefault(segment_id, lc_document)
+
+        # 2.按权重求和后降序排序
+        total_weight = sum(self.weights) or 1
+        fused = sorted(
+            ((segment_id, sum(w * s for w, s in zip(self.weights, score)) / total_weight)
+             for segment_id, score in scores.items()),
+            key=lambda item: item[1],
+            reverse=True,
+        )
+        lc_documents = []
+        for segment_id, score in fused:
+            documents[segment_id].metadata["score"] = score
+            lc_documents.append(documents[segment_id])
+
+        return lc_documents
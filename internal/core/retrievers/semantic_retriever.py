@@ -12,14 +12,15 @@ from langchain_core.callbacks import CallbackManagerForRetrieverRun
 from langchain_core.documents import Document as LCDocument
 from pydantic import Field
 from langchain_core.retrievers import BaseRetriever
-from langchain_weaviate import WeaviateVectorStore
-from weaviate.classes.query import Filter
+
+from internal.service import DatasetExclusionService, VectorDatabaseService
 
 
 class SemanticRetriever(BaseRetriever):
     """相似性检索器/向量检索器"""
     dataset_ids: list[UUID]
-    vector_store: WeaviateVectorStore
+    vector_database_service: VectorDatabaseService
+    dataset_exclusion_service: DatasetExclusionService
     search_kwargs: dict = Field(default_factory=dict)
 
     def _get_relevant_documents(
@@ -27,26 +28,29 @@ class SemanticRetriever(BaseRetriever):
     ) -> List[LCDocument]:
         """根据传递的query执行相似性检索"""
         # 1.提取最大搜索条件k，默认值为4
-        k = self.search_kwargs.pop("k", 4)
+        k = self.search_kwargs.get("k", 4)
+
+        # 2.启用/禁用状态不再写入向量数据库，检索时只按知识库过滤，并过度召回后剔除排除集合中的数据
+        lc_documents = self.dataset_exclusion_service.search_with_exclusion(
+            lambda fetch_k: self._similarity_search(query, fetch_k), k,
+        )
+
+        return lc_documents
 
-        # 2.执行相似性检索并获取得分信息
-        search_result = self.vector_store.similarity_search_with_relevance_scores(
+    def _similarity_search(self, query: str, k: int) -> List[LCDocument]:
+        """执行相似性检索，并将得分信息添加到文档元数据中"""
+        # 1.执行相似性检索并获取得分信息
+        search_result = self.vector_database_service.similarity_search_with_relevance_scores(
             query=query,
             k=k,
-            **{
-                "filters": Filter.all_of([
-                    Filter.by_property("dataset_id").contains_any([str(dataset_id) for dataset_id in self.dataset_ids]),
-                    Filter.by_property("document_enabled").equal(True),
-                    Filter.by_property("segment_enabled").equal(True),
-                ]),
-                **self.search_kwargs,
-            }
+            dataset_ids=self.dataset_ids,
+            **{key: value for key, value in self.search_kwargs.items() if key != "k"},
         )
         if search_result is None or len(search_result) == 0:
             return []
         lc_documents, scores = zip(*search_result)
 
-        # 3.执行循环将得分添加到文档元数据中
+        # 2.执行循环将得分添加到文档元数据中
         for lc_document, score in zip(lc_documents, scores):
             lc_document.metadata["score"] = score
 
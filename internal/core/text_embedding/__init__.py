@@ -0,0 +1,25 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+@Time    : 2024/12/20 15:02
+@Author  : thezehui@gmail.com
+@File    : __init__.py.py
+"""
+from .cache_backed_embeddings import CacheBackedEmbeddings
+from .embedding_dispatcher import DynamicBatcher, EmbeddingDispatcher
+from .local_embeddings import LocalEmbeddings, get_local_embeddings
+from .tiered_byte_store import LRUByteCache, TieredByteStore, get_lru_byte_cache
+from .vector_codec import encode_vector, decode_vector
+
+__all__ = [
+    "CacheBackedEmbeddings",
+    "DynamicBatcher",
+    "EmbeddingDispatcher",
+    "LocalEmbeddings",
+    "get_local_embeddings",
+    "LRUByteCache",
+    "TieredByteStore",
+    "get_lru_byte_cache",
+    "encode_vector",
+    "decode_vector",
+]
@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+@Time    : 2024/12/21 10:18
+@Author  : thezehui@gmail.com
+@File    : cache_backed_embeddings.py
+"""
+import hashlib
+import json
+import uuid
+from typing import Optional
+
+from langchain_core.embeddings import Embeddings
+from langchain_core.stores import ByteStore
+
+from internal.lib.helper import generate_text_hash
+from .vector_codec import encode_vector, decode_vector
+
+# 旧版本缓存(langchain CacheBackedEmbeddings)生成缓存键时使用的uuid命名空间
+LEGACY_NAMESPACE_UUID = uuid.UUID(int=1985)
+
+
+class CacheBackedEmbeddings(Embeddings):
+    """带缓存的文本嵌入模型，文档向量与查询向量分别缓存，缓存键由命名空间(模型)+类型+文本哈希组成，向量使用二进制格式存储，
+    传递legacy_store时，未命中的文档向量会读取旧版本的JSON缓存，重新编码写入新的缓存键后删除旧的缓存键"""
+
+    def __init__(
+            self,
+            underlying_embeddings: Embeddings,
+            store: ByteStore,
+            namespace: str,
+            batch_size: Optional[int] = None,
+            dtype: str = "float32",
+            legacy_store: Optional[ByteStore] = None,
+            legacy_namespace: str = "",
+    ):
+        self.underlying_embeddings = underlying_embeddings
+        self.store = store
+        self.namespace = namespace
+        self.batch_size = batch_size
+        self.dtype = dtype
+        self.legacy_store = legacy_store
+        self.legacy_namespace = legacy_namespace
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        """批量计算文档向量，只对缓存未命中的文本(去重后)调用文本嵌入模型"""
+        keys = [self._key("document", text) for text in texts]
+        vectors = self._load(keys)
+        if self.legacy_store is not None:
+            vectors = self._migrate_legacy(texts, vectors)
+
+        # 1.汇总未命中的文本，相同文本只计算一次
+        missing = list(dict.fromkeys(text for text, vector in zip(texts, vectors) if vector is None))
+        if missing:
+            batch_size = self.batch_size or len(missing)
+            computed = {}
+            for i in range(0, len(missing), batch_size):
+                batch = missing[i:i + batch_size]
+                batch_vectors = self.underlying_embeddings.embed_documents(batch)
+                self.store.mset([
+                    (self._key("document", text), self._encode(vector)) for text, vector in zip(batch, batch_vectors)
+                ])
+                computed.update(zip(batch, batch_vectors))
+
+            # 2.按原始顺序回填计算结果
+            vectors = [vector if vector is not None else computed[text] for text, vector in zip(texts, vectors)]
+
+        return vectors
+
+    def embed_query(self, text: str) -> list[float]:
+        """计算查询向量，重复的查询直接从缓存读取，无需调用文本嵌入模型"""
+        key = self._key("query", text)
+        vector = self._load([key])[0]
+        if vector is None:
+            vector = self.underlying_embeddings.embed_query(text)
+            self.store.mset([(key, self._encode(vector))])
+        return vector
+
+    def _key(self, kind: str, text: str) -> str:
+        return f"{self.namespace}:{kind}:{generate_text_hash(text)}"
+
+    def _legacy_key(self, text: str) -> str:
+        """旧版本的缓存键，为命名空间+文本sha1哈希的uuid5，旧版本只缓存了文档向量"""
+        hash_value = hashlib.sha1(text.encode("utf-8")).hexdigest()
+        return f"{self.legacy_namespace}{uuid.uuid5(LEGACY_NAMESPACE_UUID, hash_value)}"
+
+    def _load(self, keys: list[str]) -> list[Optional[list[float]]]:
+        """批量读取并解码缓存的向量，未命中的位置为None"""
+        return [decode_vector(value).tolist() if value is not None else None for value in self.store.mget(keys)]
+
+    def _migrate_legacy(self, texts: list[str], vectors: list[Optional[list[float]]]) -> list[Optional[list[float]]]:
+        """读取未命中文本的旧版本JSON缓存，重新编码写入新的缓存键并删除旧的缓存键，返回回填后的向量列表"""
+        # 1.汇总未命中的文本并批量读取旧版本缓存
+        missing = list(dict.fromkeys(text for text, vector in zip(texts, vectors) if vector is None))
+        if not missing:
+            return vectors
+        values = self.legacy_store.mget([self._legacy_key(text) for text in missing])
+        migrated = {text: json.loads(value.decode("utf-8")) for text, value in zip(missing, values) if value is not None}
+        if not migrated:
+            return vectors
+
+        # 2.先写入新的缓存键，再删除旧的缓存键，中途失败时下次读取会重新迁移
+        self.store.mset([(self._key("document", text), self._encode(vector)) for text, vector in migrated.items()])
+        self.legacy_store.mdelete([self._legacy_key(text) for text in migrated])
+
+        return [vector if vector is not None else migrated.get(text) for text, vector in zip(texts, vectors)]
+
+    def _encode(self, vector) -> bytes:
+        return encode_vector(vector, self.dtype)
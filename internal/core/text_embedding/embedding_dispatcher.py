@@ -0,0 +1,123 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+@Time    : 2024/12/22 10:26
+@Author  : thezehui@gmail.com
+@File    : embedding_dispatcher.py
+"""
+import os
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass, field
+from queue import Queue, Empty
+from typing import Callable, Optional, Sequence
+
+from langchain_core.embeddings import Embeddings
+
+
+@dataclass
+class _EmbeddingRequest:
+    """动态批处理的单次请求，记录待嵌入的文本列表及用于回传结果的future"""
+    texts: list[str]
+    future: Future = field(default_factory=Future)
+
+
+class DynamicBatcher:
+    """动态批处理器，将多个线程并发提交的小请求在短时间窗口内合并成一次批量调用，并限制同时执行的批量调用数"""
+
+    def __init__(
+            self,
+            encode_func: Callable[[list[str]], Sequence[list[float]]],
+            max_batch_size: int,
+            max_wait_ms: float,
+            max_in_flight: int = 1,
+    ):
+        self._encode_func = encode_func
+        self._max_batch_size = max_batch_size
+        self._max_wait = max_wait_ms / 1000
+        self._max_in_flight = max_in_flight
+        self._lock = threading.Lock()
+        self._pid: Optional[int] = None
+
+    def submit(self, texts: list[str]) -> list[list[float]]:
+        """提交一组文本并阻塞等待嵌入结果，返回结果与输入文本顺序一致"""
+        if not texts:
+            return []
+        request = _EmbeddingRequest(texts=texts)
+        self._get_queue().put(request)
+        return request.future.result()
+
+    def _get_queue(self) -> Queue:
+        """获取请求队列，首次调用或者fork后的子进程中调用时启动后台线程，父进程的线程不会被fork到子进程"""
+        with self._lock:
+            if self._pid != os.getpid():
+                self._queue: Queue[_EmbeddingRequest] = Queue()
+                self._semaphore = threading.BoundedSemaphore(self._max_in_flight)
+                self._executor = ThreadPoolExecutor(max_workers=self._max_in_flight)
+                threading.Thread(target=self._run, args=(self._queue,), name="embedding-batcher", daemon=True).start()
+                self._pid = os.getpid()
+            return self._queue
+
+    def _run(self, queue: Queue) -> None:
+        """后台线程，阻塞等待首个请求，再在等待窗口内继续收集请求直到凑满一个批次"""
+        while True:
+            requests = [queue.get()]
+            size = len(requests[0].texts)
+            deadline = time.perf_counter() + self._max_wait
+            while size < self._max_batch_size:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    break
+                try:
+                    request = queue.get(timeout=remaining)
+                except Empty:
+                    break
+                requests.append(request)
+                size += len(request.texts)
+
+            # 执行中的批量调用数达到上限时在此等待，等待期间新的请求继续在队列中堆积，下一个批次会更大
+            self._semaphore.acquire()
+            self._executor.submit(self._process, requests)
+
+    def _process(self, requests: list[_EmbeddingRequest]) -> None:
+        """合并请求的文本按批次上限调用，并将结果按请求拆分回传"""
+        try:
+            texts = [text for request in requests for text in request.texts]
+            vectors = []
+            for i in range(0, len(texts), self._max_batch_size):
+                vectors.extend(self._encode_func(texts[i:i + self._max_batch_size]))
+        except Exception as e:
+            for request in requests:
+                request.future.set_exception(e)
+            return
+        finally:
+            self._semaphore.release()
+
+        offset = 0
+        for request in requests:
+            request.future.set_result(vectors[offset:offset + len(request.texts)])
+            offset += len(request.texts)
+
+
+class EmbeddingDispatcher(Embeddings):
+    """文本嵌入请求合并器，并发的embed_query/embed_documents调用会在短时间窗口内合并成一次模型批量调用再分发结果，
+    只适用于查询与文档使用相同方式计算向量的模型"""
+
+    def __init__(
+            self,
+            underlying_embeddings: Embeddings,
+            max_batch_size: int = 100,
+            max_wait_ms: float = 5,
+            max_in_flight: int = 4,
+    ):
+        self.underlying_embeddings = underlying_embeddings
+        self._batcher = DynamicBatcher(underlying_embeddings.embed_documents, max_batch_size, max_wait_ms, max_in_flight)
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        """批量计算文本列表的向量"""
+        return self._batcher.submit(list(texts))
+
+    def embed_query(self, text: str) -> list[float]:
+        """计算单条查询文本的向量，与其他并发请求合并调用"""
+        return self._batcher.submit([text])[0]
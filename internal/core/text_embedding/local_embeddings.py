@@ -0,0 +1,243 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+@Time    : 2024/12/20 15:02
+@Author  : thezehui@gmail.com
+@File    : local_embeddings.py
+"""
+import logging
+import os
+import time
+from functools import lru_cache
+from typing import Optional
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+from .embedding_dispatcher import DynamicBatcher
+
+# 本地文本嵌入模型名字，模型快照随项目存放在internal/core/embeddings目录下
+LOCAL_EMBEDDINGS_MODEL = "Alibaba-NLP/gte-multilingual-base"
+
+# 导出/量化后的onnx模型存放目录
+ONNX_MODEL_FOLDER = os.path.join("storage", "embeddings")
+
+# 预热时使用的文本
+WARM_UP_TEXTS = ["LLMOps 本地文本嵌入模型预热", "warm up local embeddings model"]
+
+
+class _TorchEngine:
+    """基于sentence-transformers的PyTorch推理引擎"""
+
+    def __init__(self, model_name: str, cache_folder: str, max_seq_length: int):
+        from sentence_transformers import SentenceTransformer
+
+        self.model = SentenceTransformer(
+            model_name,
+            cache_folder=cache_folder,
+            device="cpu",
+            trust_remote_code=True,
+        )
+        self.model.max_seq_length = max_seq_length
+
+    def encode(self, texts: list[str]) -> np.ndarray:
+        return self.model.encode(
+            texts,
+            batch_size=len(texts),
+            normalize_embeddings=True,
+            convert_to_numpy=True,
+            show_progress_bar=False,
+        ).astype(np.float32)
+
+
+class _OnnxEngine:
+    """基于onnxruntime的推理引擎，首次使用时从PyTorch模型导出onnx模型，可选动态量化为int8"""
+
+    def __init__(
+            self, model_name: str, cache_folder: str, max_seq_length: int, num_threads: int, quantize: bool,
+    ):
+        import onnxruntime
+
+        # 1.加载分词器及池化配置，onnx模型只负责输出最后一层隐藏状态
+        torch_engine = _TorchEngine(model_name, cache_folder, max_seq_length)
+        self.tokenizer = torch_engine.model.tokenizer
+        self.max_seq_length = max_seq_length
+        self.pooling_cls = bool(getattr(torch_engine.model[1], "pooling_mode_cls_token", False))
+
+        # 2.导出(及量化)onnx模型，已存在时直接复用
+        model_path = self._export(torch_engine, model_name, quantize)
+        del torch_engine
+
+        # 3.创建推理会话并限制线程数
+        options = onnxruntime.SessionOptions()
+        options.intra_op_num_threads = num_threads
+        options.inter_op_num_threads = 1
+        options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = onnxruntime.InferenceSession(model_path, options, providers=["CPUExecutionProvider"])
+        self.input_names = {session_input.name for session_input in self.session.get_inputs()}
+
+    def encode(self, texts: list[str]) -> np.ndarray:
+        # 1.按文本长度排序后分词，减少同一批次内的填充长度
+        order = sorted(range(len(texts)), key=lambda index: len(texts[index]))
+        inputs = self.tokenizer(
+            [texts[index] for index in order],
+            padding=True,
+            truncation=True,
+            max_length=self.max_seq_length,
+            return_tensors="np",
+        )
+        feeds = {name: value.astype(np.int64) for name, value in inputs.items() if name in self.input_names}
+
+        # 2.执行推理并按池化配置计算句向量
+        last_hidden_state = self.session.run(None, feeds)[0]
+        if self.pooling_cls:
+            vectors = last_hidden_state[:, 0]
+        else:
+            mask = inputs["attention_mask"][..., None].astype(np.float32)
+            vectors = (last_hidden_state * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+
+        # 3.归一化后还原输入顺序
+        vectors = vectors / np.clip(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12, None)
+        result = np.empty_like(vectors, dtype=np.float32)
+        result[order] = vectors
+        return result
+
+    @classmethod
+    def _export(cls, torch_engine: _TorchEngine, model_name: str, quantize: bool) -> str:
+        """将PyTorch模型导出为onnx模型，quantize为True时再使用动态量化生成int8模型，返回最终使用的模型路径"""
+        import torch
+
+        os.makedirs(ONNX_MODEL_FOLDER, exist_ok=True)
+        base_name = model_name.replace("/", "--")
+        fp32_path = os.path.join(ONNX_MODEL_FOLDER, f"{base_name}.onnx")
+        int8_path = os.path.join(ONNX_MODEL_FOLDER, f"{base_name}-int8.onnx")
+
+        # 1.导出onnx模型，只输出最后一层隐藏状态，批次及序列长度均为动态维度
+        if not os.path.exists(fp32_path):
+            transformer = torch_engine.model[0].auto_model.eval()
+
+            class _Wrapper(torch.nn.Module):
+                def __init__(self, model: torch.nn.Module):
+                    super().__init__()
+                    self.model = model
+
+                def forward(self, input_ids, attention_mask):
+                    return self.model(input_ids=input_ids, attention_mask=attention_mask)[0]
+
+            dummy = torch_engine.model.tokenizer(WARM_UP_TEXTS, padding=True, return_tensors="pt")
+            with torch.no_grad():
+                torch.onnx.export(
+                    _Wrapper(transformer),
+                    (dummy["input_ids"], dummy["attention_mask"]),
+                    fp32_path,
+                    input_names=["input_ids", "attention_mask"],
+                    output_names=["last_hidden_state"],
+                    dynamic_axes={
+                        "input_ids": {0: "batch", 1: "sequence"},
+                        "attention_mask": {0: "batch", 1: "sequence"},
+                        "last_hidden_state": {0: "batch", 1: "sequence"},
+                    },
+                    opset_version=14,
+                )
+            logging.info("本地文本嵌入模型导出onnx完成，路径：%(path)s", {"path": fp32_path})
+
+        # 2.动态量化为int8模型
+        if quantize and not os.path.exists(int8_path):
+            from onnxruntime.quantization import quantize_dynamic, QuantType
+
+            quantize_dynamic(fp32_path, int8_path, weight_type=QuantType.QInt8)
+            logging.info("本地文本嵌入模型int8量化完成，路径：%(path)s", {"path": int8_path})
+
+        return int8_path if quantize else fp32_path
+
+
+class LocalEmbeddings(Embeddings):
+    """本地CPU文本嵌入模型，支持PyTorch及onnx(可选int8量化)两种推理运行时，并发的嵌入请求会被动态合并成批次推理"""
+
+    def __init__(
+            self,
+            model_name: str = LOCAL_EMBEDDINGS_MODEL,
+            cache_folder: Optional[str] = None,
+            runtime: str = "torch",
+            quantize: bool = False,
+            num_threads: Optional[int] = None,
+            max_batch_size: int = 32,
+            max_wait_ms: float = 10,
+            max_seq_length: int = 1024,
+    ):
+        """构造函数，加载模型并启动动态批处理器"""
+        import torch
+
+        # 1.限制推理使用的线程数，避免与进程内其他计算争抢CPU
+        self.model_name = model_name
+        self.runtime = runtime
+        self.quantize = quantize and runtime == "onnx"
+        num_threads = num_threads or os.cpu_count() or 1
+        torch.set_num_threads(num_threads)
+
+        # 2.根据运行时创建推理引擎
+        cache_folder = cache_folder or os.path.join(os.getcwd(), "internal", "core", "embeddings")
+        if runtime == "onnx":
+            engine = _OnnxEngine(model_name, cache_folder, max_seq_length, num_threads, self.quantize)
+        else:
+            engine = _TorchEngine(model_name, cache_folder, max_seq_length)
+
+        # 3.创建动态批处理器，所有请求都经由批处理器推理
+        self._batcher = DynamicBatcher(lambda texts: engine.encode(texts).tolist(), max_batch_size, max_wait_ms)
+        self._warmed_up = False
+
+    @property
+    def namespace(self) -> str:
+        """嵌入缓存的命名空间，不同模型及运行时计算的向量不能混用"""
+        suffix = f"{self.runtime}-int8" if self.quantize else self.runtime
+        return f"embeddings:{self.model_name.replace('/', '--')}:{suffix}"
+
+    def warm_up(self) -> None:
+        """预热模型，在worker启动时完成模型加载及首次推理，避免首个请求承担冷启动的耗时"""
+        if self._warmed_up:
+            return
+        start_at = time.perf_counter()
+        self.embed_documents(WARM_UP_TEXTS)
+        self._warmed_up = True
+        logging.info(
+            "本地文本嵌入模型预热完成，耗时：%(elapsed).2fs",
+            {"elapsed": time.perf_counter() - start_at},
+        )
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        """批量计算文本列表的向量"""
+        return self._batcher.submit(list(texts))
+
+    def embed_query(self, text: str) -> list[float]:
+        """计算单条查询文本的向量"""
+        return self.embed_documents([text])[0]
+
+
+@lru_cache(maxsize=None)
+def _create_local_embeddings(
+        model_name: str, runtime: str, quantize: bool, num_threads: int, max_batch_size: int, max_wait_ms: float,
+        max_seq_length: int,
+) -> LocalEmbeddings:
+    """按配置创建本地文本嵌入模型，同一进程内相同配置只加载一次"""
+    return LocalEmbeddings(
+        model_name=model_name,
+        runtime=runtime,
+        quantize=quantize,
+        num_threads=num_threads,
+        max_batch_size=max_batch_size,
+        max_wait_ms=max_wait_ms,
+        max_seq_length=max_seq_length,
+    )
+
+
+def get_local_embeddings() -> LocalEmbeddings:
+    """根据环境变量获取进程内共享的本地文本嵌入模型"""
+    return _create_local_embeddings(
+        os.getenv("LOCAL_EMBEDDINGS_MODEL", LOCAL_EMBEDDINGS_MODEL),
+        os.getenv("LOCAL_EMBEDDINGS_RUNTIME", "torch"),
+        os.getenv("LOCAL_EMBEDDINGS_QUANTIZE", "false").lower() == "true",
+        int(os.getenv("LOCAL_EMBEDDINGS_NUM_THREADS", os.cpu_count() or 1)),
+        int(os.getenv("LOCAL_EMBEDDINGS_BATCH_SIZE", 32)),
+        float(os.getenv("LOCAL_EMBEDDINGS_MAX_WAIT_MS", 10)),
+        int(os.getenv("LOCAL_EMBEDDINGS_MAX_SEQ_LENGTH", 1024)),
+    )
@@ -0,0 +1,142 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+@Time    : 2024/12/21 10:18
+@Author  : thezehui@gmail.com
+@File    : tiered_byte_store.py
+"""
+import logging
+import time
+from collections import OrderedDict, Counter
+from functools import lru_cache
+from threading import Lock
+from typing import Iterator, Optional, Sequence
+
+from langchain_core.stores import ByteStore
+from redis import Redis
+
+# 命中统计同步到redis的最小间隔，单位为秒
+STATS_FLUSH_INTERVAL = 10
+
+
+class LRUByteCache:
+    """进程内LRU字节缓存，按缓存值的字节数而不是条数限制容量，同一进程内的所有线程共享"""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.stats: Counter = Counter()
+        self.stats_flushed_at = time.monotonic()
+        self._data: OrderedDict[str, bytes] = OrderedDict()
+        self._lock = Lock()
+
+    def get_many(self, keys: Sequence[str]) -> list[Optional[bytes]]:
+        """批量读取缓存，命中的记录会移动到最近使用的位置"""
+        values = []
+        with self._lock:
+            for key in keys:
+                value = self._data.get(key)
+                if value is not None:
+                    self._data.move_to_end(key)
+                values.append(value)
+        return values
+
+    def set_many(self, key_value_pairs: Sequence[tuple[str, bytes]]) -> None:
+        """批量写入缓存，超出容量时淘汰最久未使用的记录，单条超过容量的记录不缓存"""
+        with self._lock:
+            for key, value in key_value_pairs:
+                if len(value) > self.max_bytes:
+                    continue
+                previous = self._data.pop(key, None)
+                if previous is not None:
+                    self.size -= len(previous)
+                self._data[key] = value
+                self.size += len(value)
+            while self.size > self.max_bytes:
+                _, evicted = self._data.popitem(last=False)
+                self.size -= len(evicted)
+
+    def delete_many(self, keys: Sequence[str]) -> None:
+        """批量删除缓存"""
+        with self._lock:
+            for key in keys:
+                value = self._data.pop(key, None)
+                if value is not None:
+                    self.size -= len(value)
+
+
+@lru_cache(maxsize=None)
+def get_lru_byte_cache(max_bytes: int) -> LRUByteCache:
+    """获取进程内共享的LRU字节缓存"""
+    return LRUByteCache(max_bytes)
+
+
+class TieredByteStore(ByteStore):
+    """两级字节存储，进程内LRU缓存在前，远端存储(redis)在后，读取时逐级查找并回填，写入时同时写两级"""
+
+    def __init__(
+            self,
+            local: LRUByteCache,
+            remote: ByteStore,
+            redis_client: Optional[Redis] = None,
+            stats_key: Optional[str] = None,
+    ):
+        self.local = local
+        self.remote = remote
+        self.redis_client = redis_client
+        self.stats_key = stats_key
+
+    def mget(self, keys: Sequence[str]) -> list[Optional[bytes]]:
+        """批量读取，进程内缓存未命中的键再一次性从远端存储读取，并回填进程内缓存"""
+        values = self.local.get_many(keys)
+        missing = [index for index, value in enumerate(values) if value is None]
+        if missing:
+            remote_values = self.remote.mget([keys[index] for index in missing])
+            for index, value in zip(missing, remote_values):
+                values[index] = value
+            self.local.set_many([(keys[index], values[index]) for index in missing if values[index] is not None])
+
+        # 统计各级缓存的命中数，按键的前缀(命名空间:类型)分别统计
+        missing_indexes = set(missing)
+        for index, (key, value) in enumerate(zip(keys, values)):
+            prefix = key.rsplit(":", 1)[0]
+            if index not in missing_indexes:
+                self.local.stats[f"{prefix}:local_hit"] += 1
+            elif value is not None:
+                self.local.stats[f"{prefix}:remote_hit"] += 1
+            else:
+                self.local.stats[f"{prefix}:miss"] += 1
+        self._flush_stats()
+
+        return values
+
+    def mset(self, key_value_pairs: Sequence[tuple[str, bytes]]) -> None:
+        """批量写入远端存储及进程内缓存"""
+        self.remote.mset(key_value_pairs)
+        self.local.set_many(key_value_pairs)
+
+    def mdelete(self, keys: Sequence[str]) -> None:
+        """批量删除两级存储中的数据"""
+        self.remote.mdelete(keys)
+        self.local.delete_many(keys)
+
+    def yield_keys(self, *, prefix: Optional[str] = None) -> Iterator[str]:
+        """遍历远端存储中的键，进程内缓存是远端存储的子集"""
+        yield from self.remote.yield_keys(prefix=prefix)
+
+    def _flush_stats(self) -> None:
+        """按间隔将进程内累计的命中统计同步到redis哈希表，避免每次读取都额外访问redis"""
+        if self.redis_client is None or self.stats_key is None:
+            return
+        if time.monotonic() - self.local.stats_flushed_at < STATS_FLUSH_INTERVAL:
+            return
+
+        stats = self.local.stats
+        self.local.stats, self.local.stats_flushed_at = Counter(), time.monotonic()
+        try:
+            pipeline = self.redis_client.pipeline()
+            for field, count in stats.items():
+                pipeline.hincrby(self.stats_key, field, count)
+            pipeline.execute()
+        except Exception as e:
+            logging.warning("同步文本嵌入缓存命中统计失败，错误信息：%(error)s", {"error": e})
@@ -0,0 +1,55 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+@Time    : 2024/12/21 16:40
+@Author  : thezehui@gmail.com
+@File    : vector_codec.py
+"""
+import struct
+from typing import Union
+
+import numpy as np
+
+# 二进制向量的格式标记，存放在编码结果的首字节
+FORMAT_FLOAT32 = 1
+FORMAT_FLOAT16 = 2
+FORMAT_INT8 = 3
+
+# 编码格式名字与格式标记的映射
+FORMATS = {
+    "float32": FORMAT_FLOAT32,
+    "float16": FORMAT_FLOAT16,
+    "int8": FORMAT_INT8,
+}
+
+# int8格式在格式标记之后使用4字节的float32存储缩放系数
+INT8_SCALE_STRUCT = struct.Struct("<f")
+
+
+def encode_vector(vector: Union[list[float], np.ndarray], dtype: str = "float32") -> bytes:
+    """将向量编码为紧凑的二进制格式，支持float32、float16以及带缩放系数的int8"""
+    array = np.asarray(vector, dtype=np.float32)
+    fmt = FORMATS[dtype]
+    if fmt == FORMAT_FLOAT32:
+        return bytes([fmt]) + array.astype("<f4").tobytes()
+    if fmt == FORMAT_FLOAT16:
+        return bytes([fmt]) + array.astype("<f2").tobytes()
+
+    # int8使用对称量化，缩放系数为绝对值最大值/127
+    scale = float(np.abs(array).max()) / 127 if array.size else 0.0
+    quantized = np.round(array / scale) if scale > 0 else np.zeros_like(array)
+    return bytes([fmt]) + INT8_SCALE_STRUCT.pack(scale) + quantized.astype(np.int8).tobytes()
+
+
+def decode_vector(value: bytes) -> np.ndarray:
+    """解码二进制向量，float32格式直接基于原始字节构建只读数组，不发生数据拷贝"""
+    fmt = value[0]
+    if fmt == FORMAT_FLOAT32:
+        return np.frombuffer(value, dtype="<f4", offset=1)
+    if fmt == FORMAT_FLOAT16:
+        return np.frombuffer(value, dtype="<f2", offset=1).astype(np.float32)
+    if fmt == FORMAT_INT8:
+        scale, = INT8_SCALE_STRUCT.unpack_from(value, 1)
+        return np.frombuffer(value, dtype=np.int8, offset=1 + INT8_SCALE_STRUCT.size).astype(np.float32) * scale
+
+    raise ValueError(f"未知的向量编码格式: {fmt}")
@@ -0,0 +1,11 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+@Time    : 2024/12/24 14:00
+@Author  : thezehui@gmail.com
+@File    : __init__.py.py
+"""
+from .base_vector_backend import BaseVectorBackend
+from .weaviate_vector_backend import WeaviateVectorBackend
+
+__all__ = ["BaseVectorBackend", "WeaviateVectorBackend"]
@@ -0,0 +1,56 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+@Time    : 2024/12/24 14:02
+@Author  : thezehui@gmail.com
+@File    : base_vector_backend.py
+"""
+from abc import ABC, abstractmethod
+from typing import Union
+from uuid import UUID
+
+from langchain_core.documents import Document as LCDocument
+
+
+class BaseVectorBackend(ABC):
+    """知识库向量数据库后端基类，所有记录的元数据都包含account_id/dataset_id/document_id/segment_id/node_id，
+    启用/禁用状态不写入向量数据库，检索时由排除集合过滤"""
+
+    @abstractmethod
+    def get_vectors(self, node_ids: list[str]) -> dict[str, list[float]]:
+        """根据传递的节点id列表批量获取已存储的向量，不存在的节点会被忽略"""
+        raise NotImplementedError
+
+    @abstractmethod
+    def insert_documents_with_vectors(
+            self, lc_documents: list[LCDocument], vectors: list[list[float]], ids: list[str],
+    ) -> dict[int, str]:
+        """批量写入LangChain文档及对应的向量，返回写入失败的 文档下标->错误信息 映射"""
+        raise NotImplementedError
+
+    @abstractmethod
+    def update_document(self, node_id: str, text: str, vector: list[float]) -> None:
+        """更新指定节点的文本及向量"""
+        raise NotImplementedError
+
+    @abstractmethod
+    def delete_documents(self, ids: list[str]) -> None:
+        """根据传递的节点id列表批量删除记录"""
+        raise NotImplementedError
+
+    @abstractmethod
+    def delete_by_document(self, dataset_id: Union[UUID, str], document_id: Union[UUID, str]) -> None:
+        """删除指定文档下的所有记录"""
+        raise NotImplementedError
+
+    @abstractmethod
+    def delete_by_dataset(self, dataset_id: Union[UUID, str]) -> None:
+        """删除指定知识库下的所有记录"""
+        raise NotImplementedError
+
+    @abstractmethod
+    def similarity_search_with_relevance_scores(
+            self, query: str, k: int, dataset_ids: list[Union[UUID, str]], **kwargs,
+    ) -> list[tuple[LCDocument, float]]:
+        """在传递的知识库列表中执行相似性检索，返回 (文档, 0-1的相关性得分) 列表，支持score_threshold过滤"""
+        raise NotImplementedError
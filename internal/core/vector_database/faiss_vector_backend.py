@@ -0,0 +1,546 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+@Time    : 2024/12/24 15:10
+@Author  : thezehui@gmail.com
+@File    : faiss_vector_backend.py
+"""
+import json
+import logging
+import os
+import shutil
+import sqlite3
+import time
+from contextlib import contextmanager
+from threading import Lock
+from typing import Iterator, Optional, Union
+from uuid import UUID
+
+import faiss
+import numpy as np
+from langchain_core.documents import Document as LCDocument
+from langchain_core.embeddings import Embeddings
+from redis import Redis
+
+from internal.entity.cache_entity import LOCK_EXPIRE_TIME, LOCK_VECTOR_DATABASE_SHARD
+from .base_vector_backend import BaseVectorBackend
+
+# 分片目录中存储记录及索引段清单的sqlite文件名，索引段清单与记录在同一个事务中提交
+PAYLOAD_FILE = "payload.sqlite3"
+
+# 存储目录中记录 节点id->知识库id 映射的sqlite文件名，用于按节点id定位分片
+NODE_DATASET_FILE = "node_dataset.sqlite3"
+
+# 墓碑(已删除但尚未从索引段中移除的向量)数量超过该值且超过向量总数的20%时合并全部索引段
+COMPACT_MIN_TOMBSTONES = 1000
+COMPACT_TOMBSTONE_RATIO = 0.2
+
+# 最新的索引段大小达到前一个索引段的该比例时两者合并，索引段数量保持在对数级，每个向量被重写的次数也为对数级
+MERGE_SEGMENT_RATIO = 0.5
+
+# 进程内已加载的只读索引段，键为分片目录，值为 索引段文件名->索引，索引段写入后不会再修改
+_loaded_segments: dict[str, dict[str, faiss.Index]] = {}
+_loaded_segments_lock = Lock()
+
+
+@contextmanager
+def _connect(db_path: str) -> Iterator[sqlite3.Connection]:
+    """打开sqlite连接，使用WAL模式使检索时的读取不阻塞写入，正常退出时提交事务，异常时回滚，最后关闭连接"""
+    conn = sqlite3.connect(db_path, timeout=LOCK_EXPIRE_TIME)
+    try:
+        conn.execute("PRAGMA journal_mode=WAL")
+        with conn:
+            yield conn
+    finally:
+        conn.close()
+
+
+def _select_in(conn: sqlite3.Connection, sql: str, values: list, batch_size: int = 500) -> list[tuple]:
+    """分批执行 IN (...) 查询，避免超出sqlite的参数个数限制"""
+    rows = []
+    for i in range(0, len(values), batch_size):
+        batch = values[i:i + batch_size]
+        rows.extend(conn.execute(sql.format(", ".join("?" * len(batch))), batch).fetchall())
+    return rows
+
+
+def _execute_in(conn: sqlite3.Connection, sql: str, values: list, batch_size: int = 500) -> None:
+    """分批执行 IN (...) 写入语句，避免超出sqlite的参数个数限制"""
+    for i in range(0, len(values), batch_size):
+        batch = values[i:i + batch_size]
+        conn.execute(sql.format(", ".join("?" * len(batch))), batch)
+
+
+class FaissShard:
+    """单个知识库的faiss分片，向量归一化后使用内积(余弦相似度)检索，由若干只追加的索引段及存储记录的sqlite组成，
+    写入时只新增较小的索引段，删除时只删除记录(向量成为墓碑)，索引段按大小逐级合并，墓碑过多时整体合并"""
+
+    def __init__(self, path: str, manifest: dict, indexes: dict[str, faiss.Index]):
+        """构造函数，manifest为索引段清单，indexes为已加载的 索引段文件名->索引"""
+        self.path = path
+        self.next_id: int = manifest.get("next_id", 0)
+        self.live_count: int = manifest.get("live_count", 0)
+        self.segments: list[dict] = manifest.get("segments", [])
+        self.indexes = indexes
+
+    @property
+    def manifest(self) -> dict:
+        """索引段清单，每个索引段对应一个连续的id区间 [start, end)"""
+        return {"next_id": self.next_id, "live_count": self.live_count, "segments": self.segments}
+
+    @property
+    def tombstones(self) -> int:
+        """索引段中已删除记录的向量数"""
+        return sum(segment["ntotal"] for segment in self.segments) - self.live_count
+
+    @classmethod
+    def create_index(cls, dimension: int, index_type: str, hnsw_m: int) -> faiss.Index:
+        """创建空索引，hnsw为近似检索，flat为精确检索，均包装成支持自定义id及按id重建向量的IndexIDMap2"""
+        if index_type == "flat":
+            base_index = faiss.IndexFlatIP(dimension)
+        else:
+            base_index = faiss.IndexHNSWFlat(dimension, hnsw_m, faiss.METRIC_INNER_PRODUCT)
+        return faiss.IndexIDMap2(base_index)
+
+    @classmethod
+    def read_manifest(cls, conn: sqlite3.Connection) -> Optional[dict]:
+        """读取已提交的索引段清单，分片尚未写入过时返回None"""
+        row = conn.execute("SELECT value FROM meta WHERE key = 'manifest'").fetchone()
+        return json.loads(row[0]) if row else None
+
+    def get_index(self, segment: dict) -> faiss.Index:
+        """获取索引段对应的索引，未加载时以mmap方式加载共享操作系统页缓存，不支持mmap的索引类型回退到完整读取"""
+        name = segment["name"]
+        if name not in self.indexes:
+            index_path = os.path.join(self.path, name)
+            if not os.path.exists(index_path):
+                raise FileNotFoundError(index_path)
+            try:
+                self.indexes[name] = faiss.read_index(index_path, faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY)
+            except RuntimeError:
+                self.indexes[name] = faiss.read_index(index_path)
+        return self.indexes[name]
+
+    def reconstruct(self, conn: sqlite3.Connection, node_ids: list[str]) -> dict[str, list[float]]:
+        """根据节点id列表获取已存储的向量，不存在的节点会被忽略"""
+        vectors = {}
+        for node_id, id in _select_in(conn, "SELECT node_id, id FROM documents WHERE node_id IN ({})", node_ids):
+            segment = next((segment for segment in self.segments if segment["start"] <= id < segment["end"]), None)
+            if segment is not None:
+                vectors[node_id] = self.get_index(segment).reconstruct(id).tolist()
+        return vectors
+
+    def search(
+            self, conn: sqlite3.Connection, vector: np.ndarray, k: int, ef_search: int,
+    ) -> list[tuple[LCDocument, float]]:
+        """在每个索引段中检索最相似的前k条记录后合并，会多召回墓碑数量的记录并剔除已删除的记录"""
+        if self.live_count == 0 or k <= 0:
+            return []
+
+        # 1.每个索引段多召回墓碑数量的记录，保证剔除已删除的记录后仍有k条
+        candidates = []
+        for segment in self.segments:
+            index = self.get_index(segment)
+            fetch_k = min(k + self.tombstones, index.ntotal)
+            if fetch_k <= 0:
+                continue
+            params = faiss.SearchParametersHNSW(efSearch=max(ef_search, fetch_k)) if isinstance(
+                faiss.downcast_index(index.index), faiss.IndexHNSW,
+            ) else None
+            scores, ids = index.search(vector.reshape(1, -1), fetch_k, params=params)
+            candidates.extend((score, id) for score, id in zip(scores[0].tolist(), ids[0].tolist()) if id >= 0)
+        candidates.sort(key=lambda item: item[0], reverse=True)
+
+        # 2.批量读取候选记录，已删除的记录不存在
+        documents = {
+            id: (text, json.loads(metadata))
+            for id, text, metadata in _select_in(
+                conn, "SELECT id, text, metadata FROM documents WHERE id IN ({})", [id for _, id in candidates],
+            )
+        }
+
+        # 3.将余弦相似度作为相关性得分，并截取到0-1之间
+        results = []
+        for score, id in candidates:
+            if id not in documents:
+                continue
+            text, metadata = documents[id]
+            results.append((
+                LCDocument(page_content=text, metadata={**metadata, "text": text}),
+                min(max(score, 0.0), 1.0),
+            ))
+            if len(results) >= k:
+                break
+        return results
+
+
+class FaissVectorBackend(BaseVectorBackend):
+    """嵌入式faiss向量数据库后端，每个知识库一个分片，写入在缓存锁内只追加记录及新的索引段，检索时只读加载，
+    节点id->知识库id 的映射与分片存储在同一个目录的sqlite中，不依赖redis中的数据"""
+
+    def __init__(
+            self,
+            folder_path: str,
+            embedding: Embeddings,
+            redis_client: Redis,
+            index_type: str = "hnsw",
+            hnsw_m: int = 32,
+            ef_search: int = 64,
+    ):
+        """构造函数，传递分片存储目录、文本嵌入模型、redis客户端(用于分片写入锁)及索引参数"""
+        self.folder_path = folder_path
+        self.embedding = embedding
+        self.redis_client = redis_client
+        self.index_type = index_type
+        self.hnsw_m = hnsw_m
+        self.ef_search = ef_search
+
+    def get_vectors(self, node_ids: list[str]) -> dict[str, list[float]]:
+        # 1.通过节点所属知识库的映射定位分片
+        vectors = {}
+        for dataset_id, dataset_node_ids in self._group_by_dataset(node_ids).items():
+            # 2.在分片中按id重建向量
+            with self._read_shard(dataset_id) as (conn, shard):
+                if shard is not None:
+                    vectors.update(shard.reconstruct(conn, dataset_node_ids))
+        return vectors
+
+    def insert_documents_with_vectors(
+            self, lc_documents: list[LCDocument], vectors: list[list[float]], ids: list[str],
+    ) -> dict[int, str]:
+        if not lc_documents:
+            return {}
+
+        # 1.按知识库分组，每个知识库的分片只写入一次
+        groups: dict[str, list[int]] = {}
+        for index, lc_document in enumerate(lc_documents):
+            lc_document.metadata["node_id"] = str(ids[index])
+            groups.setdefault(str(lc_document.metadata["dataset_id"]), []).append(index)
+
+        # 2.逐个分片写入，失败的分片记录错误信息，便于调用方只重试失败的部分
+        errors = {}
+        for dataset_id, indexes in groups.items():
+            try:
+                with self._write_shard(dataset_id) as writer:
+                    writer.add([lc_documents[i] for i in indexes], self._normalize([vectors[i] for i in indexes]))
+            except Exception as e:
+                logging.exception("写入faiss分片失败，知识库id：%(dataset_id)s，错误信息：%(error)s", {
+                    "dataset_id": dataset_id, "error": e,
+                })
+                errors.update({i: str(e) for i in indexes})
+        return errors
+
+    def update_document(self, node_id: str, text: str, vector: list[float]) -> None:
+        for dataset_id in self._group_by_dataset([node_id]).keys():
+            with self._write_shard(dataset_id) as writer:
+                metadata = writer.get_metadata(str(node_id))
+                if metadata is not None:
+                    writer.add([LCDocument(page_content=text, metadata=metadata)], self._normalize([vector]))
+
+    def delete_documents(self, ids: list[str]) -> None:
+        for dataset_id, dataset_node_ids in self._group_by_dataset(ids).items():
+            with self._write_shard(dataset_id) as writer:
+                writer.remove(dataset_node_ids)
+
+    def delete_by_document(self, dataset_id: Union[UUID, str], document_id: Union[UUID, str]) -> None:
+        with self._write_shard(str(dataset_id)) as writer:
+            writer.remove_document(str(document_id))
+
+    def delete_by_dataset(self, dataset_id: Union[UUID, str]) -> None:
+        path = self._get_shard_path(str(dataset_id))
+        with self.redis_client.lock(LOCK_VECTOR_DATABASE_SHARD.format(dataset_id=dataset_id), LOCK_EXPIRE_TIME):
+            shutil.rmtree(path, ignore_errors=True)
+            with _loaded_segments_lock:
+                _loaded_segments.pop(path, None)
+            with self._connect_node_dataset() as conn:
+                conn.execute("DELETE FROM node_dataset WHERE dataset_id = ?", (str(dataset_id),))
+
+    def similarity_search_with_relevance_scores(
+            self, query: str, k: int, dataset_ids: list[Union[UUID, str]], **kwargs,
+    ) -> list[tuple[LCDocument, float]]:
+        # 1.计算查询向量，并在每个知识库的分片中检索后按得分合并
+        vector = self._normalize([self.embedding.embed_query(query)])[0]
+        results = []
+        for dataset_id in dataset_ids:
+            with self._read_shard(str(dataset_id)) as (conn, shard):
+                if shard is not None:
+                    results.extend(shard.search(conn, vector, k, self.ef_search))
+        results = sorted(results, key=lambda item: item[1], reverse=True)[:k]
+
+        # 2.按最小相关性得分过滤
+        score_threshold = kwargs.get("score_threshold")
+        if score_threshold is not None:
+            results = [(lc_document, score) for lc_document, score in results if score >= score_threshold]
+        return results
+
+    @contextmanager
+    def _read_shard(self, dataset_id: str) -> Iterator[tuple[Optional[sqlite3.Connection], Optional[FaissShard]]]:
+        """获取知识库的只读分片及记录库连接，同一进程内复用已加载的索引段，分片尚未创建时返回 (None, None)"""
+        path = self._get_shard_path(dataset_id)
+        if not os.path.exists(os.path.join(path, PAYLOAD_FILE)):
+            yield None, None
+            return
+
+        with _connect(os.path.join(path, PAYLOAD_FILE)) as conn:
+            # 1.在同一个读事务中读取索引段清单及记录，两者属于同一个已提交的版本
+            conn.execute("BEGIN")
+            try:
+                shard = self._load_shard(conn, path)
+            except FileNotFoundError:
+                # 读取清单后索引段恰好被合并并清理，此时重新读取一次清单
+                conn.rollback()
+                conn.execute("BEGIN")
+                shard = self._load_shard(conn, path)
+            yield conn, shard
+
+    @classmethod
+    def _load_shard(cls, conn: sqlite3.Connection, path: str) -> Optional[FaissShard]:
+        """根据已提交的索引段清单加载分片，复用进程内已加载的索引段，并释放已被合并的索引段"""
+        manifest = FaissShard.read_manifest(conn)
+        if manifest is None:
+            return None
+
+        names = {segment["name"] for segment in manifest["segments"]}
+        with _loaded_segments_lock:
+            indexes = {name: index for name, index in _loaded_segments.get(path, {}).items() if name in names}
+            _loaded_segments[path] = indexes
+        shard = FaissShard(path, manifest, indexes)
+        for segment in shard.segments:
+            shard.get_index(segment)
+        return shard
+
+    def _write_shard(self, dataset_id: str) -> "_ShardWriter":
+        """获取分片写入上下文，在缓存锁内修改记录并追加索引段，退出时在同一个事务中提交记录及索引段清单"""
+        return _ShardWriter(self, dataset_id)
+
+    def _group_by_dataset(self, node_ids: list[str]) -> dict[str, list[str]]:
+        """根据节点id查询所属知识库，返回 知识库id->节点id列表，不存在映射的节点会被忽略"""
+        node_ids = [str(node_id) for node_id in node_ids]
+        if not node_ids or not os.path.exists(os.path.join(self.folder_path, NODE_DATASET_FILE)):
+            return {}
+        groups: dict[str, list[str]] = {}
+        with self._connect_node_dataset() as conn:
+            for node_id, dataset_id in _select_in(
+                    conn, "SELECT node_id, dataset_id FROM node_dataset WHERE node_id IN ({})", node_ids,
+            ):
+                groups.setdefault(dataset_id, []).append(node_id)
+        return groups
+
+    @contextmanager
+    def _connect_node_dataset(self) -> Iterator[sqlite3.Connection]:
+        """打开 节点id->知识库id 映射库的连接"""
+        os.makedirs(self.folder_path, exist_ok=True)
+        with _connect(os.path.join(self.folder_path, NODE_DATASET_FILE)) as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS node_dataset (node_id TEXT PRIMARY KEY, dataset_id TEXT NOT NULL)",
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_node_dataset_dataset_id ON node_dataset (dataset_id)")
+            yield conn
+
+    def _get_shard_path(self, dataset_id: str) -> str:
+        """获取知识库分片的存储目录"""
+        return os.path.join(self.folder_path, f"dataset_{dataset_id}")
+
+    @classmethod
+    def _normalize(cls, vectors: list[list[float]]) -> np.ndarray:
+        """将向量转换成float32并做L2归一化，内积即为余弦相似度"""
+        vectors = np.ascontiguousarray(np.asarray(vectors, dtype=np.float32))
+        faiss.normalize_L2(vectors)
+        return vectors
+
+
+class _ShardWriter:
+    """分片写入上下文，写入操作在知识库的缓存锁内串行执行，只追加新的索引段，检索中的只读分片在提交前不受影响"""
+
+    def __init__(self, backend: FaissVectorBackend, dataset_id: str):
+        self.backend = backend
+        self.dataset_id = dataset_id
+        self.path = backend._get_shard_path(dataset_id)
+        self.lock = backend.redis_client.lock(
+            LOCK_VECTOR_DATABASE_SHARD.format(dataset_id=dataset_id), LOCK_EXPIRE_TIME,
+        )
+        self.conn: Optional[sqlite3.Connection] = None
+        self.added_node_ids: list[str] = []
+        self.removed_node_ids: list[str] = []
+        self.written: list[str] = []
+
+    def __enter__(self) -> "_ShardWriter":
+        self.lock.acquire()
+        try:
+            # 1.打开记录库并开启写事务，本次写入的记录及索引段清单在退出时一次提交
+            os.makedirs(self.path, exist_ok=True)
+            self.conn = sqlite3.connect(os.path.join(self.path, PAYLOAD_FILE), timeout=LOCK_EXPIRE_TIME)
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS documents ("
+                "id INTEGER PRIMARY KEY, node_id TEXT NOT NULL UNIQUE, document_id TEXT, text TEXT, metadata TEXT)",
+            )
+            self.conn.execute("CREATE INDEX IF NOT EXISTS idx_documents_document_id ON documents (document_id)")
+            self.conn.execute("BEGIN IMMEDIATE")
+
+            # 2.读取最新的索引段清单
+            self.shard = FaissShard(self.path, FaissShard.read_manifest(self.conn) or {}, {})
+            return self
+        except Exception:
+            self._close()
+            raise
+
+    def __exit__(self, exc_type, exc_val, exc_tb) -> None:
+        try:
+            if exc_type is None:
+                self._commit()
+        finally:
+            # 未提交时清理本次写入的索引段文件，提交后written已被清空
+            self._close()
+            self._remove_files(self.written)
+
+    def get_metadata(self, node_id: str) -> Optional[dict]:
+        """获取节点已存储的元数据，节点不存在时返回None"""
+        row = self.conn.execute("SELECT metadata FROM documents WHERE node_id = ?", (node_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def add(self, lc_documents: list[LCDocument], vectors: np.ndarray) -> None:
+        """写入文档及向量，已存在的节点会先被删除，向量写入新的索引段"""
+        node_ids = [str(lc_document.metadata["node_id"]) for lc_document in lc_documents]
+        self.remove(node_ids)
+
+        # 1.向量写入新的索引段，id从分片的next_id开始连续分配
+        ids = np.arange(self.shard.next_id, self.shard.next_id + len(lc_documents), dtype=np.int64)
+        index = FaissShard.create_index(vectors.shape[1], self.backend.index_type, self.backend.hnsw_m)
+        index.add_with_ids(vectors, ids)
+        self._append_segment(index, int(ids[0]), int(ids[-1]) + 1)
+
+        # 2.写入记录
+        self.conn.executemany(
+            "INSERT INTO documents (id, node_id, document_id, text, metadata) VALUES (?, ?, ?, ?, ?)",
+            [
+                (
+                    id,
+                    node_id,
+                    str(lc_document.metadata.get("document_id")),
+                    lc_document.page_content,
+                    json.dumps(lc_document.metadata, ensure_ascii=False, default=str),
+                )
+                for id, node_id, lc_document in zip(ids.tolist(), node_ids, lc_documents)
+            ],
+        )
+        self.shard.next_id += len(lc_documents)
+        self.shard.live_count += len(lc_documents)
+        self.added_node_ids.extend(node_ids)
+
+    def remove(self, node_ids: list[str]) -> list[str]:
+        """删除节点的记录，向量保留在索引段中作为墓碑，返回实际删除的节点id列表"""
+        return self._delete_documents([
+            node_id for node_id, in _select_in(
+                self.conn, "SELECT node_id FROM documents WHERE node_id IN ({})", [str(id) for id in node_ids],
+            )
+        ])
+
+    def remove_document(self, document_id: str) -> list[str]:
+        """删除指定文档的所有节点，返回删除的节点id列表"""
+        return self._delete_documents([
+            node_id for node_id, in self.conn.execute(
+                "SELECT node_id FROM documents WHERE document_id = ?", (document_id,),
+            )
+        ])
+
+    def _delete_documents(self, node_ids: list[str]) -> list[str]:
+        """删除记录并更新存活记录数"""
+        if node_ids:
+            _execute_in(self.conn, "DELETE FROM documents WHERE node_id IN ({})", node_ids)
+            self.shard.live_count -= len(node_ids)
+            self.removed_node_ids.extend(node_ids)
+        return node_ids
+
+    def _append_segment(self, index: faiss.Index, start: int, end: int) -> None:
+        """将索引写入新的索引段文件并追加到清单，不包含任何向量的索引段直接丢弃"""
+        if index.ntotal == 0:
+            return
+        name = f"{time.time_ns()}.faiss"
+        faiss.write_index(index, os.path.join(self.path, name))
+        self.written.append(name)
+        self.shard.segments.append({"name": name, "start": start, "end": end, "ntotal": index.ntotal})
+        self.shard.indexes[name] = index
+
+    def _merge_segments(self) -> None:
+        """墓碑过多时合并全部索引段，否则逐级合并末尾大小相近的索引段"""
+        total = sum(segment["ntotal"] for segment in self.shard.segments)
+        threshold = max(COMPACT_MIN_TOMBSTONES, total * COMPACT_TOMBSTONE_RATIO)
+        if self.shard.segments and self.shard.tombstones >= threshold:
+            self._merge(0, len(self.shard.segments))
+            return
+
+        segments = self.shard.segments
+        while len(segments) >= 2 and segments[-1]["ntotal"] >= segments[-2]["ntotal"] * MERGE_SEGMENT_RATIO:
+            self._merge(len(segments) - 2, len(segments))
+            segments = self.shard.segments
+
+    def _merge(self, begin: int, end: int) -> None:
+        """只使用存活记录的向量将 [begin, end) 区间的索引段重建为一个索引段，被合并的索引段id区间连续"""
+        # 1.读取区间内存活记录的id
+        segments, tail = self.shard.segments[begin:end], self.shard.segments[end:]
+        start, stop = segments[0]["start"], segments[-1]["end"]
+        live_ids = np.array([
+            id for id, in self.conn.execute("SELECT id FROM documents WHERE id >= ? AND id < ?", (start, stop))
+        ], dtype=np.int64)
+
+        # 2.从各个索引段中取出存活记录的向量
+        ids, vectors = [], []
+        for segment in segments:
+            index = self.shard.get_index(segment)
+            segment_ids = faiss.vector_to_array(index.id_map).astype(np.int64)
+            mask = np.isin(segment_ids, live_ids)
+            ids.append(segment_ids[mask])
+            vectors.append(index.index.reconstruct_n(0, index.ntotal)[mask])
+
+        # 3.写入新的索引段并替换清单中被合并的索引段
+        index = FaissShard.create_index(vectors[0].shape[1], self.backend.index_type, self.backend.hnsw_m)
+        index.add_with_ids(np.vstack(vectors), np.concatenate(ids))
+        self.shard.segments = self.shard.segments[:begin]
+        self._append_segment(index, start, stop)
+        self.shard.segments.extend(tail)
+
+    def _commit(self) -> None:
+        """合并索引段后在同一个事务中提交记录及索引段清单，并更新 节点id->知识库id 映射、清理不再使用的索引段文件"""
+        # 1.新增节点的映射在提交分片之前写入，进程异常退出时最多残留指向不存在节点的映射
+        if self.added_node_ids:
+            with self.backend._connect_node_dataset() as conn:
+                conn.executemany(
+                    "INSERT OR REPLACE INTO node_dataset (node_id, dataset_id) VALUES (?, ?)",
+                    [(node_id, self.dataset_id) for node_id in self.added_node_ids],
+                )
+
+        # 2.合并索引段后提交记录及索引段清单，提交后新的版本对检索生效
+        self._merge_segments()
+        self.conn.execute(
+            "INSERT OR REPLACE INTO meta (key, value) VALUES ('manifest', ?)", (json.dumps(self.shard.manifest),),
+        )
+        self.conn.commit()
+        self.written = []
+
+        # 3.删除节点的映射，被重新写入的节点保留映射
+        removed = set(self.removed_node_ids) - set(self.added_node_ids)
+        if removed:
+            with self.backend._connect_node_dataset() as conn:
+                _execute_in(conn, "DELETE FROM node_dataset WHERE node_id IN ({})", list(removed))
+
+        # 4.清理已被合并的索引段文件及异常退出残留的文件，已经加载的进程不受影响
+        names = {segment["name"] for segment in self.shard.segments}
+        self._remove_files([name for name in os.listdir(self.path) if name.endswith(".faiss") and name not in names])
+
+    def _remove_files(self, names: list[str]) -> None:
+        """删除分片目录中的索引段文件"""
+        for name in names:
+            try:
+                os.remove(os.path.join(self.path, name))
+            except FileNotFoundError:
+                pass
+
+    def _close(self) -> None:
+        """关闭记录库连接(未提交的事务会被回滚)并释放缓存锁"""
+        try:
+            if self.conn is not None:
+                self.conn.close()
+        finally:
+            self.lock.release()
@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+@Time    : 2024/12/24 14:20
+@Author  : thezehui@gmail.com
+@File    : weaviate_vector_backend.py
+"""
+from typing import Union
+from uuid import UUID
+
+import weaviate
+from langchain_core.documents import Document as LCDocument
+from langchain_core.embeddings import Embeddings
+from langchain_weaviate import WeaviateVectorStore
+from weaviate.classes.data import DataObject
+from weaviate.classes.query import Filter
+from weaviate.collections import Collection
+
+from .base_vector_backend import BaseVectorBackend
+
+# 向量数据库的集合名字
+COLLECTION_NAME = "Dataset"
+
+# 单次按id批量读取/删除向量数据库记录的最大数量
+FETCH_OBJECTS_BATCH_SIZE = 100
+
+
+class WeaviateVectorBackend(BaseVectorBackend):
+    """Weaviate向量数据库后端，所有知识库共用一个集合，检索时按dataset_id属性过滤"""
+
+    def __init__(self, host: str, port: int, embedding: Embeddings):
+        """构造函数，完成weaviate客户端+LangChain向量数据库实例的创建"""
+        self.client = weaviate.connect_to_local(host=host, port=port)
+        self.vector_store = WeaviateVectorStore(
+            client=self.client,
+            index_name=COLLECTION_NAME,
+            text_key="text",
+            embedding=embedding,
+        )
+
+    @property
+    def collection(self) -> Collection:
+        return self.client.collections.get(COLLECTION_NAME)
+
+    def get_vectors(self, node_ids: list[str]) -> dict[str, list[float]]:
+        vectors = {}
+        for i in range(0, len(node_ids), FETCH_OBJECTS_BATCH_SIZE):
+            batch_node_ids = [str(node_id) for node_id in node_ids[i:i + FETCH_OBJECTS_BATCH_SIZE]]
+            response = self.collection.query.fetch_objects(
+                filters=Filter.by_id().contains_any(batch_node_ids),
+                include_vector=True,
+                limit=len(batch_node_ids),
+            )
+            for obj in response.objects:
+                vector = obj.vector.get("default") if isinstance(obj.vector, dict) else obj.vector
+                if vector:
+                    vectors[str(obj.uuid)] = vector
+        return vectors
+
+    def insert_documents_with_vectors(
+            self, lc_documents: list[LCDocument], vectors: list[list[float]], ids: list[str],
+    ) -> dict[int, str]:
+        if not lc_documents:
+            return {}
+
+        result = self.collection.data.insert_many([
+            DataObject(
+                properties={"text": lc_document.page_content, **lc_document.metadata},
+                uuid=str(id),
+                vector=vector,
+            ) for lc_document, vector, id in zip(lc_documents, vectors, ids)
+        ])
+        return {index: error.message for index, error in result.errors.items()}
+
+    def update_document(self, node_id: str, text: str, vector: list[float]) -> None:
+        self.collection.data.update(uuid=str(node_id), properties={"text": text}, vector=vector)
+
+    def delete_documents(self, ids: list[str]) -> None:
+        for i in range(0, len(ids), FETCH_OBJECTS_BATCH_SIZE):
+            self.collection.data.delete_many(
+                where=Filter.by_id().contains_any([str(id) for id in ids[i:i + FETCH_OBJECTS_BATCH_SIZE]]),
+            )
+
+    def delete_by_document(self, dataset_id: Union[UUID, str], document_id: Union[UUID, str]) -> None:
+        self.collection.data.delete_many(where=Filter.by_property("document_id").equal(str(document_id)))
+
+    def delete_by_dataset(self, dataset_id: Union[UUID, str]) -> None:
+        self.collection.data.delete_many(where=Filter.by_property("dataset_id").equal(str(dataset_id)))
+
+    def similarity_search_with_relevance_scores(
+            self, query: str, k: int, dataset_ids: list[Union[UUID, str]], **kwargs,
+    ) -> list[tuple[LCDocument, float]]:
+        return self.vector_store.similarity_search_with_relevance_scores(
+            query=query,
+            k=k,
+            filters=Filter.by_property("dataset_id").contains_any([str(dataset_id) for dataset_id in dataset_ids]),
+            **kwargs,
+        ) or []
@@ -8,11 +8,72 @@
 # 缓存所的过期时间，单位为妙，默认为600
 LOCK_EXPIRE_TIME = 600
 
-# 更新文档启用状态缓存锁
-LOCK_DOCUMENT_UPDATE_ENABLED = "lock:document:update:enabled_{document_id}"
+# 知识库文档并行构建的并发槽位(有序集合)，用于限制单个知识库同时构建的文档数
+LOCK_DATASET_BUILD_DOCUMENT_SLOTS = "lock:dataset:build_document:slots_{dataset_id}"
 
-# 更新关键词表缓存锁
-LOCK_KEYWORD_TABLE_UPDATE_KEYWORD_TABLE = "lock:keyword_table:update:keyword_table_{dataset_id}"
+# 文档构建槽位的过期时间，单位为秒，构建过程中会定时续期，避免worker异常退出后槽位无法释放
+BUILD_DOCUMENT_SLOT_EXPIRE_TIME = 600
 
-# 更新片段启用状态缓存锁
-LOCK_SEGMENT_UPDATE_ENABLED = "lock:segment:update:enabled_{segment_id}"
+# 文档构建槽位的续期间隔，单位为秒
+BUILD_DOCUMENT_SLOT_HEARTBEAT_INTERVAL = 60
+
+# 根据片段哈希值复用已有向量、节省文本嵌入调用的累计次数
+EMBEDDINGS_REUSED_COUNT = "counter:embeddings:reused"
+
+# 文本嵌入缓存的命中统计(哈希表)，字段为 命名空间:类型:local_hit/remote_hit/miss
+EMBEDDINGS_CACHE_STATS = "counter:embeddings:cache"
+
+# 知识库文档索引构建各阶段的指标记录(列表)，分别按知识库及账号维度存储
+INDEXING_METRICS_DATASET = "metrics:indexing:dataset_{dataset_id}:{stage}"
+INDEXING_METRICS_ACCOUNT = "metrics:indexing:account_{account_id}:{stage}"
+
+# 每个索引构建指标列表保留的最大记录数
+INDEXING_METRICS_MAX_RECORDS = 1000
+
+# 知识库检索排除集合(集合)，分别记录知识库下已禁用的文档id及片段id，检索时用于过滤召回结果
+DATASET_EXCLUDED_DOCUMENTS = "exclusion:dataset_{dataset_id}:documents"
+DATASET_EXCLUDED_SEGMENTS = "exclusion:dataset_{dataset_id}:segments"
+
+# 知识库检索排除集合的版本号，集合每次发生变化时递增，键不存在表示排除集合尚未从数据库构建
+DATASET_EXCLUSION_VERSION = "exclusion:dataset_{dataset_id}:version"
+
+# 从数据库重建知识库检索排除集合的缓存锁
+LOCK_DATASET_EXCLUSION_REBUILD = "lock:dataset:exclusion:rebuild_{dataset_id}"
+
+# 知识库检索版本号，知识库内容或启用状态发生变化时递增，检索结果缓存键包含该版本号，变化后旧缓存自然失效
+DATASET_RETRIEVAL_VERSION = "version:retrieval:dataset_{dataset_id}"
+
+# 检索结果缓存，键为知识库id列表、查询语句、检索参数及各知识库版本号的哈希值
+RETRIEVAL_RESULT_CACHE = "cache:retrieval:{cache_hash}"
+
+# 检索结果缓存的命中统计(哈希表)，字段为hit/miss
+RETRIEVAL_CACHE_STATS = "counter:retrieval:cache"
+
+# 检索命中次数写缓冲(哈希表)，字段为片段id，值为待写入数据库的命中次数增量
+RETRIEVAL_HIT_COUNT_BUFFER = "buffer:retrieval:hit_count"
+
+# 知识库查询记录写缓冲(列表)，元素为待写入数据库的查询记录json
+DATASET_QUERY_BUFFER = "buffer:retrieval:dataset_query"
+
+# 写缓冲刷写时使用的处理中键，刷写前将缓冲重命名为该键，刷写成功后逐批删除，进程异常退出后下次刷写会继续处理
+RETRIEVAL_HIT_COUNT_FLUSHING = "buffer:retrieval:hit_count:flushing"
+DATASET_QUERY_FLUSHING = "buffer:retrieval:dataset_query:flushing"
+
+# 处理中键对应的刷写批次号，每次将写缓冲重命名为处理中键时重新生成，与批次内容哈希组合后作为数据库刷写记录的id
+RETRIEVAL_ACCOUNTING_FLUSH_ID = "{flushing_key}:flush_id"
+
+# 刷写检索统计写缓冲的缓存锁，避免多个定时任务并发刷写
+LOCK_RETRIEVAL_ACCOUNTING_FLUSH = "lock:retrieval:accounting:flush"
+
+# 知识库BM25索引的待合并片段(集合)，分别记录新增/更新及删除的片段id，由异步任务增量合并到索引文件
+BM25_INDEX_UPSERTED_SEGMENTS = "bm25:dataset_{dataset_id}:upserted"
+BM25_INDEX_REMOVED_SEGMENTS = "bm25:dataset_{dataset_id}:removed"
+
+# 知识库BM25索引合并任务是否已调度，避免频繁变更时重复投递任务
+BM25_INDEX_REFRESH_SCHEDULED = "bm25:dataset_{dataset_id}:scheduled"
+
+# 合并知识库BM25索引的缓存锁
+LOCK_BM25_INDEX_REFRESH = "lock:bm25:refresh_{dataset_id}"
+
+# 写入嵌入式向量数据库知识库分片的缓存锁
+LOCK_VECTOR_DATABASE_SHARD = "lock:vector:shard_{dataset_id}"
@@ -7,6 +7,8 @@
 """
 from enum import Enum
 
+from pydantic import BaseModel, Field
+
 # 默认知识库描述格式化文本
 DEFAULT_DATASET_DESCRIPTION_FORMATTER = "当你需要回答管理《{name}》的时候可以引用该知识库。"
 
@@ -72,3 +74,25 @@ class RetrievalSource(str, Enum):
     """检索来源"""
     HIT_TESTING = "hit_testing"
     APP = "app"
+
+
+class IndexingStage(str, Enum):
+    """文档索引构建阶段"""
+    PARSING = "parsing"
+    SPLITTING = "splitting"
+    KEYWORD = "keyword"
+    EMBEDDING = "embedding"
+    VECTOR_WRITING = "vector_writing"
+    TOTAL = "total"
+
+
+# 多查询改写模板
+MULTI_QUERY_TEMPLATE = """你是一个AI语言模型助手，你的任务是为用户的问题生成{count}个不同表述的版本，用于从知识库中检索相关的文档。
+通过从多个角度改写用户的问题，帮助用户克服基于距离的相似性检索的局限性。
+生成的问题需要保持与原问题相同的语言及意图。"""
+
+
+class MultiQueries(BaseModel):
+    """请为用户的问题生成多个不同表述的版本，每个问题都保持在100个字符以内。
+    生成的内容必须是指定模式的JSON格式数组: ["问题1", "问题2", "问题3"]"""
+    queries: list[str] = Field(description="改写后的问题列表，类型为字符串数组")
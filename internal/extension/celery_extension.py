@@ -5,7 +5,10 @@
 @Author  : thezehui@gmail.com
 @File    : celery_extension.py
 """
+import logging
+
 from celery import Task, Celery
+from celery.signals import worker_process_init
 from flask import Flask
 
 
@@ -26,3 +29,15 @@ def init_app(app: Flask):
 
     # 2.将celery挂在到app的扩展中
     app.extensions["celery"] = celery_app
+
+    # 3.worker子进程启动时预热文本嵌入模型，避免首个构建任务承担模型加载的耗时
+    @worker_process_init.connect(weak=False)
+    def warm_up_embeddings(**kwargs):
+        from app.http.module import injector
+        from internal.service import EmbeddingsService
+
+        try:
+            with app.app_context():
+                injector.get(EmbeddingsService).warm_up()
+        except Exception as e:
+            logging.exception("文本嵌入模型预热失败，错误信息：%(error)s", {"error": e})
@@ -26,6 +26,7 @@ from internal.service import (
     DatasetService,
     EmbeddingsService,
     JiebaService,
+    IndexingMetricService,
     VectorDatabaseService,
 )
 from pkg.paginator import PageModel
@@ -43,6 +44,7 @@ class DatasetHandler:
     embeddings_service: EmbeddingsService
     jieba_service: JiebaService
     vector_database_service: VectorDatabaseService
+    indexing_metric_service: IndexingMetricService
 
     @login_required
     def hit(self, dataset_id: UUID):
@@ -64,6 +66,18 @@ class DatasetHandler:
         resp = GetDatasetQueriesResp(many=True)
         return success_json(resp.dump(dataset_queries))
 
+    @login_required
+    def get_dataset_indexing_metrics(self, dataset_id: UUID):
+        """根据传递的知识库id获取该知识库各阶段的索引构建指标"""
+        indexing_metrics = self.indexing_metric_service.get_dataset_metrics(dataset_id, current_user)
+        return success_json(indexing_metrics)
+
+    @login_required
+    def get_indexing_metrics(self):
+        """获取当前账号下所有知识库汇总的各阶段索引构建指标"""
+        indexing_metrics = self.indexing_metric_service.get_account_metrics(current_user)
+        return success_json(indexing_metrics)
+
     @login_required
     def create_dataset(self):
         """创建知识库"""
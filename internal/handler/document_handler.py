@@ -20,6 +20,7 @@ from internal.schema.document_schema import (
     GetDocumentsWithPageReq,
     GetDocumentsWithPageResp,
     UpdateDocumentEnabledReq,
+    UpdateDocumentFileReq,
 )
 from internal.service import DocumentService
 from pkg.paginator import PageModel
@@ -90,6 +91,26 @@ class DocumentHandler:
 
         return success_message("删除文档成功")
 
+    @login_required
+    def update_document_file(self, dataset_id: UUID, document_id: UUID):
+        """根据传递的知识库id+文档id替换指定文档的文件，只对变化的内容重新构建索引"""
+        # 1.提取请求并校验
+        req = UpdateDocumentFileReq()
+        if not req.validate():
+            return validate_error_json(req.errors)
+
+        # 2.调用服务替换文档文件
+        self.document_service.update_document_file(dataset_id, document_id, UUID(req.upload_file_id.data), current_user)
+
+        return success_message("更新文档文件成功")
+
+    @login_required
+    def rebuild_document(self, dataset_id: UUID, document_id: UUID):
+        """根据传递的知识库id+文档id重新构建指定的文档，从上次中断的阶段继续"""
+        self.document_service.rebuild_document(dataset_id, document_id, current_user)
+
+        return success_message("重新构建文档成功")
+
     @login_required
     def get_documents_with_page(self, dataset_id: UUID):
         """根据传递的知识库id获取文档分页列表数据"""
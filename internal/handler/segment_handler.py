@@ -17,6 +17,7 @@ from internal.schema.segment_schema import (
     GetSegmentsWithPageResp,
     GetSegmentResp,
     UpdateSegmentEnabledReq,
+    UpdateSegmentsEnabledReq,
     CreateSegmentReq,
     UpdateSegmentReq,
 )
@@ -80,6 +81,25 @@ class SegmentHandler:
 
         return success_message("修改片段状态成功")
 
+    @login_required
+    def update_segments_enabled(self, dataset_id: UUID, document_id: UUID):
+        """根据传递的信息批量更新文档片段的启用状态"""
+        # 1.提取请求并校验
+        req = UpdateSegmentsEnabledReq()
+        if not req.validate():
+            return validate_error_json(req.errors)
+
+        # 2.调用服务批量更新文档片段的启用状态
+        self.segment_service.update_segments_enabled(
+            dataset_id,
+            document_id,
+            [UUID(segment_id) for segment_id in req.segment_ids.data],
+            req.enabled.data,
+            current_user,
+        )
+
+        return success_message("批量修改片段状态成功")
+
     @login_required
     def delete_segment(self, dataset_id: UUID, document_id: UUID, segment_id: UUID):
         """根据传递的信息删除指定的文档片段信息"""
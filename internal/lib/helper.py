@@ -9,7 +9,7 @@ import importlib
 from datetime import datetime
 from enum import Enum
 from hashlib import sha3_256
-from typing import Any
+from typing import Any, Optional
 from uuid import UUID
 import secrets
 import string
@@ -55,6 +55,32 @@ def combine_documents(documents: list[Document]) -> str:
     return "\n\n".join([document.page_content for document in documents])
 
 
+def reciprocal_rank_fusion(
+        ranked_lists: list[list[Document]],
+        weights: Optional[list[float]] = None,
+        c: int = 60,
+        id_key: str = "segment_id",
+) -> list[tuple[Document, float]]:
+    """使用倒数排名融合(RRF)合并多个已排序的文档列表，同一文档按id_key对应的元数据去重，返回按融合得分降序排列的(文档, 得分)列表"""
+    # 1.权重默认平均分配
+    weights = weights or [1 / len(ranked_lists)] * len(ranked_lists)
+
+    # 2.累加每个文档在各个列表中的 权重/(c+排名) 得分，首次出现的文档对象作为结果
+    scores: dict[str, float] = {}
+    documents: dict[str, Document] = {}
+    for ranked_list, weight in zip(ranked_lists, weights):
+        for rank, document in enumerate(ranked_list, start=1):
+            document_id = str(document.metadata.get(id_key, document.page_content))
+            scores[document_id] = scores.get(document_id, 0) + weight / (c + rank)
+            documents.setdefault(document_id, document)
+
+    # 3.按融合得分降序排序
+    return [
+        (documents[document_id], score)
+        for document_id, score in sorted(scores.items(), key=lambda item: item[1], reverse=True)
+    ]
+
+
 def remove_fields(data_dict: dict, fields: list[str]) -> None:
     """根据传递的字段名移除字典中指定的字段"""
     for field in fields:
@@ -0,0 +1,82 @@
+"""empty message
+
+Revision ID: 3f8e2a61c9d4
+Revises: 775e752e0220
+Create Date: 2024-12-16 10:21:37.514236
+
+"""
+import sqlalchemy as sa
+from alembic import op
+from sqlalchemy.dialects import postgresql
+
+# revision identifiers, used by Alembic.
+revision = '3f8e2a61c9d4'
+down_revision = '775e752e0220'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # 1.创建关键词倒排索引表
+    op.create_table('keyword_index',
+                    sa.Column('id', sa.UUID(), server_default=sa.text('uuid_generate_v4()'), nullable=False),
+                    sa.Column('dataset_id', sa.UUID(), nullable=False),
+                    sa.Column('keyword', sa.Text(), server_default=sa.text("''::text"), nullable=False),
+                    sa.Column('segment_id', sa.UUID(), nullable=False),
+                    sa.Column('updated_at', sa.DateTime(), server_default=sa.text('CURRENT_TIMESTAMP(0)'),
+                              nullable=False),
+                    sa.Column('created_at', sa.DateTime(), server_default=sa.text('CURRENT_TIMESTAMP(0)'),
+                              nullable=False),
+                    sa.PrimaryKeyConstraint('id', name='pk_keyword_index_id'),
+                    sa.UniqueConstraint('dataset_id', 'keyword', 'segment_id',
+                                        name='uk_keyword_index_dataset_id_keyword_segment_id')
+                    )
+    with op.batch_alter_table('keyword_index', schema=None) as batch_op:
+        batch_op.create_index('idx_keyword_index_segment_id', ['segment_id'], unique=False)
+
+    # 2.将原有的知识库JSONB关键词表展开成倒排项，只保留仍然存在的片段
+    op.execute("""
+        INSERT INTO keyword_index (dataset_id, keyword, segment_id)
+        SELECT DISTINCT kt.dataset_id, kw.keyword, s.id
+        FROM keyword_table AS kt
+        CROSS JOIN LATERAL jsonb_each(kt.keyword_table) AS kw(keyword, segment_ids)
+        CROSS JOIN LATERAL jsonb_array_elements_text(kw.segment_ids) AS ids(segment_id)
+        JOIN segment AS s ON s.id::text = ids.segment_id AND s.dataset_id = kt.dataset_id
+        ON CONFLICT ON CONSTRAINT uk_keyword_index_dataset_id_keyword_segment_id DO NOTHING
+    """)
+
+    # 3.删除原有的关键词表
+    op.drop_table('keyword_table')
+
+
+def downgrade():
+    # 1.重建原有的关键词表
+    op.create_table('keyword_table',
+                    sa.Column('id', sa.UUID(), server_default=sa.text('uuid_generate_v4()'), nullable=False),
+                    sa.Column('dataset_id', sa.UUID(), nullable=False),
+                    sa.Column('keyword_table', postgresql.JSONB(astext_type=sa.Text()),
+                              server_default=sa.text("'{}'::jsonb"), nullable=False),
+                    sa.Column('updated_at', sa.DateTime(), server_default=sa.text('CURRENT_TIMESTAMP(0)'),
+                              nullable=False),
+                    sa.Column('created_at', sa.DateTime(), server_default=sa.text('CURRENT_TIMESTAMP(0)'),
+                              nullable=False),
+                    sa.PrimaryKeyConstraint('id', name='pk_keyword_table_id')
+                    )
+
+    # 2.将倒排项聚合回每个知识库一条的JSONB关键词表
+    op.execute("""
+        INSERT INTO keyword_table (dataset_id, keyword_table)
+        SELECT dataset_id, jsonb_object_agg(keyword, segment_ids)
+        FROM (
+            SELECT dataset_id, keyword, jsonb_agg(segment_id::text) AS segment_ids
+            FROM keyword_index
+            GROUP BY dataset_id, keyword
+        ) AS postings
+        GROUP BY dataset_id
+    """)
+
+    # 3.删除关键词倒排索引表
+    with op.batch_alter_table('keyword_index', schema=None) as batch_op:
+        batch_op.drop_index('idx_keyword_index_segment_id')
+
+    op.drop_table('keyword_index')
@@ -0,0 +1,36 @@
+"""empty message
+
+Revision ID: b7d41c9e5a20
+Revises: 3f8e2a61c9d4
+Create Date: 2024-12-20 11:32:08.417265
+
+"""
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = 'b7d41c9e5a20'
+down_revision = '3f8e2a61c9d4'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # 启用/禁用改为在检索时通过排除集合过滤，倒排索引需要包含已禁用的片段以及已禁用文档下的片段
+    op.execute("""
+        INSERT INTO keyword_index (dataset_id, keyword, segment_id)
+        SELECT DISTINCT s.dataset_id, kw.keyword, s.id
+        FROM segment AS s
+        CROSS JOIN LATERAL jsonb_array_elements_text(s.keywords) AS kw(keyword)
+        WHERE s.status = 'completed' AND jsonb_typeof(s.keywords) = 'array' AND kw.keyword <> ''
+        ON CONFLICT ON CONSTRAINT uk_keyword_index_dataset_id_keyword_segment_id DO NOTHING
+    """)
+
+
+def downgrade():
+    # 恢复原有的语义，倒排索引中只保留已启用文档下已启用的片段
+    op.execute("""
+        DELETE FROM keyword_index AS ki
+        USING segment AS s
+        JOIN document AS d ON d.id = s.document_id
+        WHERE ki.segment_id = s.id AND (s.enabled = false OR d.enabled = false)
+    """)
@@ -10,7 +10,7 @@ from .api_key import ApiKey
 from .api_tool import ApiTool, ApiToolProvider
 from .app import App, AppDatasetJoin, AppConfig, AppConfigVersion
 from .conversation import Conversation, Message, MessageAgentThought
-from .dataset import Dataset, Document, Segment, KeywordTable, DatasetQuery, ProcessRule
+from .dataset import Dataset, Document, Segment, KeywordIndex, DatasetQuery, RetrievalAccountingFlush, ProcessRule
 from .end_user import EndUser
 from .upload_file import UploadFile
 from .workflow import Workflow, WorkflowResult
@@ -19,7 +19,7 @@ __all__ = [
     "App", "AppDatasetJoin", "AppConfig", "AppConfigVersion",
     "ApiTool", "ApiToolProvider",
     "UploadFile",
-    "Dataset", "Document", "Segment", "KeywordTable", "DatasetQuery", "ProcessRule",
+    "Dataset", "Document", "Segment", "KeywordIndex", "DatasetQuery", "RetrievalAccountingFlush", "ProcessRule",
     "Conversation", "Message", "MessageAgentThought",
     "Account", "AccountOAuth",
     "ApiKey", "EndUser",
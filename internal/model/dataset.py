@@ -14,6 +14,8 @@ from sqlalchemy import (
     Boolean,
     DateTime,
     PrimaryKeyConstraint,
+    UniqueConstraint,
+    Index,
     text,
     func,
 )
@@ -185,16 +187,19 @@ class Segment(db.Model):
         return db.session.query(Document).get(self.document_id)
 
 
-class KeywordTable(db.Model):
-    """关键词表模型"""
-    __tablename__ = "keyword_table"
+class KeywordIndex(db.Model):
+    """关键词倒排索引表模型，每条记录对应一个 关键词->片段 的倒排项"""
+    __tablename__ = "keyword_index"
     __table_args__ = (
-        PrimaryKeyConstraint("id", name="pk_keyword_table_id"),
+        PrimaryKeyConstraint("id", name="pk_keyword_index_id"),
+        UniqueConstraint("dataset_id", "keyword", "segment_id", name="uk_keyword_index_dataset_id_keyword_segment_id"),
+        Index("idx_keyword_index_segment_id", "segment_id"),
     )
 
     id = Column(UUID, nullable=False, server_default=text("uuid_generate_v4()"))
     dataset_id = Column(UUID, nullable=False)
-    keyword_table = Column(JSONB, nullable=False, server_default=text("'{}'::jsonb"))
+    keyword = Column(Text, nullable=False, server_default=text("''::text"))
+    segment_id = Column(UUID, nullable=False)
     updated_at = Column(
         DateTime,
         nullable=False,
@@ -226,6 +231,17 @@ class DatasetQuery(db.Model):
     created_at = Column(DateTime, nullable=False, server_default=text('CURRENT_TIMESTAMP(0)'))
 
 
+class RetrievalAccountingFlush(db.Model):
+    """检索统计刷写记录表模型，每条记录对应一个已写入数据库的写缓冲批次，与批次数据在同一个事务内写入，用于避免重复刷写"""
+    __tablename__ = "retrieval_accounting_flush"
+    __table_args__ = (
+        PrimaryKeyConstraint("id", name="pk_retrieval_accounting_flush_id"),
+    )
+
+    id = Column(String(255), nullable=False)
+    created_at = Column(DateTime, nullable=False, server_default=text('CURRENT_TIMESTAMP(0)'))
+
+
 class ProcessRule(db.Model):
     """文档处理规则表模型"""
     __tablename__ = "process_rule"
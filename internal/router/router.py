@@ -195,6 +195,11 @@ class Router:
         bp.add_url_rule("/datasets/<uuid:dataset_id>", view_func=self.dataset_handler.get_dataset)
         bp.add_url_rule("/datasets/<uuid:dataset_id>", methods=["POST"], view_func=self.dataset_handler.update_dataset)
         bp.add_url_rule("/datasets/<uuid:dataset_id>/queries", view_func=self.dataset_handler.get_dataset_queries)
+        bp.add_url_rule("/datasets/indexing-metrics", view_func=self.dataset_handler.get_indexing_metrics)
+        bp.add_url_rule(
+            "/datasets/<uuid:dataset_id>/indexing-metrics",
+            view_func=self.dataset_handler.get_dataset_indexing_metrics,
+        )
         bp.add_url_rule(
             "/datasets/<uuid:dataset_id>/delete",
             methods=["POST"],
@@ -228,6 +233,16 @@ class Router:
             methods=["POST"],
             view_func=self.document_handler.delete_document,
         )
+        bp.add_url_rule(
+            "/datasets/<uuid:dataset_id>/documents/<uuid:document_id>/rebuild",
+            methods=["POST"],
+            view_func=self.document_handler.rebuild_document,
+        )
+        bp.add_url_rule(
+            "/datasets/<uuid:dataset_id>/documents/<uuid:document_id>/file",
+            methods=["POST"],
+            view_func=self.document_handler.update_document_file,
+        )
         bp.add_url_rule(
             "/datasets/<uuid:dataset_id>/documents/batch/<string:batch>",
             view_func=self.document_handler.get_documents_status,
@@ -241,6 +256,11 @@ class Router:
             methods=["POST"],
             view_func=self.segment_handler.create_segment,
         )
+        bp.add_url_rule(
+            "/datasets/<uuid:dataset_id>/documents/<uuid:document_id>/segments/enabled",
+            methods=["POST"],
+            view_func=self.segment_handler.update_segments_enabled,
+        )
         bp.add_url_rule(
             "/datasets/<uuid:dataset_id>/documents/<uuid:document_id>/segments/<uuid:segment_id>",
             view_func=self.segment_handler.get_segment,
@@ -0,0 +1,25 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+@Time    : 2024/12/23 10:40
+@Author  : thezehui@gmail.com
+@File    : retrieval_schedule.py
+"""
+import logging
+
+from celery import shared_task
+
+
+@shared_task
+def flush_retrieval_accounting() -> None:
+    """定时将检索命中次数及知识库查询记录写缓冲批量刷写到数据库"""
+    from app.http.module import injector
+    from internal.service import RetrievalAccountingService
+
+    retrieval_accounting_service = injector.get(RetrievalAccountingService)
+    segment_count, query_count = retrieval_accounting_service.flush()
+    if segment_count or query_count:
+        logging.info(
+            "检索统计刷写完成，片段数：%(segment_count)s，查询记录数：%(query_count)s",
+            {"segment_count": segment_count, "query_count": query_count},
+        )
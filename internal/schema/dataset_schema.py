@@ -14,12 +14,14 @@ from wtforms.validators import (
     URL,
     Optional,
     AnyOf, NumberRange,
+    ValidationError,
 )
 
 from internal.entity.dataset_entity import RetrievalStrategy
 from internal.lib.helper import datetime_to_timestamp
 from internal.model import Dataset, DatasetQuery
 from pkg.paginator import PaginatorReq
+from .schema import ListField
 
 
 class CreateDatasetReq(FlaskForm):
@@ -134,6 +136,24 @@ class HitReq(FlaskForm):
     score = FloatField("score", validators=[
         NumberRange(min=0, max=0.99, message="最小匹配度范围在0-0.99")
     ])
+    queries = ListField("queries")
+
+    def validate_queries(self, field: ListField) -> None:
+        """校验查询语句的其他表述列表，默认为空列表"""
+        # 1.校验数据类型
+        if field.data is None:
+            field.data = []
+        if not isinstance(field.data, list):
+            raise ValidationError("查询语句的其他表述格式必须是数组")
+
+        # 2.校验数据的长度，最多传递3条其他表述
+        if len(field.data) > 3:
+            raise ValidationError("查询语句的其他表述最多传递3条")
+
+        # 3.循环校验每条表述，必须是长度不超过200的字符串
+        for query in field.data:
+            if not isinstance(query, str) or len(query) > 200:
+                raise ValidationError("查询语句的其他表述必须是长度不超过200的字符串")
 
 
 class GetDatasetQueriesResp(Schema):
@@ -235,3 +235,17 @@ class UpdateDocumentEnabledReq(FlaskForm):
         """校验文档启用状态enabled"""
         if not isinstance(field.data, bool):
             raise ValidationError("enabled状态不能为空且必须为布尔值")
+
+
+class UpdateDocumentFileReq(FlaskForm):
+    """更新文档文件请求"""
+    upload_file_id = StringField("upload_file_id", validators=[
+        DataRequired("上传文件id不能为空"),
+    ])
+
+    def validate_upload_file_id(self, field: StringField) -> None:
+        """校验上传文件id是否为uuid"""
+        try:
+            uuid.UUID(field.data)
+        except Exception as e:
+            raise ValidationError("文件id的格式必须是UUID")
@@ -5,6 +5,8 @@
 @Author  : thezehui@gmail.com
 @File    : segment_schema.py
 """
+import uuid
+
 from flask_wtf import FlaskForm
 from marshmallow import Schema, fields, pre_dump
 from wtforms import StringField, BooleanField
@@ -113,6 +115,37 @@ class UpdateSegmentEnabledReq(FlaskForm):
             raise ValidationError("enabled状态不能为空且必须为布尔值")
 
 
+class UpdateSegmentsEnabledReq(FlaskForm):
+    """批量更新文档片段启用状态请求"""
+    segment_ids = ListField("segment_ids")
+    enabled = BooleanField("enabled")
+
+    def validate_segment_ids(self, field: ListField) -> None:
+        """校验片段id列表"""
+        # 1.校验数据类型与非空
+        if not isinstance(field.data, list):
+            raise ValidationError("片段id列表格式必须是数组")
+
+        # 2.校验数据的长度，最长不能超过1000条记录
+        if len(field.data) == 0 or len(field.data) > 1000:
+            raise ValidationError("批量修改的片段数范围在1-1000")
+
+        # 3.循环校验id是否为uuid
+        for segment_id in field.data:
+            try:
+                uuid.UUID(segment_id)
+            except Exception as e:
+                raise ValidationError("片段id的格式必须是UUID")
+
+        # 4.删除重复数据并更新
+        field.data = list(dict.fromkeys(field.data))
+
+    def validate_enabled(self, field: BooleanField) -> None:
+        """校验文档片段启用状态enabled"""
+        if not isinstance(field.data, bool):
+            raise ValidationError("enabled状态不能为空且必须为布尔值")
+
+
 class CreateSegmentReq(FlaskForm):
     """创建文档片段请求结构"""
     content = StringField("content", validators=[
@@ -14,14 +14,17 @@ from .app_config_service import AppConfigService
 from .app_service import AppService
 from .assistant_agent_service import AssistantAgentService
 from .base_service import BaseService
+from .bm25_index_service import BM25IndexService
 from .builtin_app_service import BuiltinAppService
 from .builtin_tool_service import BuiltinToolService
 from .conversation_service import ConversationService
 from .cos_service import CosService
+from .dataset_exclusion_service import DatasetExclusionService
 from .dataset_service import DatasetService
 from .document_service import DocumentService
 from .embeddings_service import EmbeddingsService
 from .faiss_service import FaissService
+from .indexing_metric_service import IndexingMetricService
 from .indexing_service import IndexingService
 from .jieba_service import JiebaService
 from .jwt_service import JwtService
@@ -30,8 +33,11 @@ from .language_model_service import LanguageModelService
 from .oauth_service import OAuthService
 from .openapi_service import OpenAPIService
 from .process_rule_service import ProcessRuleService
+from .retrieval_accounting_service import RetrievalAccountingService
+from .retrieval_cache_service import RetrievalCacheService
 from .retrieval_service import RetrievalService
 from .segment_service import SegmentService
+from .tokenizer_service import TokenizerService
 from .upload_file_service import UploadFileService
 from .vector_database_service import VectorDatabaseService
 from .web_app_service import WebAppService
@@ -39,6 +45,7 @@ from .workflow_service import WorkflowService
 
 __all__ = [
     "BaseService",
+    "BM25IndexService",
     "AppService",
     "VectorDatabaseService",
     "BuiltinToolService",
@@ -69,4 +76,9 @@ __all__ = [
     "FaissService",
     "AnalysisService",
     "WebAppService",
+    "TokenizerService",
+    "IndexingMetricService",
+    "DatasetExclusionService",
+    "RetrievalCacheService",
+    "RetrievalAccountingService",
 ]
@@ -7,6 +7,8 @@
 """
 from typing import Any, Optional
 
+from sqlalchemy import insert
+
 from internal.exception import FailException
 from pkg.sqlalchemy import SQLAlchemy
 
@@ -22,6 +24,22 @@ class BaseService:
             self.db.session.add(model_instance)
         return model_instance
 
+    def create_many(self, model: Any, records: list[dict], *returning: Any, batch_size: int = 500) -> list:
+        """根据传递的模型类+键值对列表在同一个事务内批量创建数据库记录，并按传递顺序返回指定列的数据"""
+        if not records:
+            return []
+
+        rows = []
+        with self.db.auto_commit():
+            for i in range(0, len(records), batch_size):
+                stmt = insert(model)
+                if returning:
+                    stmt = stmt.returning(*returning, sort_by_parameter_order=True)
+                    rows.extend(self.db.session.execute(stmt, records[i:i + batch_size]).all())
+                else:
+                    self.db.session.execute(stmt, records[i:i + batch_size])
+        return rows
+
     def delete(self, model_instance: Any) -> Any:
         """根据传递的模型实例删除数据库记录"""
         with self.db.auto_commit():
@@ -0,0 +1,193 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+@Time    : 2024/12/23 16:05
+@Author  : thezehui@gmail.com
+@File    : bm25_index_service.py
+"""
+import logging
+import os
+from dataclasses import dataclass
+from typing import Optional, Union
+from uuid import UUID
+
+from injector import inject
+from redis import Redis
+
+from internal.core.bm25 import LayeredBM25Index, get_bm25_index, delete_bm25_index
+from internal.entity.cache_entity import (
+    LOCK_EXPIRE_TIME,
+    BM25_INDEX_UPSERTED_SEGMENTS,
+    BM25_INDEX_REMOVED_SEGMENTS,
+    BM25_INDEX_REFRESH_SCHEDULED,
+    LOCK_BM25_INDEX_REFRESH,
+)
+from internal.model import Segment
+from pkg.sqlalchemy import SQLAlchemy
+from .base_service import BaseService
+from .jieba_service import JiebaService
+from .retrieval_cache_service import RetrievalCacheService
+
+# 合并BM25索引时单次从数据库读取的片段数
+BM25_INDEX_SEGMENT_BATCH_SIZE = 500
+
+
+@inject
+@dataclass
+class BM25IndexService(BaseService):
+    """知识库BM25索引服务，每个知识库一份可mmap的主索引+增量索引文件，片段变更先记录到redis，再由异步任务合并到增量索引"""
+    db: SQLAlchemy
+    redis_client: Redis
+    jieba_service: JiebaService
+    retrieval_cache_service: RetrievalCacheService
+
+    def upsert_segments(self, dataset_id: Union[UUID, str], segment_ids: list[Union[UUID, str]]) -> None:
+        """记录新增或内容发生变化的片段，并调度索引合并任务"""
+        if segment_ids:
+            self.redis_client.sadd(
+                BM25_INDEX_UPSERTED_SEGMENTS.format(dataset_id=dataset_id), *[str(id) for id in segment_ids],
+            )
+            self._schedule_refresh(dataset_id)
+
+    def remove_segments(self, dataset_id: Union[UUID, str], segment_ids: list[Union[UUID, str]]) -> None:
+        """记录已删除的片段，并调度索引合并任务"""
+        if segment_ids:
+            self.redis_client.sadd(
+                BM25_INDEX_REMOVED_SEGMENTS.format(dataset_id=dataset_id), *[str(id) for id in segment_ids],
+            )
+            self._schedule_refresh(dataset_id)
+
+    def delete_dataset(self, dataset_id: Union[UUID, str]) -> None:
+        """删除知识库的索引文件及待合并记录"""
+        self.redis_client.delete(
+            BM25_INDEX_UPSERTED_SEGMENTS.format(dataset_id=dataset_id),
+            BM25_INDEX_REMOVED_SEGMENTS.format(dataset_id=dataset_id),
+            BM25_INDEX_REFRESH_SCHEDULED.format(dataset_id=dataset_id),
+        )
+        delete_bm25_index(self._get_index_path(dataset_id))
+
+    def has_indexes(self, dataset_ids: list[Union[UUID, str]]) -> bool:
+        """检测传递的知识库是否均已构建BM25索引，尚未构建的知识库会调度构建任务"""
+        ready = True
+        for dataset_id in dataset_ids:
+            if get_bm25_index(self._get_index_path(dataset_id)) is None:
+                self._schedule_refresh(dataset_id)
+                ready = False
+        return ready
+
+    def search(self, dataset_ids: list[Union[UUID, str]], query: str, k: int) -> list[tuple[str, float]]:
+        """在多个知识库的BM25索引中检索得分最高的前k个 (片段id, 得分)，尚未构建索引的知识库会被跳过"""
+        # 1.将query切分成词条
+        query_terms = self.jieba_service.tokenize(query)
+        if len(query_terms) == 0:
+            return []
+
+        # 2.在每个知识库的索引中检索后按得分合并，同一进程内的索引只在版本变化时重新加载
+        results = []
+        for dataset_id in dataset_ids:
+            index = get_bm25_index(self._get_index_path(dataset_id))
+            if index is not None:
+                results.extend(index.search(query_terms, k))
+
+        return sorted(results, key=lambda item: item[1], reverse=True)[:k]
+
+    def refresh(self, dataset_id: Union[UUID, str]) -> None:
+        """将待合并的片段合并到知识库的增量索引，增量索引超过阈值时合并回主索引，索引不存在时从数据库全量构建"""
+        with self.redis_client.lock(LOCK_BM25_INDEX_REFRESH.format(dataset_id=dataset_id), LOCK_EXPIRE_TIME):
+            # 1.清除调度标记后再读取待合并记录，之后产生的变更会重新调度任务，不会被遗漏
+            self.redis_client.delete(BM25_INDEX_REFRESH_SCHEDULED.format(dataset_id=dataset_id))
+            upserted_key = BM25_INDEX_UPSERTED_SEGMENTS.format(dataset_id=dataset_id)
+            removed_key = BM25_INDEX_REMOVED_SEGMENTS.format(dataset_id=dataset_id)
+            pipeline = self.redis_client.pipeline(transaction=True)
+            pipeline.smembers(upserted_key)
+            pipeline.smembers(removed_key)
+            pipeline.delete(upserted_key, removed_key)
+            upserted, removed, _ = pipeline.execute()
+            upserted = {id.decode() for id in upserted}
+            removed = {id.decode() for id in removed}
+
+            try:
+                # 2.索引不存在时全量构建，否则只需要重新切分新增或更新的片段
+                path = self._get_index_path(dataset_id)
+                index = get_bm25_index(path)
+                rebuild = index is None
+                if rebuild:
+                    index, upserted, removed = LayeredBM25Index.empty(), None, set()
+
+                # 3.变更只合并到增量索引，全量构建或增量索引超过阈值时才重建主索引
+                added = self._tokenize_segments(dataset_id, upserted)
+                index = index.merge(added, removed)
+                max_delta_size = max(
+                    int(os.getenv("BM25_INDEX_DELTA_MIN_SEGMENTS", 1000)),
+                    int(index.base.segment_count * float(os.getenv("BM25_INDEX_DELTA_RATIO", 0.1))),
+                )
+                if rebuild or index.delta_size > max_delta_size:
+                    index = index.compact()
+
+                # 4.写入新的索引版本，空知识库同样写入空索引，避免检索时反复调度构建
+                index.save(path)
+
+                # 5.新版本生效后使检索结果缓存失效
+                self.retrieval_cache_service.bump_versions([dataset_id])
+                logging.info(
+                    "知识库BM25索引合并完成，知识库id：%(dataset_id)s，片段数：%(count)s，增量索引大小：%(delta_size)s，"
+                    "新增/更新：%(added)s，删除：%(removed)s",
+                    {
+                        "dataset_id": dataset_id,
+                        "count": index.segment_count,
+                        "delta_size": index.delta_size,
+                        "added": len(added),
+                        "removed": len(removed),
+                    },
+                )
+            except Exception:
+                # 6.合并失败时将待合并记录放回集合，等待下次合并
+                pipeline = self.redis_client.pipeline()
+                if upserted:
+                    pipeline.sadd(upserted_key, *upserted)
+                if removed:
+                    pipeline.sadd(removed_key, *removed)
+                pipeline.execute()
+                raise
+
+    def _tokenize_segments(self, dataset_id: Union[UUID, str], segment_ids: Optional[set[str]]) -> dict[str, list[str]]:
+        """分批读取片段内容并切分成词条，segment_ids为None时读取知识库下的全部片段，已删除的片段不会被读取到"""
+        query = self.db.session.query(Segment).with_entities(Segment.id, Segment.content).filter(
+            Segment.dataset_id == dataset_id,
+        )
+        if segment_ids is not None:
+            if not segment_ids:
+                return {}
+            query = query.filter(Segment.id.in_(list(segment_ids)))
+
+        tokens: dict[str, list[str]] = {}
+        segments = []
+        for segment in query.yield_per(BM25_INDEX_SEGMENT_BATCH_SIZE):
+            segments.append(segment)
+            if len(segments) >= BM25_INDEX_SEGMENT_BATCH_SIZE:
+                tokens.update(self._tokenize_batch(segments))
+                segments = []
+        tokens.update(self._tokenize_batch(segments))
+
+        return tokens
+
+    def _tokenize_batch(self, segments: list) -> dict[str, list[str]]:
+        """将一批 (片段id, 内容) 切分成词条"""
+        results = self.jieba_service.tokenize_batch([content for _, content in segments])
+        return {str(id): result for (id, _), result in zip(segments, results)}
+
+    def _schedule_refresh(self, dataset_id: Union[UUID, str]) -> None:
+        """调度索引合并任务，短时间内的多次变更只会投递一次任务，并延迟执行以合并更多变更"""
+        scheduled = self.redis_client.set(
+            BM25_INDEX_REFRESH_SCHEDULED.format(dataset_id=dataset_id), 1, ex=LOCK_EXPIRE_TIME, nx=True,
+        )
+        if scheduled:
+            from internal.task.dataset_task import refresh_bm25_index
+            refresh_bm25_index.apply_async(
+                args=(dataset_id,), countdown=int(os.getenv("BM25_INDEX_REFRESH_DELAY", 5)),
+            )
+
+    @classmethod
+    def _get_index_path(cls, dataset_id: Union[UUID, str]) -> str:
+        """获取知识库索引的存储目录"""
+        return os.path.join(os.getenv("BM25_INDEX_DIR", os.path.join("storage", "bm25")), f"dataset_{dataset_id}")
@@ -0,0 +1,186 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+@Time    : 2024/12/20 11:05
+@Author  : thezehui@gmail.com
+@File    : dataset_exclusion_service.py
+"""
+import os
+from dataclasses import dataclass
+from typing import Callable, Union
+from uuid import UUID
+
+from injector import inject
+from langchain_core.documents import Document as LCDocument
+from redis import Redis
+
+from internal.entity.cache_entity import (
+    LOCK_EXPIRE_TIME,
+    DATASET_EXCLUDED_DOCUMENTS,
+    DATASET_EXCLUDED_SEGMENTS,
+    DATASET_EXCLUSION_VERSION,
+    LOCK_DATASET_EXCLUSION_REBUILD,
+)
+from internal.model import Document, Segment
+from pkg.sqlalchemy import SQLAlchemy
+from .base_service import BaseService
+from .retrieval_cache_service import RetrievalCacheService
+
+# 检索排除集合中最多尝试扩大召回数量的次数
+EXCLUSION_MAX_FETCH_ROUNDS = 3
+
+
+@inject
+@dataclass
+class DatasetExclusionService(BaseService):
+    """知识库检索排除服务，使用redis集合记录已禁用的文档及片段，启用/禁用只修改集合，检索时过度召回后再过滤"""
+    db: SQLAlchemy
+    redis_client: Redis
+    retrieval_cache_service: RetrievalCacheService
+
+    def disable_documents(self, dataset_id: Union[UUID, str], document_ids: list[Union[UUID, str]]) -> None:
+        """将传递的文档id列表加入知识库的排除集合"""
+        self._update(dataset_id, DATASET_EXCLUDED_DOCUMENTS, document_ids, True)
+
+    def enable_documents(self, dataset_id: Union[UUID, str], document_ids: list[Union[UUID, str]]) -> None:
+        """将传递的文档id列表从知识库的排除集合中移除"""
+        self._update(dataset_id, DATASET_EXCLUDED_DOCUMENTS, document_ids, False)
+
+    def disable_segments(self, dataset_id: Union[UUID, str], segment_ids: list[Union[UUID, str]]) -> None:
+        """将传递的片段id列表加入知识库的排除集合"""
+        self._update(dataset_id, DATASET_EXCLUDED_SEGMENTS, segment_ids, True)
+
+    def enable_segments(self, dataset_id: Union[UUID, str], segment_ids: list[Union[UUID, str]]) -> None:
+        """将传递的片段id列表从知识库的排除集合中移除"""
+        self._update(dataset_id, DATASET_EXCLUDED_SEGMENTS, segment_ids, False)
+
+    def remove(
+            self,
+            dataset_id: Union[UUID, str],
+            document_ids: list[Union[UUID, str]],
+            segment_ids: list[Union[UUID, str]],
+    ) -> None:
+        """从排除集合中清除已删除的文档及片段，已删除的数据不会再被召回，所以无需递增排除集合的版本号，但需要使检索结果缓存失效"""
+        pipeline = self.redis_client.pipeline()
+        if document_ids:
+            pipeline.srem(DATASET_EXCLUDED_DOCUMENTS.format(dataset_id=dataset_id), *[str(id) for id in document_ids])
+        if segment_ids:
+            pipeline.srem(DATASET_EXCLUDED_SEGMENTS.format(dataset_id=dataset_id), *[str(id) for id in segment_ids])
+        pipeline.execute()
+        self.retrieval_cache_service.bump_versions([dataset_id])
+
+    def delete_dataset(self, dataset_id: Union[UUID, str]) -> None:
+        """删除知识库对应的排除集合及版本号"""
+        self.redis_client.delete(
+            DATASET_EXCLUDED_DOCUMENTS.format(dataset_id=dataset_id),
+            DATASET_EXCLUDED_SEGMENTS.format(dataset_id=dataset_id),
+            DATASET_EXCLUSION_VERSION.format(dataset_id=dataset_id),
+        )
+
+    def get_version(self, dataset_id: Union[UUID, str]) -> int:
+        """获取知识库排除集合的版本号"""
+        self.ensure_built([dataset_id])
+        return int(self.redis_client.get(DATASET_EXCLUSION_VERSION.format(dataset_id=dataset_id)) or 0)
+
+    def filter_documents(self, lc_documents: list[LCDocument]) -> list[LCDocument]:
+        """过滤LangChain文档列表中归属已禁用文档或者本身已禁用的片段，保持原有顺序"""
+        if not lc_documents:
+            return []
+
+        # 1.按知识库对候选文档进行分组
+        dataset_ids = list(dict.fromkeys(str(lc_document.metadata["dataset_id"]) for lc_document in lc_documents))
+        self.ensure_built(dataset_ids)
+        groups: dict[str, list[LCDocument]] = {dataset_id: [] for dataset_id in dataset_ids}
+        for lc_document in lc_documents:
+            groups[str(lc_document.metadata["dataset_id"])].append(lc_document)
+
+        # 2.使用管道一次性判断所有候选文档及片段是否在排除集合中，只涉及候选数据而不需要读取整个集合
+        pipeline = self.redis_client.pipeline()
+        for dataset_id, group in groups.items():
+            pipeline.smismember(
+                DATASET_EXCLUDED_DOCUMENTS.format(dataset_id=dataset_id),
+                [str(lc_document.metadata["document_id"]) for lc_document in group],
+            )
+            pipeline.smismember(
+                DATASET_EXCLUDED_SEGMENTS.format(dataset_id=dataset_id),
+                [str(lc_document.metadata["segment_id"]) for lc_document in group],
+            )
+        results = pipeline.execute()
+
+        # 3.汇总被排除的文档对象，并按原有顺序返回剩余文档
+        excluded = set()
+        for index, group in enumerate(groups.values()):
+            document_flags, segment_flags = results[index * 2], results[index * 2 + 1]
+            for lc_document, document_flag, segment_flag in zip(group, document_flags, segment_flags):
+                if document_flag or segment_flag:
+                    excluded.add(id(lc_document))
+
+        return [lc_document for lc_document in lc_documents if id(lc_document) not in excluded]
+
+    def search_with_exclusion(self, search: Callable[[int], list[LCDocument]], k: int) -> list[LCDocument]:
+        """过度召回并过滤已禁用的数据，过滤后数量不足k且还可能存在更多数据时扩大召回数量重试"""
+        factor = max(int(os.getenv("RETRIEVAL_OVER_FETCH_FACTOR", 2)), 1)
+        fetch_k = k * factor
+        lc_documents = []
+        for _ in range(EXCLUSION_MAX_FETCH_ROUNDS):
+            candidates = search(fetch_k)
+            lc_documents = self.filter_documents(candidates)
+            if len(lc_documents) >= k or len(candidates) < fetch_k:
+                break
+            fetch_k *= max(factor, 2)
+
+        return lc_documents[:k]
+
+    def _update(
+            self, dataset_id: Union[UUID, str], key_format: str, ids: list[Union[UUID, str]], excluded: bool,
+    ) -> None:
+        """增删排除集合中的数据，集合发生变化时递增版本号"""
+        if not ids:
+            return
+
+        self.ensure_built([dataset_id])
+        cache_key = key_format.format(dataset_id=dataset_id)
+        values = [str(id) for id in ids]
+        changed = self.redis_client.sadd(cache_key, *values) if excluded else self.redis_client.srem(cache_key, *values)
+        if changed:
+            self.redis_client.incr(DATASET_EXCLUSION_VERSION.format(dataset_id=dataset_id))
+            self.retrieval_cache_service.bump_versions([dataset_id])
+
+    def ensure_built(self, dataset_ids: list[Union[UUID, str]]) -> None:
+        """检测知识库的排除集合是否已构建，未构建(例如缓存被清除)时从数据库重建"""
+        pipeline = self.redis_client.pipeline()
+        for dataset_id in dataset_ids:
+            pipeline.exists(DATASET_EXCLUSION_VERSION.format(dataset_id=dataset_id))
+        for dataset_id, exists in zip(dataset_ids, pipeline.execute()):
+            if not exists:
+                self._rebuild(dataset_id)
+
+    def _rebuild(self, dataset_id: Union[UUID, str]) -> None:
+        """从数据库重建知识库的排除集合，涵盖未启用的文档及片段，构建中的片段尚未启用，同样会被排除"""
+        with self.redis_client.lock(LOCK_DATASET_EXCLUSION_REBUILD.format(dataset_id=dataset_id), LOCK_EXPIRE_TIME):
+            # 1.获取锁后再次检测，避免并发时重复构建
+            version_key = DATASET_EXCLUSION_VERSION.format(dataset_id=dataset_id)
+            if self.redis_client.exists(version_key):
+                return
+
+            # 2.查询知识库下已禁用的文档及片段
+            document_ids = [str(id) for id, in self.db.session.query(Document).with_entities(Document.id).filter(
+                Document.dataset_id == dataset_id,
+                Document.enabled == False,
+            ).all()]
+            segment_ids = [str(id) for id, in self.db.session.query(Segment).with_entities(Segment.id).filter(
+                Segment.dataset_id == dataset_id,
+                Segment.enabled == False,
+            ).all()]
+
+            # 3.在同一个事务内写入集合并设置版本号
+            pipeline = self.redis_client.pipeline(transaction=True)
+            documents_key = DATASET_EXCLUDED_DOCUMENTS.format(dataset_id=dataset_id)
+            segments_key = DATASET_EXCLUDED_SEGMENTS.format(dataset_id=dataset_id)
+            pipeline.delete(documents_key, segments_key)
+            if document_ids:
+                pipeline.sadd(documents_key, *document_ids)
+            if segment_ids:
+                pipeline.sadd(segments_key, *segment_ids)
+            pipeline.set(version_key, 1)
+            pipeline.execute()
@@ -16,17 +16,22 @@ from injector import inject
 from redis import Redis
 from sqlalchemy import desc, asc, func
 
-from internal.entity.cache_entity import LOCK_DOCUMENT_UPDATE_ENABLED, LOCK_EXPIRE_TIME
 from internal.entity.dataset_entity import ProcessType, DocumentStatus, SegmentStatus
 from internal.entity.upload_file_entity import ALLOWED_DOCUMENT_EXTENSION
 from internal.exception import ForbiddenException, FailException, NotFoundException
 from internal.lib.helper import datetime_to_timestamp
 from internal.model import Dataset, Document, Segment, UploadFile, ProcessRule, Account
 from internal.schema.document_schema import GetDocumentsWithPageReq
-from internal.task.document_task import build_documents, update_document_enabled, delete_document
+from internal.task.document_task import (
+    build_documents,
+    build_document,
+    update_document_file,
+    delete_document,
+)
 from pkg.paginator import Paginator
 from pkg.sqlalchemy import SQLAlchemy
 from .base_service import BaseService
+from .dataset_exclusion_service import DatasetExclusionService
 
 
 @inject
@@ -35,6 +40,7 @@ class DocumentService(BaseService):
     """文档服务"""
     db: SQLAlchemy
     redis_client: Redis
+    dataset_exclusion_service: DatasetExclusionService
 
     def create_documents(
             self,
@@ -96,10 +102,13 @@ class DocumentService(BaseService):
             )
             documents.append(document)
 
-        # 6.调用异步任务，完成后续操作
+        # 6.新建的文档在构建完成前处于禁用状态，将其加入检索排除集合
+        self.dataset_exclusion_service.disable_documents(dataset_id, [document.id for document in documents])
+
+        # 7.调用异步任务，完成后续操作
         build_documents.delay([document.id for document in documents])
 
-        # 7.返回文档列表与处理批次
+        # 8.返回文档列表与处理批次
         return documents, batch
 
     def get_documents_status(self, dataset_id: UUID, batch: str, account: Account) -> list[dict]:
@@ -179,7 +188,7 @@ class DocumentService(BaseService):
             enabled: bool,
             account: Account,
     ) -> Document:
-        """根据传递的知识库id+文档id，更新文档的启用状态，同时会异步更新weaviate向量数据库中的数据"""
+        """根据传递的知识库id+文档id，更新文档的启用状态，检索时通过排除集合过滤，无需修改向量数据库及关键词表"""
         # 1.获取文档并校验权限
         document = self.get(Document, document_id)
         if document is None:
@@ -195,22 +204,28 @@ class DocumentService(BaseService):
         if document.enabled == enabled:
             raise FailException(f"文档状态修改错误，当前已是{'启用' if enabled else '禁用'}状态")
 
-        # 4.获取更新文档启用状态的缓存键并检测是否上锁
-        cache_key = LOCK_DOCUMENT_UPDATE_ENABLED.format(document_id=document.id)
-        cache_result = self.redis_client.get(cache_key)
-        if cache_result is not None:
-            raise FailException("当前文档正在修改启用状态，请稍后再次尝试")
-
-        # 5.修改文档的启用状态并设置缓存键，缓存时间为600s
+        # 4.修改文档的启用状态
         self.update(
             document,
             enabled=enabled,
             disabled_at=None if enabled else datetime.now(),
         )
-        self.redis_client.setex(cache_key, LOCK_EXPIRE_TIME, 1)
 
-        # 6.启用异步任务完成后续操作
-        update_document_enabled.delay(document.id)
+        # 5.同步更新检索排除集合，只涉及一个集合元素，与文档的片段数无关
+        try:
+            if enabled:
+                self.dataset_exclusion_service.enable_documents(dataset_id, [document.id])
+            else:
+                self.dataset_exclusion_service.disable_documents(dataset_id, [document.id])
+        except Exception as e:
+            # 6.排除集合更新失败时将文档状态修改回原来的状态
+            logging.exception("修改文档启用状态失败，文档id：%(document_id)s，错误信息：%(error)s", {"document_id": document.id, "error": str(e)})
+            self.update(
+                document,
+                enabled=not enabled,
+                disabled_at=datetime.now() if enabled else None,
+            )
+            raise FailException("更新文档启用状态失败，请稍后重试")
 
         return document
 
@@ -227,14 +242,69 @@ class DocumentService(BaseService):
         if document.status not in [DocumentStatus.COMPLETED, DocumentStatus.ERROR]:
             raise FailException("当前文档处于不可删除状态，请稍后重试")
 
-        # 3.删除postgres中的文档基础信息
+        # 3.删除postgres中的文档基础信息，并立即将文档加入检索排除集合，避免异步清理完成前仍被检索到
         self.delete(document)
+        self.dataset_exclusion_service.disable_documents(dataset_id, [document_id])
 
         # 4.调用异步任务执行后续操作，涵盖：关键词表更新、片段数据删除、weaviate记录删除等
         delete_document.delay(dataset_id, document_id)
 
         return document
 
+    def update_document_file(
+            self, dataset_id: UUID, document_id: UUID, upload_file_id: UUID, account: Account,
+    ) -> Document:
+        """根据传递的知识库id+文档id+新上传文件id替换文档文件，后端只对变化的片段重新构建索引"""
+        # 1.获取文档并校验权限
+        document = self.get(Document, document_id)
+        if document is None:
+            raise NotFoundException("该文档不存在，请核实后重试")
+        if document.dataset_id != dataset_id or document.account_id != account.id:
+            raise ForbiddenException("当前用户无权限更新该知识库下的文档，请核实后重试")
+
+        # 2.只有构建完成/出错的文档才可以替换文件
+        if document.status not in [DocumentStatus.COMPLETED, DocumentStatus.ERROR]:
+            raise FailException("当前文档正在构建中，请稍后重试")
+
+        # 3.校验上传文件的权限与扩展名
+        upload_file = self.get(UploadFile, upload_file_id)
+        if upload_file is None or upload_file.account_id != account.id:
+            raise NotFoundException("该上传文件不存在，请核实后重试")
+        if upload_file.extension.lower() not in ALLOWED_DOCUMENT_EXTENSION:
+            raise FailException("暂未解析到合法文件，请重新上传")
+
+        # 4.更新文档状态为等待中，并调用异步任务增量更新文档，文件id在片段更新完成后才会切换
+        self.update(document, status=DocumentStatus.WAITING, error="", stopped_at=None)
+        update_document_file.delay(document.id, upload_file.id)
+
+        return document
+
+    def rebuild_document(self, dataset_id: UUID, document_id: UUID, account: Account) -> Document:
+        """根据传递的知识库id+文档id重新构建文档，构建过程会从上次中断的阶段继续，只处理未完成的片段"""
+        # 1.获取文档并校验权限
+        document = self.get(Document, document_id)
+        if document is None:
+            raise NotFoundException("该文档不存在，请核实后重试")
+        if document.dataset_id != dataset_id or document.account_id != account.id:
+            raise ForbiddenException("当前用户无权限重新构建该知识库下的文档，请核实后重试")
+
+        # 2.只有构建出错，或者构建完成但存在出错片段的文档才可以重新构建
+        if document.status == DocumentStatus.COMPLETED:
+            error_segment_count = self.db.session.query(func.count(Segment.id)).filter(
+                Segment.document_id == document.id,
+                Segment.status == SegmentStatus.ERROR,
+            ).scalar()
+            if error_segment_count == 0:
+                raise FailException("当前文档已构建完成，无需重新构建")
+        elif document.status != DocumentStatus.ERROR:
+            raise FailException("当前文档正在构建中，请稍后重试")
+
+        # 3.更新文档状态为等待中，并调用异步任务从中断的阶段继续构建
+        self.update(document, status=DocumentStatus.WAITING, error="", stopped_at=None)
+        build_document.delay(document.id)
+
+        return document
+
     def get_documents_with_page(
             self, dataset_id: UUID, req: GetDocumentsWithPageReq, account: Account,
     ) -> tuple[list[Document], Paginator]:
@@ -5,50 +5,94 @@
 @Author  : thezehui@gmail.com
 @File    : embeddings_service.py
 """
+import os
 from dataclasses import dataclass
+from functools import lru_cache
 
-import tiktoken
 from injector import inject
-from langchain.embeddings import CacheBackedEmbeddings
 from langchain_community.storage import RedisStore
 from langchain_core.embeddings import Embeddings
 from langchain_openai import OpenAIEmbeddings
 from redis import Redis
 
+from internal.core.text_embedding import (
+    CacheBackedEmbeddings,
+    EmbeddingDispatcher,
+    LocalEmbeddings,
+    TieredByteStore,
+    get_local_embeddings,
+    get_lru_byte_cache,
+)
+from internal.entity.cache_entity import EMBEDDINGS_CACHE_STATS
+from .tokenizer_service import TokenizerService
+
+# OpenAI文本嵌入模型名字
+OPENAI_EMBEDDINGS_MODEL = "text-embedding-3-small"
+
+# 旧版本文本嵌入缓存的命名空间
+LEGACY_EMBEDDINGS_NAMESPACE = "embeddings"
+
+
+@lru_cache(maxsize=1)
+def _get_openai_embeddings() -> EmbeddingDispatcher:
+    """获取进程内共享的OpenAI文本嵌入模型，并发的嵌入请求会合并成一次批量调用，同时限制执行中的请求数"""
+    return EmbeddingDispatcher(
+        OpenAIEmbeddings(model=OPENAI_EMBEDDINGS_MODEL),
+        max_batch_size=int(os.getenv("EMBEDDINGS_DISPATCH_BATCH_SIZE", 100)),
+        max_wait_ms=float(os.getenv("EMBEDDINGS_DISPATCH_MAX_WAIT_MS", 5)),
+        max_in_flight=int(os.getenv("EMBEDDINGS_DISPATCH_MAX_IN_FLIGHT", 4)),
+    )
+
 
 @inject
 @dataclass
 class EmbeddingsService:
     """文本嵌入模型服务"""
-    _store: RedisStore
+    _store: TieredByteStore
     _embeddings: Embeddings
     _cache_backed_embeddings: CacheBackedEmbeddings
 
     def __init__(self, redis: Redis):
         """构造函数，初始化文本嵌入模型客户端、存储器、缓存客户端"""
-        self._store = RedisStore(client=redis)
-        # self._embeddings = HuggingFaceEmbeddings(
-        #     model_name="Alibaba-NLP/gte-multilingual-base",
-        #     cache_folder=os.path.join(os.getcwd(), "internal", "core", "embeddings"),
-        #     model_kwargs={
-        #         "trust_remote_code": True,
-        #     }
-        # )
-        self._embeddings = OpenAIEmbeddings(model="text-embedding-3-small")
-        self._cache_backed_embeddings = CacheBackedEmbeddings.from_bytes_store(
+        # 进程内LRU缓存(按字节数限制容量)在前，redis在后，重复的文本无需访问redis
+        self._store = TieredByteStore(
+            local=get_lru_byte_cache(int(os.getenv("EMBEDDINGS_LOCAL_CACHE_MAX_BYTES", 64 * 1024 * 1024))),
+            remote=RedisStore(client=redis),
+            redis_client=redis,
+            stats_key=EMBEDDINGS_CACHE_STATS,
+        )
+
+        # 根据EMBEDDINGS_BACKEND选择文本嵌入模型，local为本地CPU推理的gte-multilingual模型，进程内只加载一次
+        if os.getenv("EMBEDDINGS_BACKEND", "openai") == "local":
+            self._embeddings = get_local_embeddings()
+            namespace = self._embeddings.namespace
+            legacy_store = None
+        else:
+            # OpenAI模型兼容旧版本写入redis的JSON缓存(命名空间为embeddings)，读取时迁移为新的缓存格式
+            self._embeddings = _get_openai_embeddings()
+            namespace = f"embeddings:{OPENAI_EMBEDDINGS_MODEL}"
+            legacy_store = self._store.remote
+        self._cache_backed_embeddings = CacheBackedEmbeddings(
             self._embeddings,
             self._store,
-            namespace="embeddings",
+            namespace,
+            dtype=os.getenv("EMBEDDINGS_CACHE_DTYPE", "float32"),
+            legacy_store=legacy_store,
+            legacy_namespace=LEGACY_EMBEDDINGS_NAMESPACE,
         )
 
+    def warm_up(self) -> None:
+        """预热文本嵌入模型，只有本地模型需要预热"""
+        if isinstance(self._embeddings, LocalEmbeddings):
+            self._embeddings.warm_up()
+
     @classmethod
     def calculate_token_count(cls, query: str) -> int:
-        """计算传入文本的token数"""
-        encoding = tiktoken.encoding_for_model("gpt-3.5")
-        return len(encoding.encode(query))
+        """计算传入文本的token数，统一交由分词器服务计算并缓存"""
+        return TokenizerService.count_token(query)
 
     @property
-    def store(self) -> RedisStore:
+    def store(self) -> TieredByteStore:
         return self._store
 
     @property
@@ -0,0 +1,128 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+@Time    : 2024/12/19 16:40
+@Author  : thezehui@gmail.com
+@File    : indexing_metric_service.py
+"""
+import json
+import logging
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Any, Iterator, Optional
+from uuid import UUID
+
+from injector import inject
+from redis import Redis
+
+from internal.entity.cache_entity import (
+    INDEXING_METRICS_DATASET,
+    INDEXING_METRICS_ACCOUNT,
+    INDEXING_METRICS_MAX_RECORDS,
+)
+from internal.entity.dataset_entity import IndexingStage
+from internal.exception import NotFoundException
+from internal.model import Account, Dataset
+from pkg.sqlalchemy import SQLAlchemy
+from .base_service import BaseService
+
+
+@dataclass
+class IndexingMetric:
+    """单次索引构建阶段的指标数据，耗时单位为秒"""
+    duration: float = 0
+    items: int = 0
+    tokens: int = 0
+    bytes: int = 0
+
+
+@inject
+@dataclass
+class IndexingMetricService(BaseService):
+    """索引构建指标服务，按阶段记录耗时、处理条数、token数、字节数，并按知识库及账号维度聚合"""
+    db: SQLAlchemy
+    redis_client: Redis
+
+    def record(self, account_id: UUID, dataset_id: UUID, stage: IndexingStage, metric: IndexingMetric) -> None:
+        """记录指定账号下知识库某个阶段的一次指标数据，指标记录失败不影响索引构建"""
+        try:
+            value = json.dumps({
+                "duration": metric.duration,
+                "items": metric.items,
+                "tokens": metric.tokens,
+                "bytes": metric.bytes,
+                "created_at": int(time.time()),
+            })
+            pipeline = self.redis_client.pipeline()
+            for cache_key in [
+                INDEXING_METRICS_DATASET.format(dataset_id=dataset_id, stage=stage.value),
+                INDEXING_METRICS_ACCOUNT.format(account_id=account_id, stage=stage.value),
+            ]:
+                pipeline.lpush(cache_key, value)
+                pipeline.ltrim(cache_key, 0, INDEXING_METRICS_MAX_RECORDS - 1)
+            pipeline.execute()
+        except Exception as e:
+            logging.warning("记录索引构建指标失败，错误信息：%(error)s", {"error": str(e)})
+
+    @contextmanager
+    def measure(self, account_id: UUID, dataset_id: UUID, stage: IndexingStage) -> Iterator[IndexingMetric]:
+        """计时上下文，调用方在上下文内填充处理条数、token数、字节数，退出时记录耗时及指标"""
+        metric = IndexingMetric()
+        start_at = time.perf_counter()
+        try:
+            yield metric
+        finally:
+            metric.duration = time.perf_counter() - start_at
+            self.record(account_id, dataset_id, stage, metric)
+
+    def get_dataset_metrics(self, dataset_id: UUID, account: Account) -> dict[str, Any]:
+        """根据传递的知识库id+账号获取该知识库各阶段的索引构建聚合指标"""
+        dataset = self.get(Dataset, dataset_id)
+        if dataset is None or dataset.account_id != account.id:
+            raise NotFoundException("该知识库不存在，或无权限")
+
+        return self._aggregate(lambda stage: INDEXING_METRICS_DATASET.format(dataset_id=dataset_id, stage=stage))
+
+    def get_account_metrics(self, account: Account) -> dict[str, Any]:
+        """获取账号下所有知识库汇总的各阶段索引构建聚合指标"""
+        return self._aggregate(lambda stage: INDEXING_METRICS_ACCOUNT.format(account_id=account.id, stage=stage))
+
+    def _aggregate(self, get_cache_key) -> dict[str, Any]:
+        """读取各阶段的指标记录并计算耗时分位数、吞吐量"""
+        # 1.使用管道一次性读取所有阶段的指标记录
+        pipeline = self.redis_client.pipeline()
+        for stage in IndexingStage:
+            pipeline.lrange(get_cache_key(stage.value), 0, -1)
+        stage_records = pipeline.execute()
+
+        # 2.逐个阶段计算聚合数据
+        metrics = {}
+        for stage, records in zip(IndexingStage, stage_records):
+            records = [json.loads(record) for record in records]
+            durations = sorted([record["duration"] for record in records])
+            total_duration = sum(durations)
+            items = sum([record["items"] for record in records])
+            tokens = sum([record["tokens"] for record in records])
+            total_bytes = sum([record["bytes"] for record in records])
+            metrics[stage.value] = {
+                "count": len(records),
+                "p50": self._percentile(durations, 50),
+                "p95": self._percentile(durations, 95),
+                "items": items,
+                "tokens": tokens,
+                "bytes": total_bytes,
+                "items_per_second": round(items / total_duration, 2) if total_duration > 0 else 0,
+                "tokens_per_second": round(tokens / total_duration, 2) if total_duration > 0 else 0,
+                "bytes_per_second": round(total_bytes / total_duration, 2) if total_duration > 0 else 0,
+            }
+
+        return metrics
+
+    @classmethod
+    def _percentile(cls, sorted_values: list[float], percent: int) -> Optional[float]:
+        """计算已排序数值列表的分位数(最近秩法)，列表为空时返回None"""
+        if not sorted_values:
+            return None
+        index = max(0, -(-len(sorted_values) * percent // 100) - 1)
+        return round(sorted_values[index], 4)
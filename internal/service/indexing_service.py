@@ -6,36 +6,76 @@
 @File    : indexing_service.py
 """
 import logging
+import os
 import re
+import time
 import uuid
 from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from dataclasses import dataclass
 from datetime import datetime
+from difflib import SequenceMatcher
+from itertools import islice
+from queue import Queue
+from threading import Event, Thread
+from typing import Iterator, Iterable, Optional
 from uuid import UUID
 
-from flask import Flask, current_app
 from injector import inject
 from langchain_core.documents import Document as LCDocument
 from redis import Redis
-from sqlalchemy import func
-from weaviate.classes.query import Filter
+from sqlalchemy import func, update, insert
 
 from internal.core.file_extractor import FileExtractor
 from internal.entity.cache_entity import (
-    LOCK_DOCUMENT_UPDATE_ENABLED
+    LOCK_DATASET_BUILD_DOCUMENT_SLOTS,
+    BUILD_DOCUMENT_SLOT_EXPIRE_TIME,
+    BUILD_DOCUMENT_SLOT_HEARTBEAT_INTERVAL,
+    EMBEDDINGS_REUSED_COUNT,
 )
-from internal.entity.dataset_entity import DocumentStatus, SegmentStatus
-from internal.exception import NotFoundException
+from internal.entity.dataset_entity import DocumentStatus, SegmentStatus, IndexingStage
 from internal.lib.helper import generate_text_hash
-from internal.model import Document, Segment, KeywordTable, DatasetQuery
+from internal.model import Document, Segment, KeywordIndex, DatasetQuery, UploadFile
 from pkg.sqlalchemy import SQLAlchemy
 from .base_service import BaseService
+from .bm25_index_service import BM25IndexService
+from .dataset_exclusion_service import DatasetExclusionService
 from .embeddings_service import EmbeddingsService
+from .indexing_metric_service import IndexingMetricService, IndexingMetric
 from .jieba_service import JiebaService
 from .keyword_table_service import KeywordTableService
 from .process_rule_service import ProcessRuleService
+from .retrieval_cache_service import RetrievalCacheService
+from .tokenizer_service import TokenizerService
 from .vector_database_service import VectorDatabaseService
 
+# 流式解析时每个窗口处理的页面数
+PARSING_WINDOW_SIZE = 20
+
+# 索引构建阶段单条语句批量更新的片段数
+INDEXING_SEGMENT_BATCH_SIZE = 500
+
+# 获取文档构建槽位的Lua脚本，清理过期槽位后判断并发数，已持有槽位的文档可重复获取
+ACQUIRE_BUILD_DOCUMENT_SLOT_SCRIPT = """
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', tonumber(ARGV[1]) - tonumber(ARGV[3]))
+if redis.call('ZSCORE', KEYS[1], ARGV[4]) or redis.call('ZCARD', KEYS[1]) < tonumber(ARGV[2]) then
+    redis.call('ZADD', KEYS[1], ARGV[1], ARGV[4])
+    redis.call('EXPIRE', KEYS[1], ARGV[3])
+    return 1
+end
+return 0
+"""
+
+# 续期文档构建槽位的Lua脚本，只续期仍然持有的槽位，槽位已过期被清理时不会重新占用
+REFRESH_BUILD_DOCUMENT_SLOT_SCRIPT = """
+if redis.call('ZSCORE', KEYS[1], ARGV[2]) then
+    redis.call('ZADD', KEYS[1], ARGV[1], ARGV[2])
+    redis.call('EXPIRE', KEYS[1], ARGV[3])
+    return 1
+end
+return 0
+"""
+
 
 @inject
 @dataclass
@@ -49,102 +89,329 @@ class IndexingService(BaseService):
     jieba_service: JiebaService
     keyword_table_service: KeywordTableService
     vector_database_service: VectorDatabaseService
+    tokenizer_service: TokenizerService
+    indexing_metric_service: IndexingMetricService
+    dataset_exclusion_service: DatasetExclusionService
+    retrieval_cache_service: RetrievalCacheService
+    bm25_index_service: BM25IndexService
+
+    def build_document(self, document_id: UUID) -> bool:
+        """根据传递的文档id构建知识库文档，同一知识库的并发构建数受限，返回False表示暂无可用槽位需稍后重试"""
+        # 1.获取文档记录，文档不存在(例如已被删除)则无需构建
+        document = self.get(Document, document_id)
+        if document is None:
+            logging.warning("构建的文档不存在，文档id：%(document_id)s", {"document_id": document_id})
+            return True
 
-    def build_documents(self, document_ids: list[UUID]) -> None:
-        """根据传递的文档id列表构建知识库文档，涵盖了加载、分割、索引构建、数据存储等内容"""
-        # 1.根据传递的文档id获取所有文档
-        documents = self.db.session.query(Document).filter(
-            Document.id.in_(document_ids)
-        ).all()
+        # 2.获取当前知识库的构建槽位，获取失败时文档维持等待状态
+        if not self._acquire_build_document_slot(document.dataset_id, document.id):
+            return False
 
-        # 2.执行循环遍历所有文档完成对每个文档的构建
-        for document in documents:
-            try:
-                # 3.更新当前状态为解析中，并记录开始处理的时间
-                self.update(document, status=DocumentStatus.PARSING, processing_started_at=datetime.now())
+        # 3.构建文档，构建期间定时续期槽位，结束后释放槽位
+        try:
+            with self._build_document_slot_heartbeat(document.dataset_id, document.id):
+                self._build_document(document)
+        finally:
+            self._release_build_document_slot(document.dataset_id, document.id)
 
-                # 4.执行文档加载步骤，并更新文档的状态与时间
-                lc_documents = self._parsing(document)
+        return True
+
+    def update_document_file(self, document_id: UUID, upload_file_id: UUID) -> bool:
+        """根据传递的文档id+新上传文件id增量更新文档，返回False表示暂无可用槽位需稍后重试"""
+        # 1.获取文档及上传文件记录，任意一个不存在则无需更新
+        document = self.get(Document, document_id)
+        upload_file = self.get(UploadFile, upload_file_id)
+        if document is None or upload_file is None:
+            logging.warning(
+                "增量更新的文档或文件不存在，文档id：%(document_id)s，文件id：%(upload_file_id)s",
+                {"document_id": document_id, "upload_file_id": upload_file_id},
+            )
+            return True
 
-                # 5.执行文档分割步骤，并更新文档状态与时间，涵盖了片段的信息
-                lc_segments = self._splitting(document, lc_documents)
+        # 2.获取当前知识库的构建槽位，获取失败时文档维持等待状态
+        if not self._acquire_build_document_slot(document.dataset_id, document.id):
+            return False
 
-                # 6.执行文档索引构建，涵盖关键词提取、向量，并更新数据状态
-                self._indexing(document, lc_segments)
+        # 3.增量更新文档，更新期间定时续期槽位，结束后释放槽位
+        try:
+            with self._build_document_slot_heartbeat(document.dataset_id, document.id):
+                self._update_document_file(document, upload_file)
+        finally:
+            self._release_build_document_slot(document.dataset_id, document.id)
 
-                # 7.存储操作，涵盖文档状态更新，以及向量数据库的存储
-                self._completed(document, lc_segments)
+        return True
 
-            except Exception as e:
-                logging.exception("构建文档发生错误，错误信息：%(error)s", {"error": e})
+    def _update_document_file(self, document: Document, upload_file: UploadFile) -> None:
+        """增量更新文档文件，按位置对比新旧片段的哈希值，保留未变化的片段及向量，只新增变化的片段并删除被移除的片段"""
+        start_at = time.perf_counter()
+        try:
+            # 1.更新当前状态为解析中，并记录开始处理的时间
+            self.update(
+                document,
+                status=DocumentStatus.PARSING,
+                processing_started_at=datetime.now(),
+                error="",
+                stopped_at=None,
+            )
+
+            # 2.解析并分割新文件，对比需要用到全部新片段，所以此处会汇总所有窗口的分割结果
+            lc_segments = [
+                lc_segment
+                for window_segments in self._split_windows(document, self._parsing(document, upload_file))
+                for lc_segment in window_segments
+            ]
+
+            # 3.按位置加载文档已有的片段，并使用哈希值序列对比新旧片段，内容相同的片段直接保留
+            segments = self.db.session.query(Segment).with_entities(
+                Segment.id, Segment.node_id, Segment.hash,
+            ).filter(
+                Segment.document_id == document.id,
+            ).order_by(Segment.position).all()
+            kept_segment_ids = {
+                new_index: segments[old_index].id for new_index, old_index in self._match_segments(
+                    [segment.hash for segment in segments],
+                    [generate_text_hash(lc_segment.page_content) for lc_segment in lc_segments],
+                ).items()
+            }
+            kept_ids = set(kept_segment_ids.values())
+            removed_segments = [segment for segment in segments if segment.id not in kept_ids]
+
+            # 4.构建保留片段的位置更新数据以及新增片段的记录
+            position_updates, records = [], []
+            for index, lc_segment in enumerate(lc_segments):
+                if index in kept_segment_ids:
+                    position_updates.append({"id": kept_segment_ids[index], "position": index + 1})
+                else:
+                    records.extend(self._build_segment_records(document, [lc_segment], index))
+            token_count = sum(self.tokenizer_service.count_tokens([lc_segment.page_content for lc_segment in lc_segments]))
+
+            # 5.在同一个事务内删除被移除的片段、更新保留片段的位置、新增片段，并切换文档文件，避免中断时文档处于不一致的状态
+            with self.db.auto_commit():
+                removed_segment_ids = [segment.id for segment in removed_segments]
+                for i in range(0, len(removed_segment_ids), INDEXING_SEGMENT_BATCH_SIZE):
+                    self.db.session.query(Segment).filter(
+                        Segment.id.in_(removed_segment_ids[i:i + INDEXING_SEGMENT_BATCH_SIZE]),
+                    ).delete(synchronize_session=False)
+                for i in range(0, len(position_updates), INDEXING_SEGMENT_BATCH_SIZE):
+                    self.db.session.execute(update(Segment), position_updates[i:i + INDEXING_SEGMENT_BATCH_SIZE])
+                for i in range(0, len(records), INDEXING_SEGMENT_BATCH_SIZE):
+                    self.db.session.execute(insert(Segment), records[i:i + INDEXING_SEGMENT_BATCH_SIZE])
+                document.upload_file_id = upload_file.id
+                document.token_count = token_count
+                document.status = DocumentStatus.INDEXING
+                document.splitting_completed_at = datetime.now()
+
+            # 6.新增的片段在写入向量数据库之前保持排除，避免检索到构建中的片段
+            self.dataset_exclusion_service.disable_segments(document.dataset_id, [record["id"] for record in records])
+
+            # 7.将被移除片段的关键词、向量及检索排除集合中的记录分别一次性批量删除，并使检索结果缓存失效
+            self.keyword_table_service.delete_keyword_table_from_ids(
+                document.dataset_id, [segment.id for segment in removed_segments],
+            )
+            self.vector_database_service.delete_documents([str(segment.node_id) for segment in removed_segments])
+            self.dataset_exclusion_service.remove(document.dataset_id, [], removed_segment_ids)
+            logging.info(
+                "文档增量更新，文档id：%(document_id)s，保留片段数：%(kept)s，新增片段数：%(added)s，删除片段数：%(removed)s",
+                {
+                    "document_id": document.id,
+                    "kept": len(position_updates),
+                    "added": len(records),
+                    "removed": len(removed_segments),
+                },
+            )
+
+            # 8.只对新增的片段提取关键词并写入向量数据库，关键词与向量均为批量写入
+            self._indexing(document, self._get_lc_segments(document, [SegmentStatus.WAITING]))
+            self._completed(document, self._get_lc_segments(document, [SegmentStatus.INDEXING, SegmentStatus.ERROR]))
+
+            # 9.记录文档整体构建的指标
+            self._record_total_metric(document, start_at)
+
+        except Exception as e:
+            logging.exception("增量更新文档发生错误，错误信息：%(error)s", {"error": e})
+            self.update(
+                document,
+                status=DocumentStatus.ERROR,
+                error=str(e),
+                stopped_at=datetime.now(),
+            )
+
+    @classmethod
+    def _match_segments(cls, old_hashes: list[str], new_hashes: list[str]) -> dict[int, int]:
+        """按位置对比新旧片段的哈希值序列，返回内容未变化的 新片段下标->旧片段下标 映射"""
+        matcher = SequenceMatcher(None, old_hashes, new_hashes, autojunk=False)
+        matches = {}
+        for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+            if tag == "equal":
+                for offset in range(i2 - i1):
+                    matches[j1 + offset] = i1 + offset
+        return matches
+
+    def _build_document(self, document: Document) -> None:
+        """构建单个知识库文档，涵盖了加载、分割、索引构建、数据存储等内容，每个阶段的进度都会记录在文档及片段上，重新构建时从中断的阶段继续"""
+        start_at = time.perf_counter()
+        try:
+            if document.splitting_completed_at is None:
+                # 1.分割阶段未完成，清除上次中断残留的片段后，更新当前状态为解析中，并记录开始处理的时间
+                self._clear_unfinished_segments(document)
                 self.update(
                     document,
-                    status=DocumentStatus.ERROR,
-                    error=str(e),
-                    stopped_at=datetime.now(),
+                    status=DocumentStatus.PARSING,
+                    processing_started_at=datetime.now(),
+                    error="",
+                    stopped_at=None,
                 )
 
-    def update_document_enabled(self, document_id: UUID) -> None:
-        """根据传递的文档id更新文档状态，同时修改weaviate向量数据库中的记录"""
-        # 1.构建缓存键
-        cache_key = LOCK_DOCUMENT_UPDATE_ENABLED.format(document_id=document_id)
+                # 2.执行文档加载步骤，解析结果以生成器的形式按页流入分割步骤，并更新文档的状态与时间
+                lc_documents = self._parsing(document)
 
-        # 2.根据传递的document_id获取文档记录
-        document = self.get(Document, document_id)
-        if document is None:
-            logging.exception("当前文档不存在，文档id：%(document_id)s", {"document_id": document_id})
-            raise NotFoundException("当前文档不存在")
-
-        # 3.查询归属于当前文档的所有片段的节点id
-        segments = self.db.session.query(Segment).with_entities(Segment.id, Segment.node_id, Segment.enabled).filter(
-            Segment.document_id == document_id,
-            Segment.status == SegmentStatus.COMPLETED,
-        ).all()
-        segment_ids = [id for id, _, _ in segments]
-        node_ids = [node_id for _, node_id, _ in segments]
-        try:
-            # 4.执行循环遍历所有node_ids并更新向量数据
-            collection = self.vector_database_service.collection
-            for node_id in node_ids:
-                try:
-                    collection.data.update(
-                        uuid=node_id,
-                        properties={
-                            "document_enabled": document.enabled,
-                        }
-                    )
-                except Exception as e:
-                    with self.db.auto_commit():
-                        self.db.session.query(Segment).filter(
-                            Segment.node_id == node_id,
-                        ).update({
-                            "error": str(e),
-                            "status": SegmentStatus.ERROR,
-                            "enabled": False,
-                            "disabled_at": datetime.now(),
-                            "stopped_at": datetime.now(),
-                        })
-
-            # 5.更新关键词表对应的数据（enabled为false表示从关键词表中删除数据，enabled为true表示在关键词表中新增数据）
-            if document.enabled is True:
-                # 6.从禁用改为启用，需要新增关键词
-                enabled_segment_ids = [id for id, _, enabled in segments if enabled is True]
-                self.keyword_table_service.add_keyword_table_from_ids(document.dataset_id, enabled_segment_ids)
+                # 3.执行文档分割步骤，按窗口消费解析的页面并存储片段，并更新文档状态与时间
+                self._splitting(document, lc_documents)
             else:
-                # 7.从启用改为禁用，需要剔除关键词
-                self.keyword_table_service.delete_keyword_table_from_ids(document.dataset_id, segment_ids)
+                # 4.分割阶段已完成，直接从索引构建阶段继续
+                self.update(document, status=DocumentStatus.INDEXING, error="", stopped_at=None)
+
+            # 5.执行文档索引构建，只处理尚未提取关键词(等待中)的片段，并更新数据状态
+            self._indexing(document, self._get_lc_segments(document, [SegmentStatus.WAITING]))
+
+            # 6.存储操作，只处理尚未写入向量数据库(构建中/出错)的片段，涵盖文档状态更新，以及向量数据库的存储
+            self._completed(document, self._get_lc_segments(document, [SegmentStatus.INDEXING, SegmentStatus.ERROR]))
+
+            # 7.记录文档整体构建的指标
+            self._record_total_metric(document, start_at)
+
         except Exception as e:
-            # 5.记录日志并将状态修改回原来的状态
-            logging.exception("修改向量数据库文档启用状态失败，文档id：%(document_id)s，错误信息：%(error)s", {"document_id": document_id, "error": str(e)})
-            origin_enabled = not document.enabled
+            logging.exception("构建文档发生错误，错误信息：%(error)s", {"error": e})
             self.update(
                 document,
-                enabled=origin_enabled,
-                disabled_at=None if origin_enabled else datetime.now(),
+                status=DocumentStatus.ERROR,
+                error=str(e),
+                stopped_at=datetime.now(),
             )
+
+    def _record_total_metric(self, document: Document, start_at: float) -> None:
+        """记录文档整体构建的耗时、片段数、token数及文件字节数"""
+        segment_count = self.db.session.query(func.count(Segment.id)).filter(
+            Segment.document_id == document.id,
+        ).scalar()
+        self.indexing_metric_service.record(document.account_id, document.dataset_id, IndexingStage.TOTAL, IndexingMetric(
+            duration=time.perf_counter() - start_at,
+            items=segment_count,
+            tokens=document.token_count,
+            bytes=document.upload_file.size,
+        ))
+
+    def _clear_unfinished_segments(self, document: Document) -> None:
+        """清除文档分割阶段中断时残留的片段，分割未完成时片段还未提取关键词及写入向量数据库，只需删除postgres记录"""
+        with self.db.auto_commit():
+            self.db.session.query(Segment).filter(
+                Segment.document_id == document.id,
+            ).delete(synchronize_session=False)
+
+    def _get_lc_segments(self, document: Document, statuses: list[str]) -> list[LCDocument]:
+        """根据传递的文档+片段状态列表，从postgres中加载对应的片段并转换成LangChain文档"""
+        segments = self.db.session.query(Segment).with_entities(
+            Segment.id, Segment.node_id, Segment.content,
+        ).filter(
+            Segment.document_id == document.id,
+            Segment.status.in_(statuses),
+        ).order_by(Segment.position).all()
+
+        return [
+            LCDocument(
+                page_content=content,
+                metadata={
+                    "account_id": str(document.account_id),
+                    "dataset_id": str(document.dataset_id),
+                    "document_id": str(document.id),
+                    "segment_id": str(segment_id),
+                    "node_id": str(node_id),
+                },
+            ) for segment_id, node_id, content in segments
+        ]
+
+    def get_reusable_segments(self, account_id: UUID, hashes: list[str]) -> dict[str, tuple[str, list[str]]]:
+        """根据传递的账号id+片段哈希值列表，查找该账号下内容相同且已构建完成的片段，返回 哈希->(节点id, 关键词列表)"""
+        if not hashes:
+            return {}
+
+        reusable_segments = {}
+        for i in range(0, len(hashes), INDEXING_SEGMENT_BATCH_SIZE):
+            segments = self.db.session.query(Segment).with_entities(
+                Segment.hash, Segment.node_id, Segment.keywords,
+            ).filter(
+                Segment.account_id == account_id,
+                Segment.hash.in_(hashes[i:i + INDEXING_SEGMENT_BATCH_SIZE]),
+                Segment.status == SegmentStatus.COMPLETED,
+            ).all()
+            for hash, node_id, keywords in segments:
+                reusable_segments.setdefault(hash, (str(node_id), keywords))
+
+        return reusable_segments
+
+    def get_reusable_vectors(self, account_id: UUID, hashes: list[str]) -> dict[str, list[float]]:
+        """根据传递的账号id+片段哈希值列表，获取该账号下相同内容片段已存储的向量，返回 哈希->向量"""
+        reusable_segments = self.get_reusable_segments(account_id, hashes)
+        vectors = self.vector_database_service.get_vectors(
+            [node_id for node_id, _ in reusable_segments.values()],
+        )
+        return {
+            hash: vectors[node_id] for hash, (node_id, _) in reusable_segments.items() if node_id in vectors
+        }
+
+    def _acquire_build_document_slot(self, dataset_id: UUID, document_id: UUID) -> bool:
+        """获取知识库的文档构建槽位，最大并发数可通过INDEXING_MAX_CONCURRENCY_PER_DATASET配置"""
+        max_concurrency = int(os.getenv("INDEXING_MAX_CONCURRENCY_PER_DATASET", 4))
+        acquired = self.redis_client.eval(
+            ACQUIRE_BUILD_DOCUMENT_SLOT_SCRIPT,
+            1,
+            LOCK_DATASET_BUILD_DOCUMENT_SLOTS.format(dataset_id=dataset_id),
+            int(time.time()),
+            max_concurrency,
+            BUILD_DOCUMENT_SLOT_EXPIRE_TIME,
+            str(document_id),
+        )
+        return bool(acquired)
+
+    def _release_build_document_slot(self, dataset_id: UUID, document_id: UUID) -> None:
+        """释放知识库的文档构建槽位"""
+        self.redis_client.zrem(LOCK_DATASET_BUILD_DOCUMENT_SLOTS.format(dataset_id=dataset_id), str(document_id))
+
+    @contextmanager
+    def _build_document_slot_heartbeat(self, dataset_id: UUID, document_id: UUID) -> Iterator[None]:
+        """在后台线程中定时续期文档构建槽位，构建耗时超过槽位过期时间时并发限制依然有效"""
+        stopped = Event()
+
+        def heartbeat() -> None:
+            while not stopped.wait(BUILD_DOCUMENT_SLOT_HEARTBEAT_INTERVAL):
+                try:
+                    self.redis_client.eval(
+                        REFRESH_BUILD_DOCUMENT_SLOT_SCRIPT,
+                        1,
+                        LOCK_DATASET_BUILD_DOCUMENT_SLOTS.format(dataset_id=dataset_id),
+                        int(time.time()),
+                        str(document_id),
+                        BUILD_DOCUMENT_SLOT_EXPIRE_TIME,
+                    )
+                except Exception as e:
+                    logging.warning("续期文档构建槽位失败，文档id：%(document_id)s，错误信息：%(error)s", {
+                        "document_id": document_id, "error": e,
+                    })
+
+        thread = Thread(target=heartbeat, name="build-document-slot-heartbeat", daemon=True)
+        thread.start()
+        try:
+            yield
         finally:
-            # 6.清空缓存键表示异步操作已经执行完成，无论失败还是成功都全部清除
-            self.redis_client.delete(cache_key)
+            stopped.set()
+            thread.join()
+
+    def abandon_document(self, document_id: UUID, error: str) -> None:
+        """文档长时间获取不到构建槽位时放弃构建，将文档标记为出错，用户可以稍后重新构建"""
+        document = self.get(Document, document_id)
+        if document is None or document.status != DocumentStatus.WAITING:
+            return
+        self.update(document, status=DocumentStatus.ERROR, error=error, stopped_at=datetime.now())
 
     def delete_document(self, dataset_id: UUID, document_id: UUID) -> None:
         """根据传递的知识库id+文档id删除文档信息"""
@@ -156,10 +423,7 @@ class IndexingService(BaseService):
         ]
 
         # 2.调用向量数据库删除其关联记录
-        collection = self.vector_database_service.collection
-        collection.data.delete_many(
-            where=Filter.by_property("document_id").equal(document_id),
-        )
+        self.vector_database_service.delete_by_document(dataset_id, document_id)
 
         # 3.删除postgres关联的segment记录
         with self.db.auto_commit():
@@ -170,6 +434,9 @@ class IndexingService(BaseService):
         # 4.删除片段id对应的关键词记录
         self.keyword_table_service.delete_keyword_table_from_ids(dataset_id, segment_ids)
 
+        # 5.清除检索排除集合中该文档及片段的记录
+        self.dataset_exclusion_service.remove(dataset_id, [document_id], segment_ids)
+
     def delete_dataset(self, dataset_id: UUID) -> None:
         """根据传递的知识库id执行相应的删除操作"""
         try:
@@ -184,9 +451,9 @@ class IndexingService(BaseService):
                     Segment.dataset_id == dataset_id,
                 ).delete()
 
-                # 3.删除关联的关键词表记录
-                self.db.session.query(KeywordTable).filter(
-                    KeywordTable.dataset_id == dataset_id,
+                # 3.删除关联的关键词倒排索引记录
+                self.db.session.query(KeywordIndex).filter(
+                    KeywordIndex.dataset_id == dataset_id,
                 ).delete()
 
                 # 4.删除知识库查询记录
@@ -195,186 +462,368 @@ class IndexingService(BaseService):
                 ).delete()
 
             # 5.调用向量数据库删除知识库的关联记录
-            self.vector_database_service.collection.data.delete_many(
-                where=Filter.by_property("dataset_id").equal(str(dataset_id))
-            )
+            self.vector_database_service.delete_by_dataset(dataset_id)
+
+            # 6.删除知识库的检索排除集合及BM25索引
+            self.dataset_exclusion_service.delete_dataset(dataset_id)
+            self.bm25_index_service.delete_dataset(dataset_id)
         except Exception as e:
             logging.exception("异步删除知识库关联内容出错, dataset_id: %(dataset_id)s, 错误信息: %(error)s", {"dataset_id": dataset_id, "error": str(e)})
 
-    def _parsing(self, document: Document) -> list[LCDocument]:
-        """解析传递的文档为LangChain文档列表"""
-        # 1.获取upload_file并加载LangChain文档
-        upload_file = document.upload_file
-        lc_documents = self.file_extractor.load(upload_file, False, True)
-
-        # 2.循环处理LangChain文档，并删除多余的空白字符串
-        for lc_document in lc_documents:
+    def _parsing(self, document: Document, upload_file: Optional[UploadFile] = None) -> Iterator[LCDocument]:
+        """流式解析传递的文档，逐页生成LangChain文档，全部解析完成后更新文档状态，未传递upload_file时解析文档当前的文件"""
+        # 1.获取upload_file并流式加载LangChain文档
+        upload_file = upload_file or document.upload_file
+        character_count = 0
+        metric = IndexingMetric(bytes=upload_file.size)
+        lc_documents = iter(self.file_extractor.lazy_load(upload_file, True))
+        while True:
+            # 2.只统计解析文件本身的耗时，不包含下游分割消费页面的耗时
+            start_at = time.perf_counter()
+            lc_document = next(lc_documents, None)
+            metric.duration += time.perf_counter() - start_at
+            if lc_document is None:
+                break
+
+            # 3.删除每一页多余的空白字符串并统计字符数
             lc_document.page_content = self._clean_extra_text(lc_document.page_content)
+            character_count += len(lc_document.page_content)
+            metric.items += 1
+            yield lc_document
 
-        # 3.更新文档状态并记录时间
+        # 4.记录解析阶段指标，更新文档状态并记录时间
+        self.indexing_metric_service.record(document.account_id, document.dataset_id, IndexingStage.PARSING, metric)
         self.update(
             document,
-            character_count=sum([len(lc_document.page_content) for lc_document in lc_documents]),
+            character_count=character_count,
             status=DocumentStatus.SPLITTING,
             parsing_completed_at=datetime.now(),
         )
 
-        return lc_documents
-
-    def _splitting(self, document: Document, lc_documents: list[LCDocument]) -> list[LCDocument]:
-        """根据传递的信息进行文档分割，拆分成小块片段"""
-        # 1.根据process_rule获取文本分割器
-        process_rule = document.process_rule
-        text_splitter = self.process_rule_service.get_text_splitter_by_process_rule(
-            process_rule,
-            self.embeddings_service.calculate_token_count,
-        )
-
-        # 2.按照process_rule规则清除多余的字符串
-        for lc_document in lc_documents:
-            lc_document.page_content = self.process_rule_service.clean_text_by_process_rule(
-                lc_document.page_content,
-                process_rule,
-            )
-
-        # 3.分割文档列表为片段列表
-        lc_segments = text_splitter.split_documents(lc_documents)
-
-        # 4.获取对应文档下得到最大片段位置
+    def _splitting(self, document: Document, lc_documents: Iterable[LCDocument]) -> None:
+        """根据传递的信息进行文档分割，按窗口消费解析生成的页面，拆分成小块片段并逐窗口存储"""
+        # 1.获取对应文档下得到最大片段位置
         position = self.db.session.query(func.coalesce(func.max(Segment.position), 0)).filter(
             Segment.document_id == document.id,
         ).scalar()
 
-        # 5.循环处理片段数据并添加元数据，同时存储到postgres数据库中
-        segments = []
-        for lc_segment in lc_segments:
-            position += 1
-            content = lc_segment.page_content
-            segment = self.create(
-                Segment,
-                account_id=document.account_id,
-                dataset_id=document.dataset_id,
-                document_id=document.id,
-                node_id=uuid.uuid4(),
-                position=position,
-                content=content,
-                character_count=len(content),
-                token_count=self.embeddings_service.calculate_token_count(content),
-                hash=generate_text_hash(content),
-                status=SegmentStatus.WAITING,
-            )
-            lc_segment.metadata = {
-                "account_id": str(document.account_id),
-                "dataset_id": str(document.dataset_id),
-                "document_id": str(document.id),
-                "segment_id": str(segment.id),
-                "node_id": str(segment.node_id),
-                "document_enabled": False,
-                "segment_enabled": False,
-            }
-            segments.append(segment)
-
-        # 6.更新文档的数据，涵盖状态、token数等内容
+        # 2.逐窗口获取分割后的片段，并在同一个事务内批量写入postgres数据库
+        token_count = 0
+        metric = IndexingMetric()
+        for window_segments in self._split_windows(document, lc_documents, metric):
+            start_at = time.perf_counter()
+            records = self._build_segment_records(document, window_segments, position)
+            self.create_many(Segment, records)
+            self.dataset_exclusion_service.disable_segments(document.dataset_id, [record["id"] for record in records])
+
+            # 3.累计片段位置及token数，片段已持久化，后续阶段从postgres中按状态加载
+            position += len(records)
+            token_count += sum([record["token_count"] for record in records])
+            metric.duration += time.perf_counter() - start_at
+            metric.items += len(records)
+            metric.bytes += sum([len(record["content"].encode("utf-8")) for record in records])
+        metric.tokens = token_count
+
+        # 4.记录分割阶段指标，并更新文档的数据，涵盖状态、token数等内容
+        self.indexing_metric_service.record(document.account_id, document.dataset_id, IndexingStage.SPLITTING, metric)
         self.update(
             document,
-            token_count=sum([segment.token_count for segment in segments]),
+            token_count=token_count,
             status=DocumentStatus.INDEXING,
             splitting_completed_at=datetime.now(),
         )
 
-        return lc_segments
+    def _split_windows(
+            self, document: Document, lc_documents: Iterable[LCDocument], metric: Optional[IndexingMetric] = None,
+    ) -> Iterator[list[LCDocument]]:
+        """按窗口消费解析生成的页面，并逐窗口生成分割后的片段列表，峰值内存约为一个窗口的页面而不是整个文件，传递metric时累计清洗分割的耗时"""
+        # 1.根据process_rule获取文本分割器，分割过程中使用分词器服务计算并缓存token数
+        process_rule = document.process_rule
+        text_splitter = self.process_rule_service.get_text_splitter_by_process_rule(
+            process_rule,
+            self.tokenizer_service.count_token,
+        )
 
-    def _indexing(self, document: Document, lc_segments: list[LCDocument]) -> None:
-        """根据传递的信息构建索引，涵盖关键词提取、词表构建"""
-        for lc_segment in lc_segments:
-            # 1.提取每一个片段对应的关键词，关键词的数量最多不超过10个
-            keywords = self.jieba_service.extract_keywords(lc_segment.page_content, 10)
+        # 2.每次只处理一个窗口的页面
+        lc_documents = iter(lc_documents)
+        while window := list(islice(lc_documents, PARSING_WINDOW_SIZE)):
+            # 3.按照process_rule规则清除多余的字符串
+            start_at = time.perf_counter()
+            for lc_document in window:
+                lc_document.page_content = self.process_rule_service.clean_text_by_process_rule(
+                    lc_document.page_content,
+                    process_rule,
+                )
 
-            # 2.逐条更新文档片段的关键词
-            self.db.session.query(Segment).filter(
-                Segment.id == lc_segment.metadata["segment_id"]
-            ).update({
-                "keywords": keywords,
-                "status": SegmentStatus.INDEXING,
-                "indexing_completed_at": datetime.now(),
+            # 4.分割窗口内的页面为片段列表
+            window_segments = text_splitter.split_documents(window)
+            if metric is not None:
+                metric.duration += time.perf_counter() - start_at
+            yield window_segments
+
+    def _build_segment_records(self, document: Document, lc_segments: list[LCDocument], position: int) -> list[dict]:
+        """根据传递的文档+分割后的片段列表构建待写入的片段记录，位置从position之后开始递增"""
+        token_counts = self.tokenizer_service.count_tokens([lc_segment.page_content for lc_segment in lc_segments])
+        records = []
+        for lc_segment, token_count in zip(lc_segments, token_counts):
+            position += 1
+            content = lc_segment.page_content
+            records.append({
+                "id": uuid.uuid4(),
+                "account_id": document.account_id,
+                "dataset_id": document.dataset_id,
+                "document_id": document.id,
+                "node_id": uuid.uuid4(),
+                "position": position,
+                "content": content,
+                "character_count": len(content),
+                "token_count": token_count,
+                "hash": generate_text_hash(content),
+                "status": SegmentStatus.WAITING,
             })
+        return records
 
-            # 3.获取当前知识库的关键词表
-            keyword_table_record = self.keyword_table_service.get_keyword_table_from_dataset_id(document.dataset_id)
-            keyword_table = {
-                field: set(value) for field, value in keyword_table_record.keyword_table.items()
-            }
-
-            # 4.循环将新关键词添加到关键词表中
-            for keyword in keywords:
-                if keyword not in keyword_table:
-                    keyword_table[keyword] = set()
-                keyword_table[keyword].add(lc_segment.metadata["segment_id"])
+    def _indexing(self, document: Document, lc_segments: list[LCDocument]) -> None:
+        """根据传递的信息构建索引，涵盖关键词提取、词表构建"""
+        start_at = time.perf_counter()
 
-            # 5.更新关键词表
-            self.update(
-                keyword_table_record,
-                keyword_table={field: list(value) for field, value in keyword_table.items()}
-            )
+        # 1.先一次性提取所有片段的关键词，账号下已存在相同内容的片段直接复用其关键词，否则最多提取10个关键词
+        reusable_segments = self.get_reusable_segments(
+            document.account_id,
+            list({generate_text_hash(lc_segment.page_content) for lc_segment in lc_segments}),
+        )
+        segment_keywords, extracting_segments = {}, []
+        for lc_segment in lc_segments:
+            reusable_segment = reusable_segments.get(generate_text_hash(lc_segment.page_content))
+            segment_keywords[lc_segment.metadata["segment_id"]] = reusable_segment[1] if reusable_segment else None
+            if not reusable_segment:
+                extracting_segments.append(lc_segment)
+
+        # 2.未命中的片段交给进程池批量并行提取关键词
+        extracted_keywords = self.jieba_service.extract_keywords_batch(
+            [lc_segment.page_content for lc_segment in extracting_segments],
+            10,
+        )
+        for lc_segment, keywords in zip(extracting_segments, extracted_keywords):
+            segment_keywords[lc_segment.metadata["segment_id"]] = keywords
 
-        # 6.更新文档状态
+        # 3.按批次使用单条语句批量更新片段的关键词及状态
+        segment_ids = list(segment_keywords.keys())
+        for i in range(0, len(segment_ids), INDEXING_SEGMENT_BATCH_SIZE):
+            indexing_completed_at = datetime.now()
+            with self.db.auto_commit():
+                self.db.session.execute(update(Segment), [{
+                    "id": segment_id,
+                    "keywords": segment_keywords[segment_id],
+                    "status": SegmentStatus.INDEXING,
+                    "indexing_completed_at": indexing_completed_at,
+                } for segment_id in segment_ids[i:i + INDEXING_SEGMENT_BATCH_SIZE]])
+
+        # 4.将所有片段的关键词合并成一次增量写入知识库倒排索引
+        self.keyword_table_service.add_keywords(document.dataset_id, segment_keywords)
+
+        # 5.记录关键词阶段指标，并更新文档状态
+        self.indexing_metric_service.record(document.account_id, document.dataset_id, IndexingStage.KEYWORD, IndexingMetric(
+            duration=time.perf_counter() - start_at,
+            items=len(lc_segments),
+            tokens=sum(self.tokenizer_service.count_tokens([lc_segment.page_content for lc_segment in lc_segments])),
+            bytes=sum([len(lc_segment.page_content.encode("utf-8")) for lc_segment in lc_segments]),
+        ))
         self.update(
             document,
             indexing_completed_at=datetime.now(),
         )
 
     def _completed(self, document: Document, lc_segments: list[LCDocument]) -> None:
-        """存储文档片段到向量数据库，并完成状态更新"""
-        # 1.循环遍历片段列表数据，将文档状态及片段状态设置成True
+        """存储文档片段到向量数据库，并完成状态更新，文本嵌入与向量写入以流水线的形式重叠执行"""
+        start_at = time.perf_counter()
+
+        # 1.查找账号下相同内容片段已存储的向量，命中的片段无需再调用文本嵌入模型
+        segment_hashes = {
+            lc_segment.metadata["node_id"]: generate_text_hash(lc_segment.page_content) for lc_segment in lc_segments
+        }
+        reusable_vectors = self.get_reusable_vectors(document.account_id, list(set(segment_hashes.values())))
+        reused_segments, embedding_segments = [], []
         for lc_segment in lc_segments:
-            lc_segment.metadata["document_enabled"] = True
-            lc_segment.metadata["segment_enabled"] = True
+            if segment_hashes[lc_segment.metadata["node_id"]] in reusable_vectors:
+                reused_segments.append(lc_segment)
+            else:
+                embedding_segments.append(lc_segment)
+
+        # 2.嵌入阶段：按token预算组装批次，并发调用文本嵌入模型，嵌入完成的批次放入队列交给写入阶段
+        batches = self._build_embedding_batches(embedding_segments)
+        embedding_concurrency = int(os.getenv("INDEXING_EMBEDDING_CONCURRENCY", 5))
+        vector_queue: Queue = Queue()
+        embedding_durations = []
+        write_metric = IndexingMetric()
+
+        def embed_func(batch: list[LCDocument]) -> None:
+            """线程函数，计算一个批次片段的向量，失败时将异常放入队列，由写入阶段统一标记错误"""
+            embed_start_at = time.perf_counter()
+            try:
+                vector_queue.put((batch, self._embed_with_retry([lc_segment.page_content for lc_segment in batch])))
+            except Exception as e:
+                logging.exception("文档片段文本嵌入发生异常，错误信息： %(error)s", {"error": str(e)})
+                vector_queue.put((batch, None))
+            finally:
+                embedding_durations.append(time.perf_counter() - embed_start_at)
+
+        def write_func(batch: list[LCDocument], vectors: Optional[list[list[float]]]) -> int:
+            """写入一个批次片段的向量，并累计写入阶段的耗时及数据量"""
+            write_start_at = time.perf_counter()
+            failed = self._write_vectors(batch, vectors)
+            write_metric.duration += time.perf_counter() - write_start_at
+            write_metric.items += len(batch) - failed
+            write_metric.bytes += sum([len(vector) * 4 for vector in vectors or []])
+            return failed
+
+        with ThreadPoolExecutor(max_workers=embedding_concurrency) as executor:
+            for batch in batches:
+                executor.submit(embed_func, batch)
+
+            # 3.写入阶段：在当前线程写入复用向量的片段，再流式消费嵌入完成的批次，与嵌入阶段并行执行
+            failed_count = 0
+            max_batch_size = int(os.getenv("INDEXING_BATCH_MAX_SIZE", 100))
+            for i in range(0, len(reused_segments), max_batch_size):
+                batch = reused_segments[i:i + max_batch_size]
+                vectors = [reusable_vectors[segment_hashes[lc_segment.metadata["node_id"]]] for lc_segment in batch]
+                failed_count += write_func(batch, vectors)
+            if reused_segments:
+                self.redis_client.incrby(EMBEDDINGS_REUSED_COUNT, len(reused_segments))
+
+            for _ in range(len(batches)):
+                batch, vectors = vector_queue.get()
+                failed_count += write_func(batch, vectors)
+
+        # 4.记录文本嵌入(各批次调用耗时之和)及向量写入阶段的指标
+        self.indexing_metric_service.record(document.account_id, document.dataset_id, IndexingStage.EMBEDDING, IndexingMetric(
+            duration=sum(embedding_durations),
+            items=len(embedding_segments),
+            tokens=sum(self.tokenizer_service.count_tokens(
+                [lc_segment.page_content for lc_segment in embedding_segments],
+            )),
+            bytes=sum([len(lc_segment.page_content.encode("utf-8")) for lc_segment in embedding_segments]),
+        ))
+        self.indexing_metric_service.record(document.account_id, document.dataset_id, IndexingStage.VECTOR_WRITING, write_metric)
+
+        # 5.记录复用向量节省的文本嵌入次数及构建吞吐量
+        elapsed = time.perf_counter() - start_at
+        logging.info(
+            "文档片段向量构建完成，文档id：%(document_id)s，片段数：%(count)s，复用向量数：%(reused)s，"
+            "失败数：%(failed)s，耗时：%(elapsed).2fs，吞吐量：%(throughput).1f 片段/s",
+            {
+                "document_id": document.id,
+                "count": len(lc_segments),
+                "reused": len(reused_segments),
+                "failed": failed_count,
+                "elapsed": elapsed,
+                "throughput": len(lc_segments) / elapsed if elapsed > 0 else 0,
+            },
+        )
 
-        # 2.调用向量数据库，每次存储10条数据，避免一次传递过多的数据
-        def thread_func(flask_app: Flask, chunks: list[LCDocument], ids: list[UUID]) -> None:
-            """线程函数，执行向量数据库与postgres数据的存储"""
-            with flask_app.app_context():
-                try:
-                    self.vector_database_service.vector_store.add_documents(
-                        chunks, ids=ids,
-                    )
-                    with self.db.auto_commit():
-                        self.db.session.query(Segment).filter(
-                            Segment.node_id.in_(ids)
-                        ).update({
-                            "status": SegmentStatus.COMPLETED,
-                            "completed_at": datetime.now(),
-                            "enabled": True,
-                        })
-                except Exception as e:
-                    logging.exception("构建文档片段索引发生异常，错误信息： %(error)s", {"error": str(e)})
-                    with self.db.auto_commit():
-                        self.db.session.query(Segment).filter(
-                            Segment.node_id.in_(ids)
-                        ).update({
-                            "status": SegmentStatus.ERROR,
-                            "completed_at": None,
-                            "stopped_at": datetime.now(),
-                            "enabled": False,
-                        })
-
-        with ThreadPoolExecutor(max_workers=5) as executor:
-            futures = []
-            for i in range(0, len(lc_segments), 10):
-                chunks = lc_segments[i:i + 10]
-                ids = [chunk.metadata["node_id"] for chunk in chunks]
-                futures.append(executor.submit(thread_func, current_app._get_current_object(), chunks, ids))
-
-            for future in futures:
-                future.result()
-
-        # 6.更新文档的状态数据
+        # 6.更新文档的状态数据，首次构建完成时启用文档，替换文件或者重新构建时保留文档原有的启用状态
+        enabled = document.enabled if document.completed_at is not None else True
         self.update(
             document,
             status=DocumentStatus.COMPLETED,
             completed_at=datetime.now(),
-            enabled=True,
+            enabled=enabled,
+        )
+
+        # 7.启用的文档从检索排除集合中移除，已禁用的文档保持排除
+        if enabled:
+            self.dataset_exclusion_service.enable_documents(document.dataset_id, [document.id])
+
+    def _build_embedding_batches(self, lc_segments: list[LCDocument]) -> list[list[LCDocument]]:
+        """按token预算及条数上限将片段组装成批次，小片段合并减少请求次数，大片段单独成批避免超过接口限制"""
+        max_tokens = int(os.getenv("INDEXING_BATCH_MAX_TOKENS", 8000))
+        max_batch_size = int(os.getenv("INDEXING_BATCH_MAX_SIZE", 100))
+        token_counts = self.tokenizer_service.count_tokens([lc_segment.page_content for lc_segment in lc_segments])
+
+        batches, batch, batch_tokens = [], [], 0
+        for lc_segment, token_count in zip(lc_segments, token_counts):
+            if batch and (batch_tokens + token_count > max_tokens or len(batch) >= max_batch_size):
+                batches.append(batch)
+                batch, batch_tokens = [], 0
+            batch.append(lc_segment)
+            batch_tokens += token_count
+        if batch:
+            batches.append(batch)
+
+        return batches
+
+    def _embed_with_retry(self, texts: list[str]) -> list[list[float]]:
+        """调用文本嵌入模型计算向量，失败时按指数退避重试"""
+        max_retries = int(os.getenv("INDEXING_MAX_RETRIES", 3))
+        backoff = float(os.getenv("INDEXING_RETRY_BACKOFF", 1))
+        for attempt in range(max_retries + 1):
+            try:
+                return self.embeddings_service.cache_backed_embeddings.embed_documents(texts)
+            except Exception:
+                if attempt >= max_retries:
+                    raise
+                time.sleep(backoff * 2 ** attempt)
+
+    def _write_vectors(self, lc_segments: list[LCDocument], vectors: Optional[list[list[float]]]) -> int:
+        """将片段及向量写入向量数据库，只对写入失败的片段按指数退避重试，并同步更新postgres片段状态，返回失败数"""
+        # 1.向量为空表示嵌入阶段已失败，所有片段直接标记为错误
+        pending = list(range(len(lc_segments))) if vectors is not None else []
+        failed = set() if vectors is not None else set(range(len(lc_segments)))
+
+        # 2.循环写入待写入的片段，每次只保留写入失败的下标进行重试
+        max_retries = int(os.getenv("INDEXING_MAX_RETRIES", 3))
+        backoff = float(os.getenv("INDEXING_RETRY_BACKOFF", 1))
+        for attempt in range(max_retries + 1):
+            if not pending:
+                break
+            if attempt > 0:
+                time.sleep(backoff * 2 ** (attempt - 1))
+            try:
+                errors = self.vector_database_service.insert_documents_with_vectors(
+                    [lc_segments[i] for i in pending],
+                    [vectors[i] for i in pending],
+                    [lc_segments[i].metadata["node_id"] for i in pending],
+                )
+                pending = [pending[index] for index in errors.keys()]
+                if errors:
+                    logging.warning("向量数据库部分片段写入失败，错误信息：%(error)s", {"error": next(iter(errors.values()))})
+            except Exception as e:
+                logging.exception("向量数据库写入片段发生异常，错误信息： %(error)s", {"error": str(e)})
+        failed.update(pending)
+
+        # 3.更新写入成功与失败的片段状态
+        completed = [i for i in range(len(lc_segments)) if i not in failed]
+        failed_node_ids = [lc_segments[i].metadata["node_id"] for i in failed]
+        completed_node_ids = [lc_segments[i].metadata["node_id"] for i in completed]
+        with self.db.auto_commit():
+            if completed_node_ids:
+                self.db.session.query(Segment).filter(
+                    Segment.node_id.in_(completed_node_ids)
+                ).update({
+                    "status": SegmentStatus.COMPLETED,
+                    "completed_at": datetime.now(),
+                    "enabled": True,
+                })
+            if failed_node_ids:
+                self.db.session.query(Segment).filter(
+                    Segment.node_id.in_(failed_node_ids)
+                ).update({
+                    "status": SegmentStatus.ERROR,
+                    "completed_at": None,
+                    "stopped_at": datetime.now(),
+                    "enabled": False,
+                })
+
+        # 4.写入成功的片段从检索排除集合中移除，写入失败的片段保持排除
+        dataset_id = lc_segments[0].metadata["dataset_id"]
+        self.dataset_exclusion_service.enable_segments(
+            dataset_id, [lc_segments[i].metadata["segment_id"] for i in completed],
         )
+        self.dataset_exclusion_service.disable_segments(
+            dataset_id, [lc_segments[i].metadata["segment_id"] for i in failed],
+        )
+
+        return len(failed_node_ids)
 
     @classmethod
     def _clean_extra_text(cls, text: str) -> str:
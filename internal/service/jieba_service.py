@@ -5,19 +5,74 @@
 @Author  : thezehui@gmail.com
 @File    : jieba_service.py
 """
+import atexit
+import logging
+import os
+import re
 from dataclasses import dataclass
+from threading import Lock
+from typing import Callable, Optional
 
+import jieba
 import jieba.analyse
+from billiard.exceptions import WorkerLostError
+from billiard.pool import Pool
 from injector import inject
 from jieba.analyse import default_tfidf
 
 from internal.entity.jieba_entity import STOPWORD_SET
 
+# 批量提取时每个子进程单次处理的文本数
+KEYWORD_EXTRACTION_CHUNK_SIZE = 32
+
+# 全文检索词条的最大长度，超长的词条(例如长串数字、链接)对检索几乎没有帮助
+TOKEN_MAX_LENGTH = 32
+
+# 全文检索词条至少需要包含一个文字、字母或数字，用于剔除标点及空白
+TOKEN_PATTERN = re.compile(r"\w")
+
+# 每个进程中分词进程池的默认子进程数，Celery prefork的每个子进程都会各自创建进程池，所以默认值较小
+JIEBA_PROCESS_POOL_DEFAULT_WORKERS = 2
+
+# 进程池全局唯一，同一进程内的所有JiebaService实例共享，并记录创建进程池的进程id，避免fork后的子进程复用父进程的进程池
+_process_pool: Optional[Pool] = None
+_process_pool_pid: Optional[int] = None
+_process_pool_lock = Lock()
+
+# 当前进程是否为分词进程池的子进程，子进程中不再嵌套创建进程池
+_is_pool_worker = False
+
+
+def _init_worker() -> None:
+    """进程池子进程初始化函数，每个子进程只加载一次jieba词典及停用词"""
+    global _is_pool_worker
+    _is_pool_worker = True
+    default_tfidf.stop_words = STOPWORD_SET
+    jieba.initialize()
+
+
+def _extract_keywords_chunk(texts: list[str], max_keyword_pre_chunk: int) -> list[list[str]]:
+    """子进程执行函数，提取一组文本的关键词列表"""
+    return [jieba.analyse.extract_tags(sentence=text, topK=max_keyword_pre_chunk) for text in texts]
+
+
+def _tokenize_chunk(texts: list[str]) -> list[list[str]]:
+    """子进程执行函数，将一组文本切分成全文检索词条列表"""
+    return [JiebaService.tokenize(text) for text in texts]
+
+
+def _shutdown_process_pool() -> None:
+    """进程退出时关闭进程池"""
+    global _process_pool
+    if _process_pool is not None and _process_pool_pid == os.getpid():
+        _process_pool.terminate()
+    _process_pool = None
+
 
 @inject
 @dataclass
 class JiebaService:
-    """结巴分词服务"""
+    """结巴分词服务，单条文本在当前进程同步提取，批量文本分发到进程池并行提取，进程池使用billiard，在Celery prefork的子进程中同样可用"""
 
     def __init__(self):
         """构造函数，扩展jieba的停用词"""
@@ -30,3 +85,64 @@ class JiebaService:
             sentence=text,
             topK=max_keyword_pre_chunk,
         )
+
+    @classmethod
+    def tokenize(cls, text: str) -> list[str]:
+        """将文本切分成全文检索词条列表，使用搜索引擎模式分词并统一转小写，剔除停用词、标点及超长词条"""
+        return [
+            token for token in (token.strip().lower() for token in jieba.cut_for_search(text))
+            if token and len(token) <= TOKEN_MAX_LENGTH and token not in STOPWORD_SET and TOKEN_PATTERN.search(token)
+        ]
+
+    @classmethod
+    def extract_keywords_batch(cls, texts: list[str], max_keyword_pre_chunk: int = 10) -> list[list[str]]:
+        """根据输入的文本列表批量提取关键词，返回结果与输入文本顺序一致"""
+        return cls._map_chunks(
+            _extract_keywords_chunk,
+            lambda text: cls.extract_keywords(text, max_keyword_pre_chunk),
+            texts,
+            max_keyword_pre_chunk,
+        )
+
+    @classmethod
+    def tokenize_batch(cls, texts: list[str]) -> list[list[str]]:
+        """根据输入的文本列表批量切分全文检索词条，返回结果与输入文本顺序一致"""
+        return cls._map_chunks(_tokenize_chunk, cls.tokenize, texts)
+
+    @classmethod
+    def _map_chunks(cls, chunk_func: Callable, func: Callable, texts: list[str], *args) -> list[list[str]]:
+        """将文本按块分发到进程池并行处理，文本数较少或无法使用进程池时在当前进程串行处理"""
+        # 1.文本数较少或者无法使用进程池时，直接在当前进程串行处理
+        process_pool = cls._get_process_pool()
+        if process_pool is None or len(texts) <= KEYWORD_EXTRACTION_CHUNK_SIZE:
+            return [func(text) for text in texts]
+
+        # 2.将文本按块分发到进程池，减少进程间通信的次数
+        chunks = [
+            texts[i:i + KEYWORD_EXTRACTION_CHUNK_SIZE] for i in range(0, len(texts), KEYWORD_EXTRACTION_CHUNK_SIZE)
+        ]
+        try:
+            results = process_pool.starmap(chunk_func, [(chunk, *args) for chunk in chunks], chunksize=1)
+        except WorkerLostError:
+            # 3.子进程异常退出时丢弃进程池，并回退到当前进程串行处理
+            logging.exception("分词进程池异常，回退到串行处理")
+            _shutdown_process_pool()
+            return [func(text) for text in texts]
+
+        # 4.按原始顺序合并各个块的处理结果
+        return [result for chunk_results in results for result in chunk_results]
+
+    @classmethod
+    def _get_process_pool(cls) -> Optional[Pool]:
+        """获取进程池，首次调用时创建，子进程数可通过JIEBA_PROCESS_POOL_WORKERS配置，小于等于1时不使用进程池"""
+        global _process_pool, _process_pool_pid
+        max_workers = int(os.getenv("JIEBA_PROCESS_POOL_WORKERS", JIEBA_PROCESS_POOL_DEFAULT_WORKERS))
+        if max_workers <= 1 or _is_pool_worker:
+            return None
+
+        with _process_pool_lock:
+            if _process_pool is None or _process_pool_pid != os.getpid():
+                _process_pool = Pool(processes=max_workers, initializer=_init_worker)
+                _process_pool_pid = os.getpid()
+                atexit.register(_shutdown_process_pool)
+            return _process_pool
@@ -6,90 +6,90 @@
 @File    : keyword_table_service.py
 """
 from dataclasses import dataclass
+from typing import Union
 from uuid import UUID
 
 from injector import inject
 from redis import Redis
+from sqlalchemy.dialects.postgresql import insert
 
-from internal.entity.cache_entity import (
-    LOCK_KEYWORD_TABLE_UPDATE_KEYWORD_TABLE,
-    LOCK_EXPIRE_TIME,
-)
-from internal.model import Segment, KeywordTable
+from internal.model import Segment, KeywordIndex
 from pkg.sqlalchemy import SQLAlchemy
 from .base_service import BaseService
+from .bm25_index_service import BM25IndexService
+
+# 单次批量写入倒排索引的最大记录数
+KEYWORD_INDEX_INSERT_BATCH_SIZE = 1000
 
 
 @inject
 @dataclass
 class KeywordTableService(BaseService):
-    """知识库关键词表服务"""
+    """知识库关键词表服务，底层使用 关键词->片段 的倒排索引表存储，增删只涉及受影响的倒排项，并同步记录BM25索引的待合并片段"""
     db: SQLAlchemy
     redis_client: Redis
+    bm25_index_service: BM25IndexService
+
+    def get_keywords_from_segment_ids(self, segment_ids: list[UUID]) -> dict[str, list[str]]:
+        """根据传递的片段id列表查询倒排索引，获取 片段id->关键词列表 的反向映射"""
+        segment_keywords: dict[str, list[str]] = {}
+        if not segment_ids:
+            return segment_keywords
+
+        rows = self.db.session.query(KeywordIndex).with_entities(
+            KeywordIndex.segment_id, KeywordIndex.keyword,
+        ).filter(
+            KeywordIndex.segment_id.in_(segment_ids),
+        ).all()
+        for segment_id, keyword in rows:
+            segment_keywords.setdefault(str(segment_id), []).append(keyword)
+
+        return segment_keywords
 
-    def get_keyword_table_from_dataset_id(self, dataset_id: UUID) -> KeywordTable:
-        """根据传递的知识库id获取关键词表"""
-        keyword_table = self.db.session.query(KeywordTable).filter(
-            KeywordTable.dataset_id == dataset_id,
-        ).one_or_none()
-        if keyword_table is None:
-            keyword_table = self.create(KeywordTable, dataset_id=dataset_id, keyword_table={})
+    def add_keywords(self, dataset_id: UUID, segment_keywords: dict[Union[UUID, str], list[str]]) -> None:
+        """根据传递的知识库id+片段关键词映射新增倒排项，已存在的倒排项会被忽略"""
+        self.bm25_index_service.upsert_segments(dataset_id, list(segment_keywords.keys()))
 
-        return keyword_table
+        # 1.将片段关键词映射展开成倒排记录，并剔除空关键词与重复数据
+        records = []
+        for segment_id, keywords in segment_keywords.items():
+            for keyword in dict.fromkeys(keywords or []):
+                if keyword:
+                    records.append({"dataset_id": dataset_id, "keyword": keyword, "segment_id": segment_id})
+        if not records:
+            return
+
+        # 2.分批写入倒排索引表，冲突(已存在)的记录直接跳过，无需上锁
+        with self.db.auto_commit():
+            for i in range(0, len(records), KEYWORD_INDEX_INSERT_BATCH_SIZE):
+                stmt = insert(KeywordIndex).values(
+                    records[i:i + KEYWORD_INDEX_INSERT_BATCH_SIZE],
+                ).on_conflict_do_nothing(
+                    index_elements=["dataset_id", "keyword", "segment_id"],
+                )
+                self.db.session.execute(stmt)
 
     def delete_keyword_table_from_ids(self, dataset_id: UUID, segment_ids: list[UUID]) -> None:
-        """根据传递的知识库id+片段id列表删除对应关键词表中多余的数据"""
-        # 1.删除知识库关键词表里多余的数据，该操作需要上锁，避免在并发的情况下拿到错误的数据
-        cache_key = LOCK_KEYWORD_TABLE_UPDATE_KEYWORD_TABLE.format(dataset_id=dataset_id)
-        with self.redis_client.lock(cache_key, timeout=LOCK_EXPIRE_TIME):
-            # 2.获取当前知识库的关键词表
-            keyword_table_record = self.get_keyword_table_from_dataset_id(dataset_id)
-            keyword_table = keyword_table_record.keyword_table.copy()
-
-            # 3.将片段id列表转换成集合，并创建关键词集合用于清除空关键词
-            segment_ids_to_delete = set([str(segment_id) for segment_id in segment_ids])
-            keywords_to_delete = set()
-
-            # 4.循环遍历所有关键词执行判断与更新
-            for keyword, ids in keyword_table.items():
-                ids_set = set(ids)
-                if segment_ids_to_delete.intersection(ids_set):
-                    keyword_table[keyword] = list(ids_set.difference(segment_ids_to_delete))
-                    if not keyword_table[keyword]:
-                        keywords_to_delete.add(keyword)
-
-            # 5.检测空关键词数据并删除（关键词并没有映射任何字段id的数据）
-            for keyword in keywords_to_delete:
-                del keyword_table[keyword]
-
-            # 6.将数据更新到关键词表中
-            self.update(keyword_table_record, keyword_table=keyword_table)
+        """根据传递的知识库id+片段id列表删除对应的倒排项"""
+        if not segment_ids:
+            return
+
+        self.bm25_index_service.remove_segments(dataset_id, segment_ids)
+        with self.db.auto_commit():
+            self.db.session.query(KeywordIndex).filter(
+                KeywordIndex.dataset_id == dataset_id,
+                KeywordIndex.segment_id.in_(segment_ids),
+            ).delete(synchronize_session=False)
 
     def add_keyword_table_from_ids(self, dataset_id: UUID, segment_ids: list[UUID]) -> None:
         """根据传递的知识库id+片段id列表，在关键词表中添加关键词"""
-        # 1.新增知识库关键词表里多余的数据，该操作需要上锁，避免在并发的情况下拿到错误的数据
-        cache_key = LOCK_KEYWORD_TABLE_UPDATE_KEYWORD_TABLE.format(dataset_id=dataset_id)
-        with self.redis_client.lock(cache_key, timeout=LOCK_EXPIRE_TIME):
-            # 2.获取指定知识库的关键词比哦啊
-            keyword_table_record = self.get_keyword_table_from_dataset_id(dataset_id)
-            keyword_table = {
-                field: set(value) for field, value in keyword_table_record.keyword_table.items()
-            }
-
-            # 3.根据segment_ids查找片段的关键词信息
-            segments = self.db.session.query(Segment).with_entities(Segment.id, Segment.keywords).filter(
-                Segment.id.in_(segment_ids),
-            ).all()
-
-            # 4.循环将新关键词添加到关键词表中
-            for id, keywords in segments:
-                for keyword in keywords:
-                    if keyword not in keyword_table:
-                        keyword_table[keyword] = set()
-                    keyword_table[keyword].add(str(id))
-
-            # 5.更新关键词表
-            self.update(
-                keyword_table_record,
-                keyword_table={field: list(value) for field, value in keyword_table.items()}
-            )
+        if not segment_ids:
+            return
+
+        # 1.根据segment_ids查找片段的关键词信息
+        segments = self.db.session.query(Segment).with_entities(Segment.id, Segment.keywords).filter(
+            Segment.id.in_(segment_ids),
+        ).all()
+
+        # 2.将片段关键词写入倒排索引
+        self.add_keywords(dataset_id, {id: keywords for id, keywords in segments})
@@ -0,0 +1,195 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+@Time    : 2024/12/23 10:12
+@Author  : thezehui@gmail.com
+@File    : retrieval_accounting_service.py
+"""
+import json
+import os
+import uuid
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Optional, Union
+from uuid import UUID
+
+from injector import inject
+from redis import Redis
+from sqlalchemy import Integer, UUID as SQLAlchemyUUID, column, delete, insert, update, values
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+
+from internal.entity.cache_entity import (
+    LOCK_EXPIRE_TIME,
+    RETRIEVAL_HIT_COUNT_BUFFER,
+    DATASET_QUERY_BUFFER,
+    RETRIEVAL_HIT_COUNT_FLUSHING,
+    DATASET_QUERY_FLUSHING,
+    LOCK_RETRIEVAL_ACCOUNTING_FLUSH,
+    RETRIEVAL_ACCOUNTING_FLUSH_ID,
+)
+from internal.lib.helper import generate_text_hash
+from internal.model import Dataset, DatasetQuery, RetrievalAccountingFlush, Segment
+from pkg.sqlalchemy import SQLAlchemy
+from .base_service import BaseService
+
+
+@inject
+@dataclass
+class RetrievalAccountingService(BaseService):
+    """检索统计服务，检索时只将命中次数及查询记录写入redis缓冲，由定时任务批量刷写到数据库，检索链路不产生数据库写入"""
+    db: SQLAlchemy
+    redis_client: Redis
+
+    def record(
+            self,
+            dataset_ids: list[Union[UUID, str]],
+            segment_ids: list[Union[UUID, str]],
+            query: str,
+            source: str,
+            source_app_id: Optional[Union[UUID, str]],
+            created_by: Optional[Union[UUID, str]],
+    ) -> None:
+        """记录一次检索的命中片段及查询记录，使用一次pipeline写入写缓冲"""
+        created_at = datetime.now().isoformat()
+        pipeline = self.redis_client.pipeline(transaction=False)
+        for segment_id in segment_ids:
+            pipeline.hincrby(RETRIEVAL_HIT_COUNT_BUFFER, str(segment_id), 1)
+        for dataset_id in dict.fromkeys(str(dataset_id) for dataset_id in dataset_ids):
+            pipeline.rpush(DATASET_QUERY_BUFFER, json.dumps({
+                "dataset_id": dataset_id,
+                "query": query,
+                "source": str(source),
+                "source_app_id": str(source_app_id) if source_app_id else None,
+                "created_by": str(created_by) if created_by else None,
+                "created_at": created_at,
+            }, ensure_ascii=False))
+        pipeline.execute()
+
+    def flush(self) -> tuple[int, int]:
+        """将写缓冲中的命中次数及查询记录批量刷写到数据库，返回刷写的片段数及查询记录数，其他进程正在刷写时直接跳过"""
+        lock = self.redis_client.lock(LOCK_RETRIEVAL_ACCOUNTING_FLUSH, LOCK_EXPIRE_TIME)
+        if not lock.acquire(blocking=False):
+            return 0, 0
+
+        try:
+            batch_size = int(os.getenv("RETRIEVAL_ACCOUNTING_FLUSH_BATCH_SIZE", 1000))
+            return self._flush_hit_counts(batch_size), self._flush_dataset_queries(batch_size)
+        finally:
+            lock.release()
+
+    def _flush_hit_counts(self, batch_size: int) -> int:
+        """按片段id排序后分批执行 UPDATE ... FROM (VALUES ...)，每批提交后再从处理中键删除对应字段"""
+        # 1.获取待刷写的命中次数，上次刷写异常退出时优先处理遗留数据
+        flush_id = self._take(RETRIEVAL_HIT_COUNT_BUFFER, RETRIEVAL_HIT_COUNT_FLUSHING)
+        if flush_id is None:
+            return 0
+        hit_counts = {
+            segment_id.decode(): int(delta)
+            for segment_id, delta in self.redis_client.hgetall(RETRIEVAL_HIT_COUNT_FLUSHING).items()
+        }
+
+        # 2.固定的更新顺序可以避免并发事务间因行锁顺序不一致导致死锁，已删除的片段不会匹配到任何记录
+        segment_ids = sorted(hit_counts.keys())
+        for i in range(0, len(segment_ids), batch_size):
+            batch = segment_ids[i:i + batch_size]
+            batch_id = self._batch_id(flush_id, [f"{segment_id}:{hit_counts[segment_id]}" for segment_id in batch])
+            deltas = values(
+                column("segment_id", SQLAlchemyUUID),
+                column("delta", Integer),
+                name="deltas",
+            ).data([(UUID(segment_id), hit_counts[segment_id]) for segment_id in batch])
+            with self.db.auto_commit():
+                if self._mark_flushed(batch_id):
+                    self.db.session.execute(
+                        update(Segment)
+                        .where(Segment.id == deltas.c.segment_id)
+                        .values(hit_count=Segment.hit_count + deltas.c.delta)
+                    )
+            self.redis_client.hdel(RETRIEVAL_HIT_COUNT_FLUSHING, *batch)
+
+        # 3.处理中键已全部刷写，清除本批次号的刷写记录
+        self._finish(RETRIEVAL_HIT_COUNT_FLUSHING, flush_id)
+
+        return len(segment_ids)
+
+    def _flush_dataset_queries(self, batch_size: int) -> int:
+        """分批批量插入知识库查询记录，每批提交后再从处理中键的头部裁剪掉对应元素"""
+        # 1.获取待刷写的查询记录，上次刷写异常退出时优先处理遗留数据
+        flush_id = self._take(DATASET_QUERY_BUFFER, DATASET_QUERY_FLUSHING)
+        if flush_id is None:
+            return 0
+
+        total = 0
+        while True:
+            # 2.从头部读取一批查询记录，为空则表示刷写完毕
+            items = self.redis_client.lrange(DATASET_QUERY_FLUSHING, 0, batch_size - 1)
+            if not items:
+                break
+            batch_id = self._batch_id(flush_id, [item.decode() for item in items])
+            rows = [json.loads(item) for item in items]
+
+            # 3.过滤掉已被删除知识库的查询记录后批量插入
+            dataset_ids = {row["dataset_id"] for row in rows}
+            existing_dataset_ids = {str(id) for id, in self.db.session.query(Dataset).with_entities(Dataset.id).filter(
+                Dataset.id.in_(dataset_ids),
+            ).all()}
+            rows = [
+                {**row, "created_at": created_at, "updated_at": created_at}
+                for row in rows if row["dataset_id"] in existing_dataset_ids
+                for created_at in [datetime.fromisoformat(row["created_at"])]
+            ]
+            if rows:
+                with self.db.auto_commit():
+                    if self._mark_flushed(batch_id):
+                        self.db.session.execute(insert(DatasetQuery), rows)
+
+            self.redis_client.ltrim(DATASET_QUERY_FLUSHING, len(items), -1)
+            total += len(rows)
+
+        # 4.处理中键已全部刷写，清除本批次号的刷写记录
+        self._finish(DATASET_QUERY_FLUSHING, flush_id)
+
+        return total
+
+    def _take(self, buffer_key: str, flushing_key: str) -> Optional[str]:
+        """将写缓冲重命名为处理中键并生成新的刷写批次号，处理中键已存在时表示上次刷写未完成，沿用原批次号继续处理"""
+        # 1.上次刷写未完成，沿用原批次号，批次号丢失时(如重命名后进程立即退出)补充生成
+        flush_id_key = RETRIEVAL_ACCOUNTING_FLUSH_ID.format(flushing_key=flushing_key)
+        if self.redis_client.exists(flushing_key):
+            self.redis_client.set(flush_id_key, str(uuid.uuid4()), nx=True)
+            return self.redis_client.get(flush_id_key).decode()
+
+        # 2.写缓冲为空则无需刷写
+        if not self.redis_client.exists(buffer_key):
+            return None
+
+        # 3.重命名写缓冲并覆盖批次号，两者在同一个事务中执行
+        flush_id = str(uuid.uuid4())
+        pipeline = self.redis_client.pipeline()
+        pipeline.rename(buffer_key, flushing_key)
+        pipeline.set(flush_id_key, flush_id)
+        pipeline.execute()
+        return flush_id
+
+    def _mark_flushed(self, batch_id: str) -> bool:
+        """在当前事务中写入批次的刷写记录，记录已存在则表示该批次已在异常退出前提交，返回False跳过本批次"""
+        return self.db.session.execute(
+            pg_insert(RetrievalAccountingFlush)
+            .values(id=batch_id)
+            .on_conflict_do_nothing(index_elements=["id"])
+            .returning(RetrievalAccountingFlush.id)
+        ).first() is not None
+
+    def _finish(self, flushing_key: str, flush_id: str) -> None:
+        """处理中键刷写完毕后删除本批次号对应的刷写记录及批次号"""
+        with self.db.auto_commit():
+            self.db.session.execute(
+                delete(RetrievalAccountingFlush).where(RetrievalAccountingFlush.id.startswith(f"{flush_id}:"))
+            )
+        self.redis_client.delete(RETRIEVAL_ACCOUNTING_FLUSH_ID.format(flushing_key=flushing_key))
+
+    @classmethod
+    def _batch_id(cls, flush_id: str, items: list[str]) -> str:
+        """根据刷写批次号及批次内容计算批次id，异常退出后重新读取的同一批数据会得到相同的批次id"""
+        content_hash = generate_text_hash("\n".join(items))
+        return f"{flush_id}:{content_hash}"
@@ -0,0 +1,128 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+@Time    : 2024/12/22 16:35
+@Author  : thezehui@gmail.com
+@File    : retrieval_cache_service.py
+"""
+import json
+import logging
+import os
+import re
+import time
+from collections import Counter
+from dataclasses import dataclass
+from threading import Lock
+from typing import Optional, Union
+from uuid import UUID
+
+from injector import inject
+from langchain_core.documents import Document as LCDocument
+from redis import Redis
+
+from internal.entity.cache_entity import (
+    DATASET_RETRIEVAL_VERSION,
+    RETRIEVAL_RESULT_CACHE,
+    RETRIEVAL_CACHE_STATS,
+)
+from internal.lib.helper import generate_text_hash
+
+# 命中统计同步到redis的最小间隔，单位为秒
+STATS_FLUSH_INTERVAL = 10
+
+# 进程内累计的命中统计，同一进程内的所有RetrievalCacheService实例共享，按间隔批量同步到redis
+_stats: Counter = Counter()
+_stats_flushed_at = time.monotonic()
+_stats_lock = Lock()
+
+
+@inject
+@dataclass
+class RetrievalCacheService:
+    """检索结果缓存服务，缓存键包含各知识库的检索版本号，知识库发生变化时只需递增版本号，无需逐条删除缓存"""
+    redis_client: Redis
+
+    def bump_versions(self, dataset_ids: list[Union[UUID, str]]) -> None:
+        """递增传递知识库的检索版本号，使这些知识库相关的检索结果缓存全部失效"""
+        if not dataset_ids:
+            return
+        pipeline = self.redis_client.pipeline()
+        for dataset_id in dict.fromkeys(str(dataset_id) for dataset_id in dataset_ids):
+            pipeline.incr(DATASET_RETRIEVAL_VERSION.format(dataset_id=dataset_id))
+        pipeline.execute()
+
+    def get_cache_key(
+            self,
+            dataset_ids: list[Union[UUID, str]],
+            query: str,
+            retrieval_strategy: str,
+            k: int,
+            score: float,
+    ) -> str:
+        """根据检索参数及各知识库当前的版本号生成缓存键"""
+        # 1.知识库id排序后批量读取版本号
+        dataset_ids = sorted(str(dataset_id) for dataset_id in dataset_ids)
+        version_keys = [DATASET_RETRIEVAL_VERSION.format(dataset_id=dataset_id) for dataset_id in dataset_ids]
+        versions = self.redis_client.mget(version_keys)
+
+        # 2.版本号不存在(从未变化或已被淘汰)时使用纳秒时间戳初始化，避免与淘汰前的版本号重复而命中旧缓存
+        missing = [version_key for version_key, version in zip(version_keys, versions) if version is None]
+        if missing:
+            pipeline = self.redis_client.pipeline()
+            for version_key in missing:
+                pipeline.set(version_key, time.time_ns(), nx=True)
+            pipeline.execute()
+            versions = self.redis_client.mget(version_keys)
+
+        # 3.规范化查询语句(去除首尾空白、合并连续空白、转小写)后与检索参数一起计算哈希值
+        normalized_query = re.sub(r"\s+", " ", query).strip().lower()
+        cache_hash = generate_text_hash(json.dumps([
+            dataset_ids,
+            [int(version) for version in versions],
+            normalized_query,
+            str(retrieval_strategy),
+            k,
+            score,
+        ], ensure_ascii=False))
+
+        return RETRIEVAL_RESULT_CACHE.format(cache_hash=cache_hash)
+
+    def get_documents(self, cache_key: str) -> Optional[list[LCDocument]]:
+        """读取缓存的检索结果，未命中时返回None"""
+        value = self.redis_client.get(cache_key)
+        self._record_stats("hit" if value is not None else "miss")
+        if value is None:
+            return None
+
+        return [
+            LCDocument(page_content=item["page_content"], metadata=item["metadata"])
+            for item in json.loads(value)
+        ]
+
+    def set_documents(self, cache_key: str, lc_documents: list[LCDocument]) -> None:
+        """缓存检索结果，过期时间可通过RETRIEVAL_CACHE_TTL配置"""
+        self.redis_client.setex(
+            cache_key,
+            int(os.getenv("RETRIEVAL_CACHE_TTL", 300)),
+            json.dumps(
+                [{"page_content": lc_document.page_content, "metadata": lc_document.metadata} for lc_document in lc_documents],
+                ensure_ascii=False,
+            ),
+        )
+
+    def _record_stats(self, field: str) -> None:
+        """在进程内累计命中统计，并按间隔将累计值同步到redis哈希表，避免每次读取缓存都额外访问redis"""
+        global _stats, _stats_flushed_at
+        with _stats_lock:
+            _stats[field] += 1
+            if time.monotonic() - _stats_flushed_at < STATS_FLUSH_INTERVAL:
+                return
+            stats, _stats, _stats_flushed_at = _stats, Counter(), time.monotonic()
+
+        try:
+            pipeline = self.redis_client.pipeline()
+            for stats_field, count in stats.items():
+                pipeline.hincrby(RETRIEVAL_CACHE_STATS, stats_field, count)
+            pipeline.execute()
+        except Exception as e:
+            logging.warning("同步检索结果缓存命中统计失败，错误信息：%(error)s", {"error": e})
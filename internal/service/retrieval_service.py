@@ -5,27 +5,43 @@
 @Author  : thezehui@gmail.com
 @File    : retrieval_service.py
 """
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass
+from typing import Optional
 from uuid import UUID
 
-from flask import Flask
+from flask import Flask, current_app
 from injector import inject
-from langchain.retrievers import EnsembleRetriever
 from langchain_core.documents import Document as LCDocument
+from langchain_core.prompts import ChatPromptTemplate
+from langchain_openai import ChatOpenAI
 from pydantic import BaseModel, Field
 from langchain_core.tools import BaseTool, tool
-from sqlalchemy import update
 
 from internal.core.agent.entities.agent_entity import DATASET_RETRIEVAL_TOOL_NAME
-from internal.entity.dataset_entity import RetrievalStrategy, RetrievalSource
+from internal.core.reranker import get_local_reranker
+from internal.entity.dataset_entity import RetrievalStrategy, RetrievalSource, MULTI_QUERY_TEMPLATE, MultiQueries
 from internal.exception import NotFoundException
-from internal.lib.helper import combine_documents
-from internal.model import Dataset, DatasetQuery, Segment
+from internal.lib.helper import combine_documents, reciprocal_rank_fusion
+from internal.model import Dataset
 from pkg.sqlalchemy import SQLAlchemy
 from .base_service import BaseService
+from .bm25_index_service import BM25IndexService
+from .dataset_exclusion_service import DatasetExclusionService
 from .jieba_service import JiebaService
+from .retrieval_accounting_service import RetrievalAccountingService
+from .retrieval_cache_service import RetrievalCacheService
 from .vector_database_service import VectorDatabaseService
 
+# 单次检索最多合并的其他表述数
+MULTI_QUERY_MAX_COUNT = 3
+
+# 多查询倒数排名融合的平滑常数
+MULTI_QUERY_RRF_C = 60
+
 
 @inject
 @dataclass
@@ -34,6 +50,10 @@ class RetrievalService(BaseService):
     db: SQLAlchemy
     jieba_service: JiebaService
     vector_database_service: VectorDatabaseService
+    dataset_exclusion_service: DatasetExclusionService
+    bm25_index_service: BM25IndexService
+    retrieval_cache_service: RetrievalCacheService
+    retrieval_accounting_service: RetrievalAccountingService
 
     def search_in_datasets(
             self,
@@ -44,8 +64,10 @@ class RetrievalService(BaseService):
             k: int = 4,
             score: float = 0,
             retrival_source: str = RetrievalSource.HIT_TESTING,
+            queries: Optional[list[str]] = None,
     ) -> list[LCDocument]:
-        """根据传递的query+知识库列表执行检索，并返回检索的文档+得分数据（如果检索策略为全文检索，则得分为0）"""
+        """根据传递的query+知识库列表执行检索，并返回检索的文档+得分数据（如果检索策略为全文检索，则得分为BM25得分），
+        传递了queries(同一问题的其他表述)时并发检索所有表述，并使用倒数排名融合(RRF)合并结果"""
         # 1.提取知识库列表并校验权限同时更新知识库id
         datasets = self.db.session.query(Dataset).filter(
             Dataset.id.in_(dataset_ids),
@@ -55,11 +77,135 @@ class RetrievalService(BaseService):
             raise NotFoundException("当前无知识库可执行检索")
         dataset_ids = [dataset.id for dataset in datasets]
 
-        # 2.构建不同种类的检索器
-        from internal.core.retrievers import SemanticRetriever, FullTextRetriever
+        # 2.开启重排序时过度召回更多的候选片段
+        rerank_enabled = os.getenv("RETRIEVAL_RERANK_ENABLED", "false").lower() == "true"
+        fetch_k = max(k, int(os.getenv("RETRIEVAL_RERANK_CANDIDATES", 20))) if rerank_enabled else k
+
+        # 3.去除重复及空白的查询语句，只有一条查询语句时直接检索，否则并发检索后融合
+        all_queries = list(dict.fromkeys(q.strip() for q in [query, *(queries or [])] if q and q.strip())) or [query]
+        if len(all_queries) == 1:
+            lc_documents = self._cached_search(dataset_ids, all_queries[0], retrieval_strategy, fetch_k, score)
+        else:
+            lc_documents = self._multi_query_search(dataset_ids, all_queries, retrieval_strategy, fetch_k, score)
+
+        # 4.使用本地交叉编码器重排序候选片段后截取前k个
+        if rerank_enabled:
+            lc_documents = self._rerank(query, lc_documents, k)
+
+        # 5.将知识库查询记录及片段命中次数写入写缓冲，由定时任务批量刷写到数据库，命中缓存时同样记录
+        try:
+            self.retrieval_accounting_service.record(
+                dataset_ids=[lc_document.metadata["dataset_id"] for lc_document in lc_documents],
+                segment_ids=[lc_document.metadata["segment_id"] for lc_document in lc_documents],
+                query=query,
+                source=retrival_source,
+                # todo:等待APP配置模块完成后进行调整
+                source_app_id=None,
+                created_by=account_id,
+            )
+        except Exception as e:
+            logging.exception("记录知识库检索统计失败，错误信息：%(error)s", {"error": e})
+
+        return lc_documents
+
+    def generate_queries(self, query: str, count: int) -> list[str]:
+        """调用一次大语言模型，为传递的query生成count个不同表述的查询语句，生成失败时返回空列表"""
+        # 1.构建prompt及结构化输出的大语言模型，将温度调低，降低偏离原问题意图的概率
+        prompt = ChatPromptTemplate.from_messages([
+            ("system", MULTI_QUERY_TEMPLATE),
+            ("human", "{query}"),
+        ])
+        llm = ChatOpenAI(model="gpt-4o-mini", temperature=0)
+        chain = prompt | llm.with_structured_output(MultiQueries)
+
+        # 2.调用链并提取查询语句列表
+        try:
+            multi_queries = chain.invoke({"query": query, "count": count})
+            return [q for q in multi_queries.queries if isinstance(q, str)][:count]
+        except Exception as e:
+            logging.exception("生成多查询语句出错, query: %(query)s, 错误信息: %(error)s", {"query": query, "error": e})
+            return []
+
+    def _cached_search(
+            self, dataset_ids: list[UUID], query: str, retrieval_strategy: str, k: int, score: float,
+    ) -> list[LCDocument]:
+        """优先读取检索结果缓存，知识库发生变化时版本号递增，缓存键随之变化，不会读取到过期的结果"""
+        cache_key = self.retrieval_cache_service.get_cache_key(dataset_ids, query, retrieval_strategy, k, score)
+        lc_documents = self.retrieval_cache_service.get_documents(cache_key)
+        if lc_documents is None:
+            lc_documents = self._search(dataset_ids, query, retrieval_strategy, k, score)
+            self.retrieval_cache_service.set_documents(cache_key, lc_documents)
+        return lc_documents
+
+    def _multi_query_search(
+            self, dataset_ids: list[UUID], queries: list[str], retrieval_strategy: str, k: int, score: float,
+    ) -> list[LCDocument]:
+        """并发检索多条查询语句，按片段id去重并使用倒数排名融合合并，融合得分归一化到0-1"""
+        # 1.第一条查询在当前线程执行，其余查询在子线程执行，子线程推入独立的应用上下文，使用各自的数据库会话
+        flask_app = current_app._get_current_object()
+
+        def search(sub_query: str) -> list[LCDocument]:
+            with flask_app.app_context():
+                return self._cached_search(dataset_ids, sub_query, retrieval_strategy, k, score)
+
+        max_workers = min(len(queries) - 1, int(os.getenv("RETRIEVAL_MULTI_QUERY_MAX_WORKERS", 4)))
+        with ThreadPoolExecutor(max_workers=max(max_workers, 1)) as executor:
+            futures = [executor.submit(search, sub_query) for sub_query in queries[1:]]
+            ranked_lists = [self._cached_search(dataset_ids, queries[0], retrieval_strategy, k, score)]
+            ranked_lists.extend(future.result() for future in futures)
+
+        # 2.使用倒数排名融合合并结果，每条查询的权重均为1，所有查询都排在第一位时得分为1
+        weights = [1.0] * len(ranked_lists)
+        fused = reciprocal_rank_fusion(ranked_lists, weights, MULTI_QUERY_RRF_C)[:k]
+        max_score = len(ranked_lists) / (MULTI_QUERY_RRF_C + 1)
+        lc_documents = []
+        for lc_document, fused_score in fused:
+            lc_document.metadata["score"] = fused_score / max_score
+            lc_documents.append(lc_document)
+
+        return lc_documents
+
+    @classmethod
+    def _rerank(cls, query: str, lc_documents: list[LCDocument], k: int) -> list[LCDocument]:
+        """一次批量计算query与所有候选片段的相关性得分并重新排序，超出延迟预算或者重排序失败时保持原有顺序"""
+        if len(lc_documents) <= 1:
+            return lc_documents[:k]
+
+        # 1.在延迟预算内执行重排序，得分记录在rerank_score中，原有的召回得分保持不变
+        start_at = time.perf_counter()
+        try:
+            scores = get_local_reranker().rerank(
+                query,
+                [lc_document.page_content for lc_document in lc_documents],
+                timeout=float(os.getenv("RETRIEVAL_RERANK_TIMEOUT_MS", 300)) / 1000,
+            )
+        except Exception as e:
+            logging.exception("检索结果重排序失败，错误信息：%(error)s", {"error": e})
+            scores = None
+
+        # 2.超时或者失败时回退到原有顺序
+        if scores is None:
+            logging.warning(
+                "检索结果重排序超出延迟预算或失败，回退到原有顺序，耗时：%(elapsed).3fs",
+                {"elapsed": time.perf_counter() - start_at},
+            )
+            return lc_documents[:k]
+
+        # 3.按重排序得分降序截取前k个
+        for lc_document, rerank_score in zip(lc_documents, scores):
+            lc_document.metadata["rerank_score"] = float(rerank_score)
+        return sorted(lc_documents, key=lambda lc_document: lc_document.metadata["rerank_score"], reverse=True)[:k]
+
+    def _search(
+            self, dataset_ids: list[UUID], query: str, retrieval_strategy: str, k: int, score: float,
+    ) -> list[LCDocument]:
+        """根据检索策略构建检索器并执行检索"""
+        # 1.构建不同种类的检索器
+        from internal.core.retrievers import SemanticRetriever, FullTextRetriever, HybridRetriever
         semantic_retriever = SemanticRetriever(
             dataset_ids=dataset_ids,
-            vector_store=self.vector_database_service.vector_store,
+            vector_database_service=self.vector_database_service,
+            dataset_exclusion_service=self.dataset_exclusion_service,
             search_kwargs={
                 "k": k,
                 "score_threshold": score,
@@ -69,46 +215,28 @@ class RetrievalService(BaseService):
             db=self.db,
             dataset_ids=dataset_ids,
             jieba_service=self.jieba_service,
+            dataset_exclusion_service=self.dataset_exclusion_service,
+            bm25_index_service=self.bm25_index_service,
             search_kwargs={
                 "k": k
             },
         )
-        hybrid_retriever = EnsembleRetriever(
-            retrievers=[semantic_retriever, full_text_retriever],
+        hybrid_retriever = HybridRetriever(
+            semantic_retriever=semantic_retriever,
+            full_text_retriever=full_text_retriever,
             weights=[0.5, 0.5],
+            score_mode=os.getenv("HYBRID_RETRIEVAL_SCORE_MODE", "rrf"),
+            search_kwargs={
+                "k": k,
+            },
         )
 
-        # 3.根据不同的检索策略执行检索
+        # 2.根据不同的检索策略执行检索
         if retrieval_strategy == RetrievalStrategy.SEMANTIC:
-            lc_documents = semantic_retriever.invoke(query)[:k]
+            return semantic_retriever.invoke(query)[:k]
         elif retrieval_strategy == RetrievalStrategy.FULL_TEXT:
-            lc_documents = full_text_retriever.invoke(query)[:k]
-        else:
-            lc_documents = hybrid_retriever.invoke(query)[:k]
-
-        # 4.添加知识库查询记录（只存储唯一记录，也就是一个知识库如果检索了多篇文档，也只存储一条）
-        unique_dataset_ids = list(set(str(lc_document.metadata["dataset_id"]) for lc_document in lc_documents))
-        for dataset_id in unique_dataset_ids:
-            self.create(
-                DatasetQuery,
-                dataset_id=dataset_id,
-                query=query,
-                source=retrival_source,
-                # todo:等待APP配置模块完成后进行调整
-                source_app_id=None,
-                created_by=account_id,
-            )
-
-        # 5.批量更新片段的命中次数，召回次数，涵盖了构建+执行语句
-        with self.db.auto_commit():
-            stmt = (
-                update(Segment)
-                .where(Segment.id.in_([lc_document.metadata["segment_id"] for lc_document in lc_documents]))
-                .values(hit_count=Segment.hit_count + 1)
-            )
-            self.db.session.execute(stmt)
-
-        return lc_documents
+            return full_text_retriever.invoke(query)[:k]
+        return hybrid_retriever.invoke(query)[:k]
 
     def create_langchain_tool_from_search(
             self,
@@ -125,11 +253,21 @@ class RetrievalService(BaseService):
         class DatasetRetrievalInput(BaseModel):
             """知识库检索工具输入结构"""
             query: str = Field(description="知识库搜索query语句，类型为字符串")
+            queries: list[str] = Field(
+                default_factory=list,
+                description="可选，同一问题的其他不同表述，会与query一起检索并合并结果，类型为字符串数组，最多3条",
+            )
 
         @tool(DATASET_RETRIEVAL_TOOL_NAME, args_schema=DatasetRetrievalInput)
-        def dataset_retrieval(query: str) -> str:
-            """如果需要搜索扩展的知识库内容，当你觉得用户的提问超过你的知识范围时，可以尝试调用该工具，输入为搜索query语句，返回数据为检索内容字符串"""
-            # 1.调用search_in_datasets检索得到LangChain文档列表
+        def dataset_retrieval(query: str, queries: Optional[list[str]] = None) -> str:
+            """如果需要搜索扩展的知识库内容，当你觉得用户的提问超过你的知识范围时，可以尝试调用该工具，输入为搜索query语句及可选的多个不同表述，返回数据为检索内容字符串"""
+            # 1.未传递其他表述且开启了多查询改写时，调用大语言模型生成其他表述
+            queries = (queries or [])[:MULTI_QUERY_MAX_COUNT]
+            multi_query_count = min(int(os.getenv("RETRIEVAL_MULTI_QUERY_COUNT", 0)), MULTI_QUERY_MAX_COUNT)
+            if len(queries) == 0 and multi_query_count > 0:
+                queries = self.generate_queries(query, multi_query_count)
+
+            # 2.调用search_in_datasets检索得到LangChain文档列表
             with flask_app.app_context():
                 documents = self.search_in_datasets(
                     dataset_ids=dataset_ids,
@@ -139,9 +277,10 @@ class RetrievalService(BaseService):
                     k=k,
                     score=score,
                     retrival_source=retrival_source,
+                    queries=queries,
                 )
 
-            # 2.将LangChain文档列表转换成字符串后返回
+            # 3.将LangChain文档列表转换成字符串后返回
             if len(documents) == 0:
                 return "知识库内没有检索到对应内容"
 
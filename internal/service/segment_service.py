@@ -16,7 +16,7 @@ from langchain_core.documents import Document as LCDocument
 from redis import Redis
 from sqlalchemy import asc, func
 
-from internal.entity.cache_entity import LOCK_EXPIRE_TIME, LOCK_SEGMENT_UPDATE_ENABLED
+from internal.entity.cache_entity import EMBEDDINGS_REUSED_COUNT
 from internal.entity.dataset_entity import DocumentStatus, SegmentStatus
 from internal.exception import NotFoundException, FailException, ValidateErrorException
 from internal.lib.helper import generate_text_hash
@@ -29,9 +29,13 @@ from internal.schema.segment_schema import (
 from pkg.paginator import Paginator
 from pkg.sqlalchemy import SQLAlchemy
 from .base_service import BaseService
+from .dataset_exclusion_service import DatasetExclusionService
 from .embeddings_service import EmbeddingsService
+from .indexing_service import IndexingService
 from .jieba_service import JiebaService
 from .keyword_table_service import KeywordTableService
+from .retrieval_cache_service import RetrievalCacheService
+from .tokenizer_service import TokenizerService
 from .vector_database_service import VectorDatabaseService
 
 
@@ -45,6 +49,10 @@ class SegmentService(BaseService):
     embeddings_service: EmbeddingsService
     keyword_table_service: KeywordTableService
     vector_database_service: VectorDatabaseService
+    indexing_service: IndexingService
+    tokenizer_service: TokenizerService
+    dataset_exclusion_service: DatasetExclusionService
+    retrieval_cache_service: RetrievalCacheService
 
     def create_segment(
             self,
@@ -55,7 +63,7 @@ class SegmentService(BaseService):
     ) -> Segment:
         """根据传递的信息新增文档片段信息"""
         # 1.校验上传内容的token长度总数，不能超过1000
-        token_count = self.embeddings_service.calculate_token_count(req.content.data)
+        token_count = self.tokenizer_service.count_token(req.content.data)
         if token_count > 1000:
             raise ValidateErrorException("片段内容的长度不能超过1000 token")
 
@@ -77,14 +85,22 @@ class SegmentService(BaseService):
             Segment.document_id == document_id,
         ).scalar()
 
-        # 5.检测是否传递了keywords，如果没有传递的话，调用jieba服务生成关键词
+        # 5.检测是否传递了keywords，如果没有传递的话，优先复用账号下相同内容片段的关键词，否则调用jieba服务生成关键词
+        content_hash = generate_text_hash(req.content.data)
         if req.keywords.data is None or len(req.keywords.data) == 0:
-            req.keywords.data = self.jieba_service.extract_keywords(req.content.data, 10)
+            reusable_segment = self.indexing_service.get_reusable_segments(account.id, [content_hash]).get(content_hash)
+            req.keywords.data = (
+                reusable_segment[1] if reusable_segment
+                else self.jieba_service.extract_keywords(req.content.data, 10)
+            )
 
         # 6.往postgres数据库中新增记录
         segment = None
         try:
-            # 7.位置+1并且新增segment记录
+            # 7.查找账号下相同内容片段已存储的向量，需要在新增片段记录前查找，避免匹配到片段自身
+            vector = self.indexing_service.get_reusable_vectors(account.id, [content_hash]).get(content_hash)
+
+            # 8.位置+1并且新增segment记录
             position += 1
             segment = self.create(
                 Segment,
@@ -97,7 +113,7 @@ class SegmentService(BaseService):
                 character_count=len(req.content.data),
                 token_count=token_count,
                 keywords=req.keywords.data,
-                hash=generate_text_hash(req.content.data),
+                hash=content_hash,
                 enabled=True,
                 processing_started_at=datetime.now(),
                 indexing_completed_at=datetime.now(),
@@ -105,39 +121,41 @@ class SegmentService(BaseService):
                 status=SegmentStatus.COMPLETED,
             )
 
-            # 8.往向量数据库中新增数据
-            self.vector_database_service.vector_store.add_documents(
-                [LCDocument(
-                    page_content=req.content.data,
-                    metadata={
-                        "account_id": str(document.account_id),
-                        "dataset_id": str(document.dataset_id),
-                        "document_id": str(document.id),
-                        "segment_id": str(segment.id),
-                        "node_id": str(segment.node_id),
-                        "document_enabled": document.enabled,
-                        "segment_enabled": True,
-                    }
-                )],
-                ids=[str(segment.node_id)],
+            # 9.往向量数据库中新增数据，存在相同内容片段的向量时直接复用
+            lc_document = LCDocument(
+                page_content=req.content.data,
+                metadata={
+                    "account_id": str(document.account_id),
+                    "dataset_id": str(document.dataset_id),
+                    "document_id": str(document.id),
+                    "segment_id": str(segment.id),
+                    "node_id": str(segment.node_id),
+                }
             )
+            if vector is not None:
+                self.vector_database_service.add_documents_with_vectors(
+                    [lc_document], [vector], [str(segment.node_id)],
+                )
+                self.redis_client.incr(EMBEDDINGS_REUSED_COUNT)
+            else:
+                self.vector_database_service.add_documents([lc_document], ids=[str(segment.node_id)])
 
-            # 9.重新计算片段的字符总数以及token总数
+            # 10.重新计算片段的字符总数以及token总数
             document_character_count, document_token_count = self.db.session.query(
                 func.coalesce(func.sum(Segment.character_count), 0),
                 func.coalesce(func.sum(Segment.token_count), 0)
             ).filter(Segment.document_id == document.id).first()
 
-            # 10.更新文档的对应信息
+            # 11.更新文档的对应信息
             self.update(
                 document,
                 character_count=document_character_count,
                 token_count=document_token_count,
             )
 
-            # 11.更新关键词表信息
-            if document.enabled is True:
-                self.keyword_table_service.add_keyword_table_from_ids(dataset_id, [segment.id])
+            # 12.更新关键词表信息，文档是否启用在检索时通过排除集合过滤，并使检索结果缓存失效
+            self.keyword_table_service.add_keyword_table_from_ids(dataset_id, [segment.id])
+            self.retrieval_cache_service.bump_versions([dataset_id])
 
         except Exception as e:
             logging.exception("新增文档片段内容发生异常, 错误信息: %(error)s", {"error": str(e)})
@@ -150,6 +168,7 @@ class SegmentService(BaseService):
                     disabled_at=datetime.now(),
                     stopped_at=datetime.now(),
                 )
+                self.dataset_exclusion_service.disable_segments(dataset_id, [segment.id])
             raise FailException("新增文档片段失败，请稍后尝试")
 
     def update_segment(
@@ -170,14 +189,18 @@ class SegmentService(BaseService):
         if segment.status != SegmentStatus.COMPLETED:
             raise FailException("当前片段不可修改状态，请稍后尝试")
 
-        # 3.检测是否传递了keywords，如果没有传递的话，调用jieba服务生成关键词
-        if req.keywords.data is None or len(req.keywords.data) == 0:
-            req.keywords.data = self.jieba_service.extract_keywords(req.content.data, 10)
-
-        # 4.计算新内容hash值，用于判断是否需要更新向量数据库以及文档详情
+        # 3.计算新内容hash值，用于判断是否需要更新向量数据库以及文档详情
         new_hash = generate_text_hash(req.content.data)
         required_update = segment.hash != new_hash
 
+        # 4.检测是否传递了keywords，如果没有传递的话，优先复用账号下相同内容片段的关键词，否则调用jieba服务生成关键词
+        if req.keywords.data is None or len(req.keywords.data) == 0:
+            reusable_segment = self.indexing_service.get_reusable_segments(account.id, [new_hash]).get(new_hash)
+            req.keywords.data = (
+                reusable_segment[1] if reusable_segment
+                else self.jieba_service.extract_keywords(req.content.data, 10)
+            )
+
         try:
             # 5.更新segment表记录
             self.update(
@@ -186,7 +209,7 @@ class SegmentService(BaseService):
                 content=req.content.data,
                 hash=new_hash,
                 character_count=len(req.content.data),
-                token_count=self.embeddings_service.calculate_token_count(req.content.data),
+                token_count=self.tokenizer_service.count_token(req.content.data),
             )
 
             # 7.更新片段归属关键词信息
@@ -207,14 +230,16 @@ class SegmentService(BaseService):
                     token_count=document_token_count,
                 )
 
-                # 9.更新向量数据库对应记录
-                self.vector_database_service.collection.data.update(
-                    uuid=str(segment.node_id),
-                    properties={
-                        "text": req.content.data,
-                    },
-                    vector=self.embeddings_service.embeddings.embed_query(req.content.data)
-                )
+                # 9.更新向量数据库对应记录，账号下存在相同内容片段的向量时直接复用，无需重新调用文本嵌入模型
+                vector = self.indexing_service.get_reusable_vectors(account.id, [new_hash]).get(new_hash)
+                if vector is None:
+                    vector = self.embeddings_service.cache_backed_embeddings.embed_documents([req.content.data])[0]
+                else:
+                    self.redis_client.incr(EMBEDDINGS_REUSED_COUNT)
+                self.vector_database_service.update_document(str(segment.node_id), req.content.data, vector)
+
+            # 10.使检索结果缓存失效
+            self.retrieval_cache_service.bump_versions([dataset_id])
         except Exception as e:
             logging.exception("更新文档片段记录失败, segment_id: %(segment_id)s, 错误信息: %(error)s", {"segment_id": segment_id, "error": str(e)})
             raise FailException("更新文档片段记录失败，请稍后尝试")
@@ -281,45 +306,83 @@ class SegmentService(BaseService):
         if enabled == segment.enabled:
             raise FailException(f"片段状态修改错误，当前已是{'启用' if enabled else '禁用'}")
 
-        # 4.获取更新片段启用状态锁并上锁检测
-        cache_key = LOCK_SEGMENT_UPDATE_ENABLED.format(segment_id=segment_id)
-        cache_result = self.redis_client.get(cache_key)
-        if cache_result is not None:
-            raise FailException("当前文档片段正在修改状态，请稍后尝试")
+        # 4.修改postgres数据库里的文档片段状态
+        self.update(
+            segment,
+            enabled=enabled,
+            disabled_at=None if enabled else datetime.now()
+        )
 
-        # 5.上锁并更新对应的数据，涵盖postgres记录、weaviate、关键词表
-        with self.redis_client.lock(cache_key, LOCK_EXPIRE_TIME):
-            try:
-                # 6.修改postgres数据库里的文档片段状态
-                self.update(
-                    segment,
-                    enabled=enabled,
-                    disabled_at=None if enabled else datetime.now()
-                )
+        # 5.同步更新检索排除集合，关键词表及weaviate中的数据保持不变
+        try:
+            if enabled:
+                self.dataset_exclusion_service.enable_segments(dataset_id, [segment_id])
+            else:
+                self.dataset_exclusion_service.disable_segments(dataset_id, [segment_id])
+        except Exception as e:
+            # 6.排除集合更新失败时将片段状态修改回原来的状态
+            logging.exception("更改文档片段启用状态出现异常, segment_id: %(segment_id)s, 错误信息: %(error)s", {"segment_id": segment_id, "error": str(e)})
+            self.update(
+                segment,
+                enabled=not enabled,
+                disabled_at=datetime.now() if enabled else None,
+            )
+            raise FailException("更新文档片段启用状态失败，请稍后重试")
 
-                # 7.更新关键词表的对应信息，有可能新增，也有可能删除
-                document = segment.document
-                if enabled is True and document.enabled is True:
-                    self.keyword_table_service.add_keyword_table_from_ids(dataset_id, [segment_id])
-                else:
-                    self.keyword_table_service.delete_keyword_table_from_ids(dataset_id, [segment_id])
+        return segment
 
-                # 8.同步处理weaviate向量数据库里的数据
-                self.vector_database_service.collection.data.update(
-                    uuid=segment.node_id,
-                    properties={"segment_enabled": enabled}
-                )
-            except Exception as e:
-                logging.exception("更改文档片段启用状态出现异常, segment_id: %(segment_id)s, 错误信息: %(error)s", {"segment_id": segment_id, "error": str(e)})
-                self.update(
-                    segment,
-                    error=str(e),
-                    status=SegmentStatus.ERROR,
-                    enabled=False,
-                    disabled_at=datetime.now(),
-                    stopped_at=datetime.now(),
-                )
-                raise FailException("更新文档片段启用状态失败，请稍后重试")
+    def update_segments_enabled(
+            self, dataset_id: UUID, document_id: UUID, segment_ids: list[UUID], enabled: bool, account: Account,
+    ) -> list[Segment]:
+        """根据传递的信息批量更新文档片段的启用状态，只需批量更新postgres及检索排除集合"""
+        # 1.获取片段列表并校验权限
+        segments = self.db.session.query(Segment).filter(
+            Segment.id.in_(segment_ids),
+            Segment.account_id == account.id,
+            Segment.dataset_id == dataset_id,
+            Segment.document_id == document_id,
+        ).all()
+        if len(segments) != len(segment_ids):
+            raise NotFoundException("部分文档片段不存在，或无权限修改，请核实后重试")
+
+        # 2.判断文档片段是否都处于可启用/禁用的环境
+        if any(segment.status != SegmentStatus.COMPLETED for segment in segments):
+            raise FailException("存在不可修改状态的片段，请稍后尝试")
+
+        # 3.筛选出启用状态需要变化的片段，状态一致的片段无需处理
+        segments = [segment for segment in segments if segment.enabled != enabled]
+        if not segments:
+            return []
+
+        # 4.使用一条语句批量修改postgres数据库里的文档片段状态
+        changed_segment_ids = [segment.id for segment in segments]
+        with self.db.auto_commit():
+            self.db.session.query(Segment).filter(
+                Segment.id.in_(changed_segment_ids),
+            ).update({
+                "enabled": enabled,
+                "disabled_at": None if enabled else datetime.now(),
+            }, synchronize_session=False)
+
+        # 5.使用一条集合命令批量更新检索排除集合
+        try:
+            if enabled:
+                self.dataset_exclusion_service.enable_segments(dataset_id, changed_segment_ids)
+            else:
+                self.dataset_exclusion_service.disable_segments(dataset_id, changed_segment_ids)
+        except Exception as e:
+            # 6.排除集合更新失败时将片段状态批量修改回原来的状态
+            logging.exception("批量更改文档片段启用状态出现异常, document_id: %(document_id)s, 错误信息: %(error)s", {"document_id": document_id, "error": str(e)})
+            with self.db.auto_commit():
+                self.db.session.query(Segment).filter(
+                    Segment.id.in_(changed_segment_ids),
+                ).update({
+                    "enabled": not enabled,
+                    "disabled_at": datetime.now() if enabled else None,
+                }, synchronize_session=False)
+            raise FailException("批量更新文档片段启用状态失败，请稍后重试")
+
+        return segments
 
     def delete_segment(self, dataset_id: UUID, document_id: UUID, segment_id: UUID, account: Account) -> Segment:
         """根据传递的信息删除指定的文档片段信息，该服务是同步方法"""
@@ -341,12 +404,14 @@ class SegmentService(BaseService):
         document = segment.document
         self.delete(segment)
 
-        # 4.同步删除关键词表中属于该片段的关键词
+        # 4.同步删除关键词表中属于该片段的关键词，并在删除向量前将片段加入检索排除集合
         self.keyword_table_service.delete_keyword_table_from_ids(dataset_id, [segment_id])
+        self.dataset_exclusion_service.disable_segments(dataset_id, [segment_id])
 
-        # 5.同步删除向量数据库存储的记录
+        # 5.同步删除向量数据库存储的记录，删除成功后才清除排除集合中的记录，失败时保留排除避免残留的向量被召回
         try:
-            self.vector_database_service.collection.data.delete_by_id(str(segment.node_id))
+            self.vector_database_service.delete_documents([str(segment.node_id)])
+            self.dataset_exclusion_service.remove(dataset_id, [], [segment_id])
         except Exception as e:
             logging.exception("删除文档片段记录失败, segment_id: %(segment_id)s, 错误信息: %(error)s", {"segment_id": segment_id, "error": str(e)})
 
@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+@Time    : 2024/12/18 10:12
+@Author  : thezehui@gmail.com
+@File    : tokenizer_service.py
+"""
+import os
+from collections import OrderedDict
+from dataclasses import dataclass
+from functools import lru_cache
+from threading import Lock
+
+import tiktoken
+from injector import inject
+from langchain_core.messages import BaseMessage, get_buffer_string
+
+from internal.lib.helper import generate_text_hash
+
+# 计算token数使用的编码器对应模型
+TOKENIZER_ENCODING_MODEL = "gpt-3.5"
+
+# token数缓存，键为文本哈希值，同一进程内的所有TokenizerService实例共享
+_token_count_cache: OrderedDict[str, int] = OrderedDict()
+_token_count_cache_lock = Lock()
+
+
+@lru_cache(maxsize=1)
+def _get_encoding() -> tiktoken.Encoding:
+    """获取编码器，进程内只解析一次"""
+    return tiktoken.encoding_for_model(TOKENIZER_ENCODING_MODEL)
+
+
+@inject
+@dataclass
+class TokenizerService:
+    """分词器服务，编码器只初始化一次，并使用有界LRU缓存已计算过的文本token数"""
+
+    @classmethod
+    def count_token(cls, text: str) -> int:
+        """计算传入文本的token数"""
+        return cls.count_tokens([text])[0]
+
+    @classmethod
+    def count_tokens(cls, texts: list[str]) -> list[int]:
+        """批量计算传入文本列表的token数，返回结果与输入文本顺序一致"""
+        # 1.计算所有文本的哈希值，并从缓存中查找已计算过的token数
+        hashes = [generate_text_hash(text) for text in texts]
+        token_counts: dict[str, int] = {}
+        with _token_count_cache_lock:
+            for text_hash in hashes:
+                if text_hash in _token_count_cache:
+                    _token_count_cache.move_to_end(text_hash)
+                    token_counts[text_hash] = _token_count_cache[text_hash]
+
+        # 2.未命中缓存的文本去重后使用编码器批量计算
+        missing = {text_hash: text for text_hash, text in zip(hashes, texts) if text_hash not in token_counts}
+        if missing:
+            tokens_list = _get_encoding().encode_ordinary_batch(list(missing.values()))
+            token_counts.update({text_hash: len(tokens) for text_hash, tokens in zip(missing.keys(), tokens_list)})
+
+            # 3.将新计算的结果写入缓存，超出容量时淘汰最久未使用的记录
+            max_size = int(os.getenv("TOKENIZER_CACHE_SIZE", 10000))
+            with _token_count_cache_lock:
+                for text_hash in missing.keys():
+                    _token_count_cache[text_hash] = token_counts[text_hash]
+                    _token_count_cache.move_to_end(text_hash)
+                while len(_token_count_cache) > max_size:
+                    _token_count_cache.popitem(last=False)
+
+        return [token_counts[text_hash] for text_hash in hashes]
+
+    @classmethod
+    def count_messages_tokens(cls, messages: list[BaseMessage]) -> int:
+        """计算消息列表的token数，可作为trim_messages的token_counter使用"""
+        return sum(cls.count_tokens([get_buffer_string([message]) for message in messages]))
@@ -6,51 +6,92 @@
 @File    : vector_database_service.py
 """
 import os
+from typing import Union
+from uuid import UUID
 
-import weaviate
 from injector import inject
-from langchain_core.vectorstores import VectorStoreRetriever
-from langchain_weaviate import WeaviateVectorStore
-from weaviate import WeaviateClient
-from weaviate.collections import Collection
+from langchain_core.documents import Document as LCDocument
+from redis import Redis
 
+from internal.core.vector_database import BaseVectorBackend, WeaviateVectorBackend
 from .embeddings_service import EmbeddingsService
 
-# 向量数据库的集合名字
-COLLECTION_NAME = "Dataset"
-
 
 @inject
 class VectorDatabaseService:
-    """向量数据库服务"""
-    client: WeaviateClient
-    vector_store: WeaviateVectorStore
+    """向量数据库服务，通过VECTOR_DATABASE_BACKEND环境变量选择weaviate或者嵌入式faiss后端，两者对外接口一致"""
+    backend: BaseVectorBackend
     embeddings_service: EmbeddingsService
 
-    def __init__(self, embeddings_services: EmbeddingsService):
-        """构造函数，完成向量数据库服务的客户端+LangChain向量数据库实例的创建"""
+    def __init__(self, embeddings_services: EmbeddingsService, redis_client: Redis):
+        """构造函数，根据环境变量完成向量数据库后端的创建"""
         # 1.赋值embeddings_service
         self.embeddings_service = embeddings_services
 
-        # 2.创建/连接weaviate向量数据库
-        self.client = weaviate.connect_to_local(
+        # 2.嵌入式faiss后端，每个知识库一个分片，适合单机及小规模租户部署，只在选用时才导入faiss
+        if os.getenv("VECTOR_DATABASE_BACKEND", "weaviate") == "faiss":
+            from internal.core.vector_database.faiss_vector_backend import FaissVectorBackend
+
+            self.backend = FaissVectorBackend(
+                folder_path=os.getenv("FAISS_VECTOR_DATABASE_DIR", os.path.join("storage", "vector_database")),
+                embedding=self.embeddings_service.cache_backed_embeddings,
+                redis_client=redis_client,
+                index_type=os.getenv("FAISS_VECTOR_DATABASE_INDEX_TYPE", "hnsw"),
+                hnsw_m=int(os.getenv("FAISS_VECTOR_DATABASE_HNSW_M", 32)),
+                ef_search=int(os.getenv("FAISS_VECTOR_DATABASE_EF_SEARCH", 64)),
+            )
+            return
+
+        # 3.创建/连接weaviate向量数据库
+        self.backend = WeaviateVectorBackend(
             host=os.getenv("WEAVIATE_HOST"),
-            port=int(os.getenv("WEAVIATE_PORT"))
+            port=int(os.getenv("WEAVIATE_PORT")),
+            embedding=self.embeddings_service.cache_backed_embeddings,
         )
 
-        # 3.创建LangChain向量数据库
-        self.vector_store = WeaviateVectorStore(
-            client=self.client,
-            index_name=COLLECTION_NAME,
-            text_key="text",
-            embedding=self.embeddings_service.cache_backed_embeddings
-            # embedding=self.embeddings_service.embeddings,
+    def get_vectors(self, node_ids: list[str]) -> dict[str, list[float]]:
+        """根据传递的节点id列表批量获取向量数据库中已存储的向量，不存在的节点会被忽略"""
+        return self.backend.get_vectors(node_ids)
+
+    def add_documents(self, lc_documents: list[LCDocument], ids: list[str]) -> None:
+        """计算LangChain文档的向量后写入向量数据库"""
+        vectors = self.embeddings_service.cache_backed_embeddings.embed_documents(
+            [lc_document.page_content for lc_document in lc_documents],
         )
+        self.add_documents_with_vectors(lc_documents, vectors, ids)
+
+    def add_documents_with_vectors(
+            self, lc_documents: list[LCDocument], vectors: list[list[float]], ids: list[str],
+    ) -> None:
+        """将LangChain文档及已经计算好的向量直接写入向量数据库，无需再调用文本嵌入模型"""
+        errors = self.insert_documents_with_vectors(lc_documents, vectors, ids)
+        if errors:
+            raise RuntimeError("; ".join(errors.values()))
+
+    def insert_documents_with_vectors(
+            self, lc_documents: list[LCDocument], vectors: list[list[float]], ids: list[str],
+    ) -> dict[int, str]:
+        """批量写入LangChain文档及对应的向量，返回写入失败的 文档下标->错误信息 映射，便于只重试失败的部分"""
+        return self.backend.insert_documents_with_vectors(lc_documents, vectors, ids)
+
+    def update_document(self, node_id: str, text: str, vector: list[float]) -> None:
+        """更新指定节点的文本及向量"""
+        self.backend.update_document(node_id, text, vector)
+
+    def delete_documents(self, ids: list[str]) -> None:
+        """根据传递的节点id列表批量删除向量数据库中的记录"""
+        self.backend.delete_documents(ids)
+
+    def delete_by_document(self, dataset_id: Union[UUID, str], document_id: Union[UUID, str]) -> None:
+        """删除指定文档在向量数据库中的所有记录"""
+        self.backend.delete_by_document(dataset_id, document_id)
 
-    def get_retriever(self) -> VectorStoreRetriever:
-        """获取检索器"""
-        return self.vector_store.as_retriever()
+    def delete_by_dataset(self, dataset_id: Union[UUID, str]) -> None:
+        """删除指定知识库在向量数据库中的所有记录"""
+        self.backend.delete_by_dataset(dataset_id)
 
-    @property
-    def collection(self) -> Collection:
-        return self.client.collections.get(COLLECTION_NAME)
+    def similarity_search_with_relevance_scores(
+            self, query: str, k: int, dataset_ids: list[Union[UUID, str]], **kwargs,
+    ) -> list[tuple[LCDocument, float]]:
+        """在传递的知识库列表中执行相似性检索，返回 (文档, 0-1的相关性得分) 列表"""
+        return self.backend.similarity_search_with_relevance_scores(query, k, dataset_ids, **kwargs)
@@ -18,3 +18,13 @@ def delete_dataset(dataset_id: UUID) -> None:
 
     indexing_service = injector.get(IndexingService)
     indexing_service.delete_dataset(dataset_id)
+
+
+@shared_task
+def refresh_bm25_index(dataset_id: UUID) -> None:
+    """根据传递的知识库id将待合并的片段增量合并到BM25索引"""
+    from app.http.module import injector
+    from internal.service import BM25IndexService
+
+    bm25_index_service = injector.get(BM25IndexService)
+    bm25_index_service.refresh(dataset_id)
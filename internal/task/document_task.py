@@ -7,27 +7,53 @@
 """
 from uuid import UUID
 
-from celery import shared_task
+from celery import shared_task, group, Task
+
+# 知识库构建槽位已满时，文档构建子任务的初始重试间隔及最大重试间隔，单位为秒，重试间隔按指数退避
+BUILD_DOCUMENT_RETRY_COUNTDOWN = 10
+BUILD_DOCUMENT_MAX_RETRY_COUNTDOWN = 300
+
+# 文档构建子任务获取构建槽位的最大重试次数，超出后文档标记为出错(约2小时)
+BUILD_DOCUMENT_MAX_RETRIES = 30
 
 
 @shared_task
 def build_documents(document_ids: list[UUID]) -> None:
-    """根据传递的文档id列表，构建文档"""
+    """根据传递的文档id列表，为每个文档分发一个构建子任务，由多个worker并行完成构建"""
+    group(build_document.s(document_id) for document_id in document_ids).apply_async()
+
+
+def _retry_or_abandon(task: Task, indexing_service, document_id: UUID) -> None:
+    """构建槽位已满时按指数退避重试，超出最大重试次数后放弃构建并将文档标记为出错"""
+    if task.request.retries >= BUILD_DOCUMENT_MAX_RETRIES:
+        indexing_service.abandon_document(document_id, "知识库构建任务繁忙，请稍后重新构建该文档")
+        return
+    raise task.retry(countdown=min(
+        BUILD_DOCUMENT_RETRY_COUNTDOWN * 2 ** task.request.retries,
+        BUILD_DOCUMENT_MAX_RETRY_COUNTDOWN,
+    ))
+
+
+@shared_task(bind=True, max_retries=BUILD_DOCUMENT_MAX_RETRIES)
+def build_document(self: Task, document_id: UUID) -> None:
+    """根据传递的文档id构建单个文档，所属知识库并发构建数已满时稍后重试"""
     from app.http.module import injector
     from internal.service.indexing_service import IndexingService
 
     indexing_service = injector.get(IndexingService)
-    indexing_service.build_documents(document_ids)
+    if not indexing_service.build_document(document_id):
+        _retry_or_abandon(self, indexing_service, document_id)
 
 
-@shared_task
-def update_document_enabled(document_id: UUID) -> None:
-    """根据传递的文档id修改文档的状态"""
+@shared_task(bind=True, max_retries=BUILD_DOCUMENT_MAX_RETRIES)
+def update_document_file(self: Task, document_id: UUID, upload_file_id: UUID) -> None:
+    """根据传递的文档id+新上传文件id增量更新文档，所属知识库并发构建数已满时稍后重试"""
     from app.http.module import injector
     from internal.service.indexing_service import IndexingService
 
     indexing_service = injector.get(IndexingService)
-    indexing_service.update_document_enabled(document_id)
+    if not indexing_service.update_document_file(document_id, upload_file_id):
+        _retry_or_abandon(self, indexing_service, document_id)
 
 
 @shared_task
@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+@Time    : 2024/12/21
+@File    : benchmark_embedding_codec.py
+文本嵌入缓存编码基准测试，对比旧版JSON编码与二进制编码(float32/float16/int8)的单条向量字节数、编解码耗时及精度损失，
+传递--redis-url时额外写入redis并使用MEMORY USAGE统计每条记录实际占用的内存
+
+用法: python scripts/benchmark_embedding_codec.py --dimensions 768 1536 --count 2000 [--redis-url redis://localhost:6379/0]
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from typing import Callable, Optional
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from internal.core.text_embedding.vector_codec import encode_vector, decode_vector  # noqa: E402
+
+# 参与对比的编码方式，每种编码方式对应 (编码函数, 解码函数)
+CODECS: dict[str, tuple[Callable, Callable]] = {
+    "json": (lambda vector: json.dumps(vector.tolist()).encode(), lambda value: json.loads(value.decode())),
+    "float32": (lambda vector: encode_vector(vector, "float32"), decode_vector),
+    "float16": (lambda vector: encode_vector(vector, "float16"), decode_vector),
+    "int8": (lambda vector: encode_vector(vector, "int8"), decode_vector),
+}
+
+
+def build_vectors(count: int, dimension: int, seed: int = 42) -> np.ndarray:
+    """构建归一化的随机向量，模拟文本嵌入模型的输出"""
+    rng = np.random.default_rng(seed)
+    vectors = rng.standard_normal((count, dimension)).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def measure_redis(client, name: str, values: list[bytes]) -> float:
+    """将编码结果写入redis，返回每条记录的平均内存占用(字节)"""
+    keys = [f"benchmark:codec:{name}:{i}" for i in range(len(values))]
+    pipeline = client.pipeline()
+    for key, value in zip(keys, values):
+        pipeline.set(key, value)
+    pipeline.execute()
+    pipeline = client.pipeline()
+    for key in keys:
+        pipeline.memory_usage(key)
+    usages = pipeline.execute()
+    client.delete(*keys)
+    return sum(usages) / len(usages)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="文本嵌入缓存编码基准测试")
+    parser.add_argument("--dimensions", type=int, nargs="+", default=[768, 1536])
+    parser.add_argument("--count", type=int, default=2000)
+    parser.add_argument("--redis-url", default=None)
+    args = parser.parse_args()
+
+    client: Optional[object] = None
+    if args.redis_url:
+        from redis import Redis
+        client = Redis.from_url(args.redis_url)
+
+    print(
+        f"{'dim':>6} {'codec':>8} {'bytes':>8} {'ratio':>7} {'encode(us)':>11} {'decode(us)':>11} "
+        f"{'cos_err':>9} {'redis(B)':>9}"
+    )
+    for dimension in args.dimensions:
+        vectors = build_vectors(args.count, dimension)
+        json_bytes = None
+        for name, (encode, decode) in CODECS.items():
+            # 1.测量编码耗时及单条向量字节数
+            start = time.perf_counter()
+            values = [encode(vector) for vector in vectors]
+            encode_us = (time.perf_counter() - start) / args.count * 1e6
+            average_bytes = sum(len(value) for value in values) / args.count
+            json_bytes = json_bytes or average_bytes
+
+            # 2.测量解码耗时，并计算解码结果与原始向量的最大余弦误差
+            start = time.perf_counter()
+            decoded = [decode(value) for value in values]
+            decode_us = (time.perf_counter() - start) / args.count * 1e6
+            decoded = np.asarray(decoded, dtype=np.float32)
+            cosine = np.sum(decoded * vectors, axis=1) / np.linalg.norm(decoded, axis=1)
+            cos_err = float(np.max(1 - cosine))
+
+            # 3.可选：统计redis中每条记录实际占用的内存
+            redis_bytes = measure_redis(client, name, values) if client is not None else float("nan")
+
+            print(
+                f"{dimension:>6} {name:>8} {average_bytes:>8.0f} {json_bytes / average_bytes:>6.1f}x "
+                f"{encode_us:>11.1f} {decode_us:>11.1f} {cos_err:>9.2e} {redis_bytes:>9.0f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+@Time    : 2024/12/20
+@File    : benchmark_embeddings.py
+文本嵌入基准测试，对比OpenAI与本地gte-multilingual模型(PyTorch/onnx/onnx-int8)的吞吐量及召回率
+
+默认使用API文档的 "### " 小节构建评测集：小节标题作为查询，小节正文作为文档，召回率为标题的前k个检索结果中包含对应小节的比例，
+同时以OpenAI的检索结果为基准，计算本地模型前k个结果与其的重合率
+
+用法: python scripts/benchmark_embeddings.py --backends openai torch onnx onnx-int8 --concurrency 4 --k 5
+"""
+import argparse
+import os
+import re
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import dotenv
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# 默认评测集来源
+DEFAULT_CORPUS = os.path.join("docs", "01.项目API文档.md")
+
+
+def load_corpus(path: str, max_chars: int) -> tuple[list[str], list[str]]:
+    """读取markdown文档，按三级标题拆分成 (查询, 文档) 对"""
+    with open(path, encoding="utf-8") as f:
+        content = f.read()
+    queries, documents = [], []
+    for section in re.split(r"^### ", content, flags=re.M)[1:]:
+        title, _, body = section.partition("\n")
+        title = re.sub(r"^[\d.]+\s*", "", title).strip()
+        body = body.strip()[:max_chars]
+        if title and body:
+            queries.append(title)
+            documents.append(body)
+    return queries, documents
+
+
+def create_embeddings(backend: str):
+    """根据后端名字创建文本嵌入模型"""
+    if backend == "openai":
+        from langchain_openai import OpenAIEmbeddings
+        return OpenAIEmbeddings(model="text-embedding-3-small")
+
+    from internal.core.text_embedding import LocalEmbeddings
+    runtime, _, precision = backend.partition("-")
+    return LocalEmbeddings(runtime=runtime, quantize=precision == "int8")
+
+
+def embed(embeddings, texts: list[str], batch_size: int, concurrency: int) -> tuple[np.ndarray, float]:
+    """按批次并发计算文本向量，返回归一化后的向量矩阵及耗时"""
+    batches = [texts[i:i + batch_size] for i in range(0, len(texts), batch_size)]
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(embeddings.embed_documents, batches))
+    elapsed = time.perf_counter() - start
+    vectors = np.array([vector for result in results for vector in result], dtype=np.float32)
+    vectors /= np.clip(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12, None)
+    return vectors, elapsed
+
+
+def top_k(query_vectors: np.ndarray, document_vectors: np.ndarray, k: int) -> np.ndarray:
+    """计算每个查询余弦相似度最高的前k个文档下标"""
+    scores = query_vectors @ document_vectors.T
+    return np.argsort(-scores, axis=1)[:, :k]
+
+
+def main():
+    dotenv.load_dotenv()
+    parser = argparse.ArgumentParser(description="文本嵌入吞吐量及召回率基准测试")
+    parser.add_argument("--backends", nargs="+", default=["openai", "torch", "onnx", "onnx-int8"])
+    parser.add_argument("--corpus", default=DEFAULT_CORPUS)
+    parser.add_argument("--max-chars", type=int, default=1500)
+    parser.add_argument("--batch-size", type=int, default=16)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--k", type=int, default=5)
+    args = parser.parse_args()
+
+    queries, documents = load_corpus(args.corpus, args.max_chars)
+    labels = np.arange(len(queries))[:, None]
+    print(f"corpus: {len(documents)} documents, {sum(len(d) for d in documents)} chars, k={args.k}")
+
+    baseline = None
+    print(f"{'backend':>10} {'load(s)':>9} {'docs/s':>9} {'query(ms)':>10} {f'recall@{args.k}':>10} {'overlap':>9}")
+    for backend in args.backends:
+        # 1.加载模型并预热，预热耗时计入加载耗时
+        start = time.perf_counter()
+        embeddings = create_embeddings(backend)
+        embeddings.embed_documents(documents[:2])
+        load_seconds = time.perf_counter() - start
+
+        # 2.测量文档批量嵌入的吞吐量及单条查询的平均耗时
+        document_vectors, elapsed = embed(embeddings, documents, args.batch_size, args.concurrency)
+        start = time.perf_counter()
+        query_vectors = np.array([embeddings.embed_query(query) for query in queries], dtype=np.float32)
+        query_ms = (time.perf_counter() - start) / len(queries) * 1000
+        query_vectors /= np.clip(np.linalg.norm(query_vectors, axis=1, keepdims=True), 1e-12, None)
+
+        # 3.计算召回率，以及与第一个后端(默认为OpenAI)检索结果的重合率
+        indices = top_k(query_vectors, document_vectors, args.k)
+        recall = float(np.mean(np.any(indices == labels, axis=1)))
+        if baseline is None:
+            baseline = indices
+        overlap = float(np.mean([len(set(a) & set(b)) / args.k for a, b in zip(indices, baseline)]))
+
+        print(
+            f"{backend:>10} {load_seconds:>9.2f} {len(documents) / elapsed:>9.1f} "
+            f"{query_ms:>10.1f} {recall:>10.3f} {overlap:>9.3f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
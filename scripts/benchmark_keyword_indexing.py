@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+@Time    : 2024/12/16
+@File    : benchmark_keyword_indexing.py
+关键词索引构建基准测试，对比“逐片段重写整张关键词表”与“批量合并增量倒排项”两种方式的耗时随片段数的增长情况
+
+用法: python scripts/benchmark_keyword_indexing.py --counts 250 500 1000 2000
+"""
+import argparse
+import json
+import random
+import time
+import uuid
+
+# 每个片段提取的关键词数，与IndexingService._indexing保持一致
+KEYWORDS_PER_SEGMENT = 10
+
+
+def build_segments(count: int, vocabulary_size: int, seed: int = 42) -> list[tuple[str, list[str]]]:
+    """构建模拟的片段关键词数据，关键词按长尾分布从词表中采样"""
+    rng = random.Random(seed)
+    vocabulary = [f"keyword_{i}" for i in range(vocabulary_size)]
+    weights = [1 / (i + 1) for i in range(vocabulary_size)]
+    segments = []
+    for _ in range(count):
+        keywords = list(dict.fromkeys(rng.choices(vocabulary, weights=weights, k=KEYWORDS_PER_SEGMENT)))
+        segments.append((str(uuid.uuid4()), keywords))
+    return segments
+
+
+def legacy_indexing(segments: list[tuple[str, list[str]]]) -> int:
+    """旧方式：每个片段都读取整张JSONB关键词表，转换成集合合并后再整体写回"""
+    blob = "{}"
+    for segment_id, keywords in segments:
+        keyword_table = {field: set(value) for field, value in json.loads(blob).items()}
+        for keyword in keywords:
+            keyword_table.setdefault(keyword, set()).add(segment_id)
+        blob = json.dumps({field: list(value) for field, value in keyword_table.items()})
+    return len(blob)
+
+
+def batched_indexing(segments: list[tuple[str, list[str]]]) -> int:
+    """新方式：先提取全部片段关键词，再一次性生成需要写入的倒排项"""
+    segment_keywords = {segment_id: keywords for segment_id, keywords in segments}
+    records = [
+        {"keyword": keyword, "segment_id": segment_id}
+        for segment_id, keywords in segment_keywords.items()
+        for keyword in dict.fromkeys(keywords)
+    ]
+    return len(records)
+
+
+def measure(func, segments: list[tuple[str, list[str]]]) -> float:
+    start = time.perf_counter()
+    func(segments)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="关键词索引构建耗时基准测试")
+    parser.add_argument("--counts", type=int, nargs="+", default=[250, 500, 1000, 2000])
+    parser.add_argument("--vocabulary", type=int, default=20000)
+    args = parser.parse_args()
+
+    print(f"{'segments':>10} {'legacy(s)':>12} {'batched(s)':>12} {'speedup':>10}")
+    for count in args.counts:
+        segments = build_segments(count, args.vocabulary)
+        legacy_seconds = measure(legacy_indexing, segments)
+        batched_seconds = measure(batched_indexing, segments)
+        speedup = legacy_seconds / batched_seconds if batched_seconds > 0 else float("inf")
+        print(f"{count:>10} {legacy_seconds:>12.4f} {batched_seconds:>12.4f} {speedup:>9.1f}x")
+
+
+if __name__ == "__main__":
+    main()
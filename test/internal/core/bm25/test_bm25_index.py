@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+@Time    : 2024/12/25 16:05
+@Author  : thezehui@gmail.com
+@File    : test_bm25_index.py
+"""
+from uuid import uuid4
+
+import pytest
+
+from internal.core.bm25 import BM25Index, LayeredBM25Index, get_bm25_index
+
+SEGMENTS = {
+    str(uuid4()): ["llm", "应用", "开发"],
+    str(uuid4()): ["llm", "llm", "知识库"],
+    str(uuid4()): ["向量", "数据库"],
+    str(uuid4()): [],
+}
+
+
+def _ids(results: list[tuple[str, float]]) -> list[str]:
+    return [segment_id for segment_id, _ in results]
+
+
+class TestBM25Index:
+    """BM25索引的测试类"""
+
+    def test_merge_and_search(self):
+        index = BM25Index.empty().merge(SEGMENTS, set())
+        segment_ids = list(SEGMENTS.keys())
+
+        assert index.segment_count == 4
+        assert _ids(index.search(["llm"], 10)) == [segment_ids[1], segment_ids[0]]
+        assert _ids(index.search(["数据库", "数据库", "不存在"], 10)) == [segment_ids[2]]
+        assert len(index.search(["llm"], 1)) == 1
+        assert index.search(["不存在"], 10) == []
+        assert index.search(["llm"], 0) == []
+
+    def test_merge_removes_and_replaces(self):
+        segment_ids = list(SEGMENTS.keys())
+        index = BM25Index.empty().merge(SEGMENTS, set())
+        index = index.merge({segment_ids[0]: ["数据库"]}, {segment_ids[2]})
+
+        assert index.segment_count == 3
+        assert _ids(index.search(["数据库"], 10)) == [segment_ids[0]]
+        assert _ids(index.search(["llm"], 10)) == [segment_ids[1]]
+        assert "向量" not in index.terms
+
+    def test_to_tokens(self):
+        index = BM25Index.empty().merge(SEGMENTS, set())
+        tokens = index.to_tokens()
+
+        assert tokens.keys() == SEGMENTS.keys()
+        assert {id: sorted(terms) for id, terms in tokens.items()} == {
+            id: sorted(terms) for id, terms in SEGMENTS.items()
+        }
+
+
+class TestLayeredBM25Index:
+    """主索引+增量索引的测试类"""
+
+    @pytest.mark.parametrize("added, removed", [
+        ({}, set()),
+        ({list(SEGMENTS.keys())[0]: ["数据库", "llm"]}, set()),
+        ({}, {list(SEGMENTS.keys())[1]}),
+        ({str(uuid4()): ["llm", "向量"]}, {list(SEGMENTS.keys())[2]}),
+    ])
+    def test_merge_matches_compacted(self, added, removed):
+        """增量索引的检索结果与合并回主索引后的检索结果一致"""
+        index = LayeredBM25Index.empty().merge(SEGMENTS, set()).compact().merge(added, removed)
+        compacted = index.compact()
+
+        assert index.segment_count == compacted.segment_count
+        assert compacted.delta_size == 0
+        for query_terms in (["llm"], ["数据库", "向量"], ["llm", "知识库", "开发"]):
+            results, expected = index.search(query_terms, 10), compacted.search(query_terms, 10)
+            assert _ids(results) == _ids(expected)
+            assert [score for _, score in results] == pytest.approx([score for _, score in expected])
+
+    def test_save_keeps_base_generation(self, tmp_path):
+        """只有增量索引变化时不会重写主索引"""
+        segment_ids = list(SEGMENTS.keys())
+        path = str(tmp_path)
+        index = LayeredBM25Index.empty().merge(SEGMENTS, set()).compact()
+        base_version = index.save(path)
+
+        index = get_bm25_index(path).merge({}, {segment_ids[1]})
+        version = index.save(path)
+        assert version.split()[0] == base_version
+        assert len(version.split()) == 2
+
+        loaded = get_bm25_index(path)
+        assert loaded.segment_count == 3
+        assert _ids(loaded.search(["llm"], 10)) == [segment_ids[0]]
@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+@Time    : 2024/12/26 11:20
+@Author  : thezehui@gmail.com
+@File    : test_file_extractor.py
+"""
+from typing import Iterator
+
+import pandas as pd
+from langchain_core.documents import Document as LCDocument
+from pypdf import PdfReader, PdfWriter
+
+from internal.core.file_extractor import file_extractor
+from internal.core.file_extractor.file_extractor import FileExtractor, STREAMING_PDF_PAGES_PER_PARTITION
+
+
+class FakeUnstructuredPDFLoader:
+    """按页生成文档的假unstructured加载器，并记录每次解析的文件页数"""
+    page_counts = []
+
+    def __init__(self, file_path: str, mode: str = "single"):
+        self.file_path = file_path
+
+    def lazy_load(self) -> Iterator[LCDocument]:
+        page_count = len(PdfReader(self.file_path).pages)
+        self.page_counts.append(page_count)
+        for page_number in range(1, page_count + 1):
+            yield LCDocument(
+                page_content=f"page {page_number}",
+                metadata={"source": self.file_path, "filename": "pages.pdf", "page_number": page_number},
+            )
+
+
+class TestFileExtractor:
+    """文件提取器的测试类"""
+
+    def test_lazy_load_pdf_by_partitions(self, tmp_path, monkeypatch):
+        """PDF按页范围拆分解析，页码及来源与原文件一致"""
+        page_count = STREAMING_PDF_PAGES_PER_PARTITION * 2 + 5
+        writer = PdfWriter()
+        for _ in range(page_count):
+            writer.add_blank_page(width=72, height=72)
+        file_path = str(tmp_path / "test.pdf")
+        with open(file_path, "wb") as file:
+            writer.write(file)
+        FakeUnstructuredPDFLoader.page_counts = []
+        monkeypatch.setattr(file_extractor, "UnstructuredPDFLoader", FakeUnstructuredPDFLoader)
+
+        documents = list(FileExtractor.lazy_load_from_file(file_path))
+
+        assert FakeUnstructuredPDFLoader.page_counts == [
+            STREAMING_PDF_PAGES_PER_PARTITION, STREAMING_PDF_PAGES_PER_PARTITION, 5,
+        ]
+        assert [document.metadata["page_number"] for document in documents] == list(range(1, page_count + 1))
+        assert all(document.metadata["source"] == file_path for document in documents)
+        assert all(document.metadata["filename"] == "test.pdf" for document in documents)
+
+    def test_lazy_load_xls_by_sheets(self, monkeypatch):
+        """旧版xls逐个工作表按行批次生成文档，空单元格不会输出nan"""
+        sheets = {
+            "first": pd.DataFrame([["a", 1], [None, 2.5]], dtype=object),
+            "second": pd.DataFrame([["b", None]], dtype=object),
+        }
+
+        class FakeExcelFile:
+            sheet_names = list(sheets.keys())
+
+            def __init__(self, file_path: str):
+                pass
+
+            def __enter__(self):
+                return self
+
+            def __exit__(self, *args):
+                pass
+
+            def parse(self, sheet_name: str, **kwargs) -> pd.DataFrame:
+                return sheets[sheet_name]
+
+        monkeypatch.setattr(file_extractor.pd, "ExcelFile", FakeExcelFile)
+
+        documents = list(FileExtractor.lazy_load_from_file("test.xls"))
+
+        assert [document.page_content for document in documents] == ["a\t1\n2.5", "b"]
+        assert [document.metadata["sheet"] for document in documents] == ["first", "second"]
+        assert documents[0].metadata == {"source": "test.xls", "sheet": "first", "start_row": 1, "end_row": 2}
@@ -0,0 +1,7 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+@Time    : 2024/12/25 14:02
+@Author  : thezehui@gmail.com
+@File    : __init__.py.py
+"""
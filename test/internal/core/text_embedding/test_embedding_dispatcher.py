@@ -0,0 +1,64 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+@Time    : 2024/12/25 18:05
+@Author  : thezehui@gmail.com
+@File    : test_embedding_dispatcher.py
+"""
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from internal.core.text_embedding import DynamicBatcher
+
+
+class FakeEncoder:
+    """将文本转换成 [文本长度, 文本数值] 向量的假编码函数，并记录每次批量调用的文本数"""
+
+    def __init__(self, fail: bool = False):
+        self.batch_sizes = []
+        self.fail = fail
+        self.lock = threading.Lock()
+
+    def __call__(self, texts: list[str]) -> list[list[float]]:
+        with self.lock:
+            self.batch_sizes.append(len(texts))
+        if self.fail:
+            raise RuntimeError("嵌入模型调用失败")
+        return [[float(len(text)), float(text)] for text in texts]
+
+
+class TestDynamicBatcher:
+    """动态批处理器的测试类"""
+
+    @pytest.mark.parametrize("max_batch_size, max_in_flight", [(4, 1), (16, 2), (1, 4)])
+    def test_results_keep_request_order(self, max_batch_size, max_in_flight):
+        """并发提交的请求被合并调用，每个请求拿到的结果与自己的输入顺序一致"""
+        encoder = FakeEncoder()
+        batcher = DynamicBatcher(encoder, max_batch_size, max_wait_ms=20, max_in_flight=max_in_flight)
+        requests = [[str(i * 10 + j) for j in range(i % 3 + 1)] for i in range(20)]
+
+        with ThreadPoolExecutor(max_workers=len(requests)) as executor:
+            results = list(executor.map(batcher.submit, requests))
+
+        assert results == [[[float(len(text)), float(text)] for text in texts] for texts in requests]
+        assert sum(encoder.batch_sizes) == sum(len(texts) for texts in requests)
+        assert max(encoder.batch_sizes) <= max_batch_size
+        if max_batch_size > 1:
+            assert len(encoder.batch_sizes) < len(requests)
+
+    def test_empty_request(self):
+        encoder = FakeEncoder()
+        assert DynamicBatcher(encoder, 4, max_wait_ms=1).submit([]) == []
+        assert encoder.batch_sizes == []
+
+    def test_exception_is_propagated(self):
+        """批量调用失败时同一批次的所有请求都会抛出异常，之后的请求仍可继续提交"""
+        encoder = FakeEncoder(fail=True)
+        batcher = DynamicBatcher(encoder, 4, max_wait_ms=1)
+        with pytest.raises(RuntimeError):
+            batcher.submit(["1"])
+
+        encoder.fail = False
+        assert batcher.submit(["12"]) == [[2.0, 12.0]]
@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+@Time    : 2024/12/25 14:05
+@Author  : thezehui@gmail.com
+@File    : test_vector_codec.py
+"""
+import hashlib
+import json
+import uuid
+
+import numpy as np
+import pytest
+from langchain_core.embeddings import Embeddings
+from langchain_core.stores import InMemoryByteStore
+
+from internal.core.text_embedding import CacheBackedEmbeddings, encode_vector, decode_vector
+
+
+class FakeEmbeddings(Embeddings):
+    """按文本长度生成向量的假文本嵌入模型，并记录每次调用的文本"""
+
+    def __init__(self):
+        self.calls = []
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        self.calls.append(texts)
+        return [[float(len(text)), 1.0, -0.5] for text in texts]
+
+    def embed_query(self, text: str) -> list[float]:
+        self.calls.append([text])
+        return [float(len(text)), 0.0, 0.5]
+
+
+class TestVectorCodec:
+    """向量编解码的测试类"""
+
+    @pytest.mark.parametrize(
+        "dtype, max_bytes, max_cosine_error",
+        [
+            ("float32", 1 + 1536 * 4, 1e-6),
+            ("float16", 1 + 1536 * 2, 1e-3),
+            ("int8", 1 + 4 + 1536, 1e-2),
+        ]
+    )
+    def test_encode_decode(self, dtype, max_bytes, max_cosine_error):
+        vectors = np.random.default_rng(0).normal(size=(20, 1536)).astype(np.float32)
+        for vector in vectors:
+            value = encode_vector(vector, dtype)
+            decoded = decode_vector(value)
+
+            cosine = float(np.dot(vector, decoded) / (np.linalg.norm(vector) * np.linalg.norm(decoded)))
+            assert len(value) == max_bytes
+            assert decoded.dtype == np.float32
+            assert 1 - cosine <= max_cosine_error
+
+    def test_decode_float32_without_copy(self):
+        value = encode_vector([0.1, 0.2, 0.3], "float32")
+        decoded = decode_vector(value)
+
+        assert not decoded.flags.writeable
+        assert decoded.base is not None
+        assert np.allclose(decoded, [0.1, 0.2, 0.3])
+
+    def test_encode_zero_vector_int8(self):
+        assert np.array_equal(decode_vector(encode_vector([0.0, 0.0], "int8")), [0.0, 0.0])
+
+    def test_decode_unknown_format(self):
+        with pytest.raises(ValueError):
+            decode_vector(b"\x09abcd")
+
+    def test_cache_backed_embeddings(self):
+        underlying = FakeEmbeddings()
+        embeddings = CacheBackedEmbeddings(underlying, InMemoryByteStore(), "test")
+
+        first = embeddings.embed_documents(["a", "bb", "a"])
+        second = embeddings.embed_documents(["bb", "ccc"])
+
+        # 相同文本只计算一次，已缓存的文本不再调用文本嵌入模型
+        assert underlying.calls == [["a", "bb"], ["ccc"]]
+        assert first == [[1.0, 1.0, -0.5], [2.0, 1.0, -0.5], [1.0, 1.0, -0.5]]
+        assert second == [[2.0, 1.0, -0.5], [3.0, 1.0, -0.5]]
+
+        # 文档向量与查询向量分别缓存，命中与未命中均返回list[float]
+        assert embeddings.embed_query("a") == [1.0, 0.0, 0.5]
+        assert embeddings.embed_query("a") == [1.0, 0.0, 0.5]
+        assert underlying.calls[-1] == ["a"] and len(underlying.calls) == 3
+
+    def test_cache_backed_embeddings_migrates_legacy_entries(self):
+        underlying = FakeEmbeddings()
+        store, legacy_store = InMemoryByteStore(), InMemoryByteStore()
+        legacy_key = "embeddings" + str(uuid.uuid5(uuid.UUID(int=1985), hashlib.sha1("a".encode()).hexdigest()))
+        legacy_store.mset([(legacy_key, json.dumps([0.5, 0.25, -1.0]).encode())])
+        embeddings = CacheBackedEmbeddings(
+            underlying, store, "test", legacy_store=legacy_store, legacy_namespace="embeddings",
+        )
+
+        # 旧版本JSON缓存命中的文本不再调用文本嵌入模型，迁移后旧的缓存键被删除
+        assert embeddings.embed_documents(["a", "bb"]) == [[0.5, 0.25, -1.0], [2.0, 1.0, -0.5]]
+        assert underlying.calls == [["bb"]]
+        assert legacy_store.mget([legacy_key]) == [None]
+        assert decode_vector(store.mget([embeddings._key("document", "a")])[0]).tolist() == [0.5, 0.25, -1.0]
+
+        # 再次读取直接命中新的缓存键
+        assert embeddings.embed_documents(["a"]) == [[0.5, 0.25, -1.0]]
+        assert underlying.calls == [["bb"]]
@@ -0,0 +1,149 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+@Time    : 2024/12/25 17:05
+@Author  : thezehui@gmail.com
+@File    : test_faiss_vector_backend.py
+"""
+import os
+from unittest.mock import MagicMock
+from uuid import uuid4
+
+import numpy as np
+import pytest
+from langchain_core.documents import Document as LCDocument
+from langchain_core.embeddings import Embeddings
+
+from internal.core.vector_database.faiss_vector_backend import FaissVectorBackend, PAYLOAD_FILE
+
+DIMENSION = 8
+
+
+class FakeEmbeddings(Embeddings):
+    """查询文本为整数时返回对应的单位向量"""
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        return [_vector(int(text)) for text in texts]
+
+    def embed_query(self, text: str) -> list[float]:
+        return _vector(int(text))
+
+
+def _vector(i: int) -> list[float]:
+    vector = np.full(DIMENSION, 0.01, dtype=np.float32)
+    vector[i % DIMENSION] = 1.0
+    return vector.tolist()
+
+
+def _documents(dataset_id: str, document_id: str, count: int, offset: int = 0) -> list[LCDocument]:
+    return [
+        LCDocument(page_content=str(offset + i), metadata={"dataset_id": dataset_id, "document_id": document_id})
+        for i in range(count)
+    ]
+
+
+@pytest.fixture
+def backend(tmp_path):
+    """构建使用临时目录及flat索引的faiss后端，redis只用于写入锁"""
+    return FaissVectorBackend(str(tmp_path), FakeEmbeddings(), MagicMock(), index_type="flat")
+
+
+def _insert(backend, documents: list[LCDocument]) -> list[str]:
+    ids = [str(uuid4()) for _ in documents]
+    errors = backend.insert_documents_with_vectors(
+        documents, [_vector(int(document.page_content)) for document in documents], ids,
+    )
+    assert errors == {}
+    return ids
+
+
+def _manifest(backend, dataset_id: str) -> dict:
+    with backend._read_shard(dataset_id) as (_, shard):
+        return shard.manifest
+
+
+class TestFaissVectorBackend:
+    """嵌入式faiss向量数据库后端的测试类"""
+
+    def test_insert_and_search(self, backend):
+        dataset_id, document_id = str(uuid4()), str(uuid4())
+        ids = _insert(backend, _documents(dataset_id, document_id, DIMENSION))
+
+        results = backend.similarity_search_with_relevance_scores("3", 2, [dataset_id])
+        assert results[0][0].metadata["node_id"] == ids[3]
+        assert results[0][0].metadata["text"] == "3"
+        assert results[0][1] == pytest.approx(1.0)
+        assert len(results) == 2
+        assert backend.similarity_search_with_relevance_scores("3", 2, [str(uuid4())]) == []
+
+    def test_segments_stay_logarithmic(self, backend):
+        """逐条写入时索引段逐级合并，数量保持在对数级"""
+        dataset_id, document_id = str(uuid4()), str(uuid4())
+        for i in range(64):
+            _insert(backend, _documents(dataset_id, document_id, 1, i))
+
+        manifest = _manifest(backend, dataset_id)
+        assert manifest["live_count"] == 64
+        assert sum(segment["ntotal"] for segment in manifest["segments"]) == 64
+        assert len(manifest["segments"]) <= 7
+        assert len([name for name in os.listdir(backend._get_shard_path(dataset_id)) if name.endswith(".faiss")]) == len(
+            manifest["segments"],
+        )
+
+    def test_update_and_delete(self, backend):
+        dataset_id, document_id, other_document_id = str(uuid4()), str(uuid4()), str(uuid4())
+        ids = _insert(backend, _documents(dataset_id, document_id, 3))
+        other_ids = _insert(backend, _documents(dataset_id, other_document_id, 2, 5))
+
+        # 1.更新节点后旧向量不再被检索到
+        backend.update_document(ids[0], "7", _vector(7))
+        results = backend.similarity_search_with_relevance_scores("7", 1, [dataset_id])
+        assert [(result.metadata["node_id"], result.page_content) for result, _ in results] == [(ids[0], "7")]
+        assert backend.get_vectors([ids[0]])[ids[0]] == pytest.approx(
+            FaissVectorBackend._normalize([_vector(7)])[0].tolist(),
+        )
+
+        # 2.删除节点及文档
+        backend.delete_documents([ids[1], str(uuid4())])
+        backend.delete_by_document(dataset_id, other_document_id)
+        results = backend.similarity_search_with_relevance_scores("1", 10, [dataset_id])
+        assert {result.metadata["node_id"] for result, _ in results} == {ids[0], ids[2]}
+        assert backend.get_vectors([ids[1], *other_ids]) == {}
+        assert _manifest(backend, dataset_id)["live_count"] == 2
+
+    def test_node_dataset_mapping_is_persisted(self, backend, tmp_path):
+        """节点所属知识库的映射存储在分片目录中，新建的后端实例同样可以按节点id读取及删除"""
+        dataset_id = str(uuid4())
+        ids = _insert(backend, _documents(dataset_id, str(uuid4()), 2))
+
+        other_backend = FaissVectorBackend(str(tmp_path), FakeEmbeddings(), MagicMock(), index_type="flat")
+        assert set(other_backend.get_vectors(ids).keys()) == set(ids)
+        other_backend.delete_documents([ids[0]])
+        assert set(backend.get_vectors(ids).keys()) == {ids[1]}
+
+    def test_delete_by_dataset(self, backend):
+        dataset_id = str(uuid4())
+        ids = _insert(backend, _documents(dataset_id, str(uuid4()), 2))
+
+        backend.delete_by_dataset(dataset_id)
+        assert not os.path.exists(os.path.join(backend._get_shard_path(dataset_id), PAYLOAD_FILE))
+        assert backend._group_by_dataset(ids) == {}
+        assert backend.similarity_search_with_relevance_scores("0", 2, [dataset_id]) == []
+
+    def test_failed_write_is_rolled_back(self, backend):
+        """写入失败时记录及索引段均不生效"""
+        dataset_id = str(uuid4())
+        _insert(backend, _documents(dataset_id, str(uuid4()), 2))
+
+        documents = _documents(dataset_id, str(uuid4()), 1, 3)
+        documents[0].metadata["node_id"] = str(uuid4())
+        with pytest.raises(RuntimeError):
+            with backend._write_shard(dataset_id) as writer:
+                writer.add(documents, FaissVectorBackend._normalize([_vector(3)]))
+                raise RuntimeError("写入失败")
+
+        manifest = _manifest(backend, dataset_id)
+        assert manifest["live_count"] == 2
+        assert len([name for name in os.listdir(backend._get_shard_path(dataset_id)) if name.endswith(".faiss")]) == len(
+            manifest["segments"],
+        )
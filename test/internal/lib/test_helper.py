@@ -0,0 +1,45 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+@Time    : 2024/12/25 18:22
+@Author  : thezehui@gmail.com
+@File    : test_helper.py
+"""
+import pytest
+from langchain_core.documents import Document
+
+from internal.lib.helper import reciprocal_rank_fusion
+
+
+def _documents(*segment_ids: str) -> list[Document]:
+    return [Document(page_content=f"content-{segment_id}", metadata={"segment_id": segment_id}) for segment_id in segment_ids]
+
+
+class TestReciprocalRankFusion:
+    """倒数排名融合的测试类"""
+
+    def test_fuse_and_deduplicate(self):
+        results = reciprocal_rank_fusion([_documents("a", "b", "c"), _documents("b", "d")], c=60)
+
+        assert [document.metadata["segment_id"] for document, _ in results] == ["b", "a", "d", "c"]
+        scores = dict((document.metadata["segment_id"], score) for document, score in results)
+        assert scores["b"] == pytest.approx(0.5 / 62 + 0.5 / 61)
+        assert scores["a"] == pytest.approx(0.5 / 61)
+        assert scores["c"] == pytest.approx(0.5 / 63)
+
+    def test_weights(self):
+        """权重更高的列表中排名靠前的文档得分更高"""
+        ranked_lists = [_documents("a", "b"), _documents("b", "a")]
+        assert reciprocal_rank_fusion(ranked_lists, weights=[0.9, 0.1])[0][0].metadata["segment_id"] == "a"
+        assert reciprocal_rank_fusion(ranked_lists, weights=[0.1, 0.9])[0][0].metadata["segment_id"] == "b"
+
+    def test_keeps_first_document(self):
+        """同一片段保留首次出现的文档对象"""
+        first, second = _documents("a"), _documents("a")
+        results = reciprocal_rank_fusion([first, second])
+        assert len(results) == 1
+        assert results[0][0] is first[0]
+
+    @pytest.mark.parametrize("ranked_lists", [[[]], [[], []]])
+    def test_empty(self, ranked_lists):
+        assert reciprocal_rank_fusion(ranked_lists) == []
@@ -0,0 +1,7 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+@Time    : 2024/12/25 17:40
+@Author  : thezehui@gmail.com
+@File    : __init__.py.py
+"""
@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+@Time    : 2024/12/25 17:42
+@Author  : thezehui@gmail.com
+@File    : test_keyword_index_migration.py
+"""
+import importlib.util
+import os
+
+import pytest
+from alembic.migration import MigrationContext
+from alembic.operations import Operations
+from sqlalchemy import text
+
+MIGRATION_PATH = os.path.join(
+    os.path.dirname(__file__), "..", "..", "..", "internal", "migration", "versions", "3f8e2a61c9d4_.py",
+)
+
+
+def _load_migration():
+    """加载关键词倒排索引表的迁移脚本"""
+    spec = importlib.util.spec_from_file_location("keyword_index_migration", MIGRATION_PATH)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def _postings(connection) -> set[tuple[str, str, str]]:
+    """读取关键词倒排索引表中仍然存在对应片段的 (知识库id, 关键词, 片段id)"""
+    return {
+        (str(dataset_id), keyword, str(segment_id))
+        for dataset_id, keyword, segment_id in connection.execute(text("""
+            SELECT ki.dataset_id, ki.keyword, ki.segment_id
+            FROM keyword_index AS ki
+            JOIN segment AS s ON s.id = ki.segment_id AND s.dataset_id = ki.dataset_id
+        """))
+    }
+
+
+class TestKeywordIndexMigration:
+    """关键词倒排索引表迁移脚本的测试类，迁移在测试事务中执行，结束后整体回滚"""
+
+    def test_downgrade_upgrade_round_trip(self, db):
+        connection = db.session.connection()
+        segment = connection.execute(text("SELECT id, dataset_id FROM segment LIMIT 1")).first()
+        if segment is None:
+            pytest.skip("数据库中没有文档片段")
+
+        # 1.写入一条测试倒排项，并记录迁移前的倒排项
+        connection.execute(text("""
+            INSERT INTO keyword_index (dataset_id, keyword, segment_id)
+            VALUES (:dataset_id, '__round_trip__', :segment_id)
+            ON CONFLICT ON CONSTRAINT uk_keyword_index_dataset_id_keyword_segment_id DO NOTHING
+        """), {"dataset_id": segment.dataset_id, "segment_id": segment.id})
+        expected = _postings(connection)
+        dataset_count = connection.execute(text("SELECT COUNT(DISTINCT dataset_id) FROM keyword_index")).scalar()
+
+        # 2.回退到JSONB关键词表后再升级回倒排索引表
+        migration = _load_migration()
+        with Operations.context(MigrationContext.configure(connection)):
+            migration.downgrade()
+            keyword_table_count = connection.execute(text("SELECT COUNT(*) FROM keyword_table")).scalar()
+            migration.upgrade()
+
+        # 3.倒排项在往返迁移后保持一致
+        assert keyword_table_count == dataset_count
+        assert _postings(connection) == expected
+        assert (str(segment.dataset_id), "__round_trip__", str(segment.id)) in expected
@@ -0,0 +1,192 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+@Time    : 2024/12/26 14:10
+@Author  : thezehui@gmail.com
+@File    : test_dataset_exclusion_service.py
+"""
+from contextlib import nullcontext
+from unittest.mock import MagicMock
+
+import pytest
+from langchain_core.documents import Document as LCDocument
+
+from internal.entity.cache_entity import (
+    DATASET_EXCLUDED_DOCUMENTS,
+    DATASET_EXCLUDED_SEGMENTS,
+    DATASET_EXCLUSION_VERSION,
+)
+from internal.service.dataset_exclusion_service import DatasetExclusionService
+
+
+class FakePipeline:
+    """记录命令并在execute时按顺序执行的假redis管道"""
+
+    def __init__(self, redis_client: "FakeRedis"):
+        self.redis_client = redis_client
+        self.commands = []
+
+    def __getattr__(self, name: str):
+        def command(*args, **kwargs):
+            self.commands.append((name, args, kwargs))
+            return self
+
+        return command
+
+    def execute(self) -> list:
+        results = [getattr(self.redis_client, name)(*args, **kwargs) for name, args, kwargs in self.commands]
+        self.commands = []
+        return results
+
+
+class FakeRedis:
+    """只实现排除服务用到的命令的内存假redis"""
+
+    def __init__(self):
+        self.data = {}
+
+    def pipeline(self, transaction: bool = True) -> FakePipeline:
+        return FakePipeline(self)
+
+    def lock(self, name: str, timeout: int = None):
+        return nullcontext()
+
+    def exists(self, *keys: str) -> int:
+        return sum(key in self.data for key in keys)
+
+    def get(self, key: str):
+        return self.data.get(key)
+
+    def set(self, key: str, value) -> bool:
+        self.data[key] = str(value).encode()
+        return True
+
+    def incr(self, key: str) -> int:
+        value = int(self.data.get(key, 0)) + 1
+        self.data[key] = str(value).encode()
+        return value
+
+    def delete(self, *keys: str) -> int:
+        return sum(self.data.pop(key, None) is not None for key in keys)
+
+    def sadd(self, key: str, *values: str) -> int:
+        members = self.data.setdefault(key, set())
+        added = set(values) - members
+        members.update(added)
+        return len(added)
+
+    def srem(self, key: str, *values: str) -> int:
+        members = self.data.get(key, set())
+        removed = members & set(values)
+        members.difference_update(removed)
+        return len(removed)
+
+    def smismember(self, key: str, values: list[str]) -> list[int]:
+        members = self.data.get(key, set())
+        return [int(value in members) for value in values]
+
+
+@pytest.fixture
+def dataset_exclusion_service():
+    """构建使用假redis的检索排除服务，知识库的排除集合默认已构建"""
+    redis_client = FakeRedis()
+    for dataset_id in ["d1", "d2"]:
+        redis_client.set(DATASET_EXCLUSION_VERSION.format(dataset_id=dataset_id), 1)
+    return DatasetExclusionService(db=MagicMock(), redis_client=redis_client, retrieval_cache_service=MagicMock())
+
+
+def _document(dataset_id: str, document_id: str, segment_id: str) -> LCDocument:
+    return LCDocument(
+        page_content=segment_id,
+        metadata={"dataset_id": dataset_id, "document_id": document_id, "segment_id": segment_id},
+    )
+
+
+class TestDatasetExclusionService:
+    """检索排除服务的测试类"""
+
+    def test_filter_documents(self, dataset_exclusion_service):
+        """已禁用文档下的片段及已禁用的片段被过滤，剩余片段保持原有顺序"""
+        dataset_exclusion_service.disable_documents("d1", ["doc2"])
+        dataset_exclusion_service.disable_segments("d2", ["s4"])
+        lc_documents = [
+            _document("d1", "doc1", "s1"),
+            _document("d2", "doc3", "s4"),
+            _document("d1", "doc2", "s2"),
+            _document("d2", "doc3", "s5"),
+            _document("d1", "doc1", "s3"),
+        ]
+
+        filtered = dataset_exclusion_service.filter_documents(lc_documents)
+
+        assert [lc_document.metadata["segment_id"] for lc_document in filtered] == ["s1", "s5", "s3"]
+
+    def test_filter_documents_scoped_by_dataset(self, dataset_exclusion_service):
+        """排除集合按知识库隔离，其他知识库中相同id的数据不受影响"""
+        dataset_exclusion_service.disable_segments("d1", ["s1"])
+
+        filtered = dataset_exclusion_service.filter_documents([
+            _document("d1", "doc1", "s1"),
+            _document("d2", "doc1", "s1"),
+        ])
+
+        assert [lc_document.metadata["dataset_id"] for lc_document in filtered] == ["d2"]
+
+    def test_search_with_exclusion_widens_fetch(self, dataset_exclusion_service, monkeypatch):
+        """过滤后数量不足k时扩大召回数量重试，返回前k条未被排除的数据"""
+        monkeypatch.setenv("RETRIEVAL_OVER_FETCH_FACTOR", "2")
+        dataset_exclusion_service.disable_segments("d1", ["s0", "s1", "s2"])
+        fetch_ks = []
+
+        def search(fetch_k: int) -> list[LCDocument]:
+            fetch_ks.append(fetch_k)
+            return [_document("d1", "doc1", f"s{i}") for i in range(fetch_k)]
+
+        lc_documents = dataset_exclusion_service.search_with_exclusion(search, 2)
+
+        assert fetch_ks == [4, 8]
+        assert [lc_document.metadata["segment_id"] for lc_document in lc_documents] == ["s3", "s4"]
+
+    def test_search_with_exclusion_stops_when_exhausted(self, dataset_exclusion_service, monkeypatch):
+        """召回数量少于请求数量表示已没有更多数据，不再扩大召回数量"""
+        monkeypatch.setenv("RETRIEVAL_OVER_FETCH_FACTOR", "2")
+        dataset_exclusion_service.disable_segments("d1", ["s0"])
+        search = MagicMock(return_value=[_document("d1", "doc1", "s0"), _document("d1", "doc1", "s1")])
+
+        lc_documents = dataset_exclusion_service.search_with_exclusion(search, 2)
+
+        search.assert_called_once_with(4)
+        assert [lc_document.metadata["segment_id"] for lc_document in lc_documents] == ["s1"]
+
+    def test_rebuild_when_version_missing(self, dataset_exclusion_service):
+        """版本号不存在(例如缓存被清除)时从数据库重建排除集合"""
+        redis_client = dataset_exclusion_service.redis_client
+        redis_client.delete(DATASET_EXCLUSION_VERSION.format(dataset_id="d1"))
+        redis_client.sadd(DATASET_EXCLUDED_SEGMENTS.format(dataset_id="d1"), "stale")
+        query = dataset_exclusion_service.db.session.query.return_value.with_entities.return_value.filter.return_value
+        query.all.side_effect = [[("doc2",)], [("s1",), ("s2",)]]
+
+        assert dataset_exclusion_service.get_version("d1") == 1
+        assert redis_client.data[DATASET_EXCLUDED_DOCUMENTS.format(dataset_id="d1")] == {"doc2"}
+        assert redis_client.data[DATASET_EXCLUDED_SEGMENTS.format(dataset_id="d1")] == {"s1", "s2"}
+
+        # 已构建的知识库不会再次查询数据库
+        assert dataset_exclusion_service.get_version("d1") == 1
+        assert query.all.call_count == 2
+
+    def test_update_bumps_versions_only_on_change(self, dataset_exclusion_service):
+        """只有排除集合实际发生变化时才递增版本号并使检索结果缓存失效"""
+        retrieval_cache_service = dataset_exclusion_service.retrieval_cache_service
+
+        dataset_exclusion_service.disable_segments("d1", ["s1"])
+        dataset_exclusion_service.disable_segments("d1", ["s1"])
+        dataset_exclusion_service.enable_segments("d1", ["s2"])
+        dataset_exclusion_service.enable_documents("d1", [])
+
+        assert dataset_exclusion_service.get_version("d1") == 2
+        assert retrieval_cache_service.bump_versions.call_count == 1
+
+        dataset_exclusion_service.enable_segments("d1", ["s1"])
+
+        assert dataset_exclusion_service.get_version("d1") == 3
+        assert retrieval_cache_service.bump_versions.call_count == 2
@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+@Time    : 2024/12/25 10:05
+@Author  : thezehui@gmail.com
+@File    : test_indexing_service.py
+"""
+from dataclasses import fields
+from datetime import datetime
+from types import SimpleNamespace
+from unittest.mock import MagicMock
+
+import pytest
+from langchain_core.documents import Document as LCDocument
+
+from internal.service.indexing_service import IndexingService
+
+
+@pytest.fixture
+def indexing_service():
+    """构建依赖全部替换为MagicMock的索引构建服务，token数按文本长度计算"""
+    service = IndexingService(**{field.name: MagicMock() for field in fields(IndexingService)})
+    service.tokenizer_service.count_tokens.side_effect = lambda texts: [len(text) for text in texts]
+    return service
+
+
+class TestIndexingService:
+    """索引构建服务的测试类"""
+
+    @pytest.mark.parametrize(
+        "lengths, max_tokens, max_batch_size, expected",
+        [
+            ([], 10, 100, []),
+            ([3, 3, 3, 3], 10, 100, [[3, 3, 3], [3]]),
+            ([4, 4, 4, 4, 4], 100, 2, [[4, 4], [4, 4], [4]]),
+            ([2, 20, 2], 10, 100, [[2], [20], [2]]),
+            ([5, 5, 10], 10, 100, [[5, 5], [10]]),
+        ]
+    )
+    def test_build_embedding_batches(self, lengths, max_tokens, max_batch_size, expected, indexing_service, monkeypatch):
+        monkeypatch.setenv("INDEXING_BATCH_MAX_TOKENS", str(max_tokens))
+        monkeypatch.setenv("INDEXING_BATCH_MAX_SIZE", str(max_batch_size))
+        lc_segments = [LCDocument(page_content="a" * length, metadata={"index": i}) for i, length in enumerate(lengths)]
+
+        batches = indexing_service._build_embedding_batches(lc_segments)
+
+        assert [[len(lc_segment.page_content) for lc_segment in batch] for batch in batches] == expected
+        assert [lc_segment.metadata["index"] for batch in batches for lc_segment in batch] == list(range(len(lengths)))
+
+    @pytest.mark.parametrize(
+        "completed_at, enabled, expected_enabled",
+        [
+            (None, False, True),
+            (datetime(2024, 12, 1), True, True),
+            (datetime(2024, 12, 1), False, False),
+        ]
+    )
+    def test_completed_keeps_enabled(self, completed_at, enabled, expected_enabled, indexing_service):
+        document = SimpleNamespace(
+            id="document_id",
+            dataset_id="dataset_id",
+            account_id="account_id",
+            status="indexing",
+            completed_at=completed_at,
+            enabled=enabled,
+        )
+
+        indexing_service._completed(document, [])
+
+        assert document.status == "completed"
+        assert document.enabled is expected_enabled
+        if expected_enabled:
+            indexing_service.dataset_exclusion_service.enable_documents.assert_called_once_with("dataset_id", ["document_id"])
+        else:
+            indexing_service.dataset_exclusion_service.enable_documents.assert_not_called()
+
+    @pytest.mark.parametrize(
+        "old_hashes, new_hashes, expected",
+        [
+            ([], ["a", "b"], {}),
+            (["a", "b"], [], {}),
+            (["a", "b", "c"], ["a", "b", "c"], {0: 0, 1: 1, 2: 2}),
+            (["a", "b", "c"], ["a", "x", "b", "c"], {0: 0, 2: 1, 3: 2}),
+            (["a", "b", "c"], ["a", "c"], {0: 0, 1: 2}),
+            (["a", "b", "c"], ["a", "y", "c"], {0: 0, 2: 2}),
+            (["a", "a", "b"], ["a", "b", "a"], {0: 1, 1: 2}),
+        ]
+    )
+    def test_match_segments(self, old_hashes, new_hashes, expected):
+        assert IndexingService._match_segments(old_hashes, new_hashes) == expected
@@ -0,0 +1,50 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+@Time    : 2024/12/25 15:20
+@Author  : thezehui@gmail.com
+@File    : test_retrieval_accounting_service.py
+"""
+from dataclasses import fields
+from unittest.mock import MagicMock, call
+from uuid import uuid4
+
+import pytest
+
+from internal.entity.cache_entity import RETRIEVAL_HIT_COUNT_FLUSHING
+from internal.service.retrieval_accounting_service import RetrievalAccountingService
+
+
+@pytest.fixture
+def retrieval_accounting_service():
+    """构建依赖全部替换为MagicMock的检索统计服务"""
+    return RetrievalAccountingService(**{field.name: MagicMock() for field in fields(RetrievalAccountingService)})
+
+
+class TestRetrievalAccountingService:
+    """检索统计服务的测试类"""
+
+    def test_batch_id(self):
+        batch_id = RetrievalAccountingService._batch_id("flush", ["a:1", "b:2"])
+        assert batch_id.startswith("flush:")
+        assert batch_id == RetrievalAccountingService._batch_id("flush", ["a:1", "b:2"])
+        assert batch_id != RetrievalAccountingService._batch_id("flush", ["a:1", "b:3"])
+        assert batch_id != RetrievalAccountingService._batch_id("other", ["a:1", "b:2"])
+
+    def test_flush_hit_counts_skips_flushed_batch(self, retrieval_accounting_service):
+        """异常退出前已提交的批次只从处理中键删除，不会重复累加命中次数"""
+        segment_ids = sorted(str(uuid4()) for _ in range(3))
+        retrieval_accounting_service._take = MagicMock(return_value="flush")
+        retrieval_accounting_service._finish = MagicMock()
+        retrieval_accounting_service._mark_flushed = MagicMock(side_effect=[False, True])
+        retrieval_accounting_service.redis_client.hgetall.return_value = {
+            segment_id.encode(): b"1" for segment_id in segment_ids
+        }
+
+        assert retrieval_accounting_service._flush_hit_counts(2) == 3
+        assert retrieval_accounting_service.db.session.execute.call_count == 1
+        assert retrieval_accounting_service.redis_client.hdel.call_args_list == [
+            call(RETRIEVAL_HIT_COUNT_FLUSHING, *segment_ids[:2]),
+            call(RETRIEVAL_HIT_COUNT_FLUSHING, *segment_ids[2:]),
+        ]
+        retrieval_accounting_service._finish.assert_called_once_with(RETRIEVAL_HIT_COUNT_FLUSHING, "flush")
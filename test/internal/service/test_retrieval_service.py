@@ -0,0 +1,63 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+@Time    : 2024/12/26 10:30
+@Author  : thezehui@gmail.com
+@File    : test_retrieval_service.py
+"""
+from dataclasses import fields
+from unittest.mock import MagicMock
+
+import pytest
+from flask import Flask
+from langchain_core.documents import Document as LCDocument
+
+from internal.service.retrieval_service import RetrievalService
+
+
+@pytest.fixture
+def retrieval_service():
+    """构建依赖全部替换为MagicMock的检索服务"""
+    return RetrievalService(**{field.name: MagicMock() for field in fields(RetrievalService)})
+
+
+def _documents(segment_ids: list[str]) -> list[LCDocument]:
+    return [LCDocument(page_content=segment_id, metadata={"segment_id": segment_id}) for segment_id in segment_ids]
+
+
+class TestRetrievalService:
+    """检索服务的测试类"""
+
+    @pytest.mark.parametrize("query_count", [1, 2, 4])
+    def test_multi_query_search_scores_within_one(self, query_count, retrieval_service):
+        """多条查询融合后的得分不超过1，所有查询都排在第一位的片段得分为1"""
+        retrieval_service._cached_search = MagicMock(side_effect=lambda *args: _documents(["a", "b", "c"]))
+
+        with Flask(__name__).app_context():
+            lc_documents = retrieval_service._multi_query_search(
+                [], [f"query{i}" for i in range(query_count)], "semantic", 3, 0.5,
+            )
+
+        scores = [lc_document.metadata["score"] for lc_document in lc_documents]
+        assert [lc_document.metadata["segment_id"] for lc_document in lc_documents] == ["a", "b", "c"]
+        assert scores[0] == pytest.approx(1.0)
+        assert all(0 < score <= 1 for score in scores)
+        assert scores == sorted(scores, reverse=True)
+
+    def test_multi_query_search_partial_overlap(self, retrieval_service):
+        """只在部分查询中排第一的片段得分低于1，仍然不超过1"""
+        ranked_lists = {
+            "q0": _documents(["a", "b"]),
+            "q1": _documents(["b", "c"]),
+            "q2": _documents(["b"]),
+            "q3": _documents(["d"]),
+        }
+        retrieval_service._cached_search = MagicMock(side_effect=lambda dataset_ids, query, *args: ranked_lists[query])
+
+        with Flask(__name__).app_context():
+            lc_documents = retrieval_service._multi_query_search([], list(ranked_lists.keys()), "semantic", 4, 0.5)
+
+        scores = {lc_document.metadata["segment_id"]: lc_document.metadata["score"] for lc_document in lc_documents}
+        assert lc_documents[0].metadata["segment_id"] == "b"
+        assert scores["b"] == pytest.approx((1 / 62 + 2 / 61) * 61 / 4)
+        assert all(0 < score < 1 for score in scores.values())
@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+@Time    : 2024/12/25 11:20
+@Author  : thezehui@gmail.com
+@File    : test_segment_service.py
+"""
+from dataclasses import fields
+from types import SimpleNamespace
+from unittest.mock import MagicMock
+from uuid import uuid4
+
+import pytest
+
+from internal.entity.dataset_entity import SegmentStatus
+from internal.exception import FailException, NotFoundException
+from internal.service.segment_service import SegmentService
+
+
+@pytest.fixture
+def segment_service():
+    """构建依赖全部替换为MagicMock的片段服务"""
+    return SegmentService(**{field.name: MagicMock() for field in fields(SegmentService)})
+
+
+def _mock_segments(segment_service, segments):
+    """设置片段查询返回的片段列表"""
+    segment_service.db.session.query.return_value.filter.return_value.all.return_value = segments
+
+
+class TestSegmentService:
+    """片段服务的测试类"""
+
+    def test_update_segments_enabled(self, segment_service):
+        segments = [
+            SimpleNamespace(id=uuid4(), status=SegmentStatus.COMPLETED, enabled=True),
+            SimpleNamespace(id=uuid4(), status=SegmentStatus.COMPLETED, enabled=False),
+            SimpleNamespace(id=uuid4(), status=SegmentStatus.COMPLETED, enabled=True),
+        ]
+        _mock_segments(segment_service, segments)
+
+        changed = segment_service.update_segments_enabled(
+            "dataset_id", "document_id", [segment.id for segment in segments], False, SimpleNamespace(id="account_id"),
+        )
+
+        # 启用状态未变化的片段被忽略，变化的片段使用一条语句及一条集合命令批量更新
+        assert [segment.id for segment in changed] == [segments[0].id, segments[2].id]
+        segment_service.db.session.query.return_value.filter.return_value.update.assert_called_once()
+        segment_service.dataset_exclusion_service.disable_segments.assert_called_once_with(
+            "dataset_id", [segments[0].id, segments[2].id],
+        )
+        segment_service.dataset_exclusion_service.enable_segments.assert_not_called()
+
+    def test_update_segments_enabled_without_changes(self, segment_service):
+        segments = [SimpleNamespace(id=uuid4(), status=SegmentStatus.COMPLETED, enabled=True)]
+        _mock_segments(segment_service, segments)
+
+        changed = segment_service.update_segments_enabled(
+            "dataset_id", "document_id", [segments[0].id], True, SimpleNamespace(id="account_id"),
+        )
+
+        assert changed == []
+        segment_service.db.session.query.return_value.filter.return_value.update.assert_not_called()
+        segment_service.dataset_exclusion_service.enable_segments.assert_not_called()
+
+    @pytest.mark.parametrize(
+        "found, status, exception",
+        [
+            (False, SegmentStatus.COMPLETED, NotFoundException),
+            (True, SegmentStatus.INDEXING, FailException),
+        ]
+    )
+    def test_update_segments_enabled_invalid(self, found, status, exception, segment_service):
+        segment_ids = [uuid4(), uuid4()]
+        segments = [SimpleNamespace(id=segment_id, status=status, enabled=True) for segment_id in segment_ids]
+        _mock_segments(segment_service, segments if found else segments[:1])
+
+        with pytest.raises(exception):
+            segment_service.update_segments_enabled(
+                "dataset_id", "document_id", segment_ids, False, SimpleNamespace(id="account_id"),
+            )
+
+    @pytest.mark.parametrize("vector_delete_failed", [False, True])
+    def test_delete_segment_keeps_exclusion_until_vector_deleted(self, vector_delete_failed, segment_service):
+        """片段在删除向量前加入排除集合，只有向量删除成功后才清除，删除失败时残留的向量不会被召回"""
+        segment = SimpleNamespace(
+            id=uuid4(), node_id=uuid4(), account_id="account_id", dataset_id="dataset_id",
+            document_id="document_id", status=SegmentStatus.COMPLETED, document=SimpleNamespace(id="document_id"),
+        )
+        segment_service.get = MagicMock(return_value=segment)
+        segment_service.delete = MagicMock()
+        segment_service.update = MagicMock()
+        segment_service.db.session.query.return_value.filter.return_value.first.return_value = (0, 0)
+        if vector_delete_failed:
+            segment_service.vector_database_service.delete_documents.side_effect = RuntimeError("timeout")
+
+        segment_service.delete_segment("dataset_id", "document_id", segment.id, SimpleNamespace(id="account_id"))
+
+        exclusion_service = segment_service.dataset_exclusion_service
+        exclusion_service.disable_segments.assert_called_once_with("dataset_id", [segment.id])
+        if vector_delete_failed:
+            exclusion_service.remove.assert_not_called()
+        else:
+            exclusion_service.remove.assert_called_once_with("dataset_id", [], [segment.id])
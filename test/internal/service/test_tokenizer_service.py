@@ -0,0 +1,61 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+@Time    : 2024/12/25 17:55
+@Author  : thezehui@gmail.com
+@File    : test_tokenizer_service.py
+"""
+import pytest
+from langchain_core.messages import AIMessage, HumanMessage
+
+from internal.service import tokenizer_service
+from internal.service.tokenizer_service import TokenizerService
+
+
+class FakeEncoding:
+    """按空格切分的假编码器，并记录每次批量编码的文本"""
+
+    def __init__(self):
+        self.calls = []
+
+    def encode_ordinary_batch(self, texts: list[str]) -> list[list[str]]:
+        self.calls.append(texts)
+        return [text.split() for text in texts]
+
+
+@pytest.fixture
+def encoding(monkeypatch):
+    """替换编码器并清空进程内的token数缓存"""
+    encoding = FakeEncoding()
+    monkeypatch.setattr(tokenizer_service, "_get_encoding", lambda: encoding)
+    monkeypatch.setattr(tokenizer_service, "_token_count_cache", type(tokenizer_service._token_count_cache)())
+    return encoding
+
+
+class TestTokenizerService:
+    """分词器服务的测试类"""
+
+    def test_count_tokens(self, encoding):
+        assert TokenizerService.count_tokens(["a b", "c", "a b", ""]) == [2, 1, 2, 0]
+        assert encoding.calls == [["a b", "c", ""]]
+
+        # 已计算过的文本直接命中缓存
+        assert TokenizerService.count_tokens(["c", "d e f", "a b"]) == [1, 3, 2]
+        assert encoding.calls[1:] == [["d e f"]]
+        assert TokenizerService.count_token("a b") == 2
+        assert len(encoding.calls) == 2
+
+    def test_cache_eviction(self, encoding, monkeypatch):
+        monkeypatch.setenv("TOKENIZER_CACHE_SIZE", "2")
+        TokenizerService.count_tokens(["a", "b"])
+        TokenizerService.count_tokens(["a"])
+        TokenizerService.count_tokens(["c"])
+
+        # 最久未使用的b被淘汰，a仍在缓存中
+        assert len(tokenizer_service._token_count_cache) == 2
+        TokenizerService.count_tokens(["a", "b"])
+        assert encoding.calls[-1] == ["b"]
+
+    def test_count_messages_tokens(self, encoding):
+        messages = [HumanMessage(content="你好 世界"), AIMessage(content="你好")]
+        assert TokenizerService.count_messages_tokens(messages) == 5